@@ -33,6 +33,10 @@ gpx_mode=OVERWRITE
 
 if [ $fit_file = 'none' ]; then
     gopro-dashboard.py --include date_and_time big_speed map moving_journey_map --layout xml --layout-xml ./layouts/my-layout.xml --units-speed kph --units-distance km $infile $outfile
+elif [ "${DASHBOARD:-gopro}" = 'native' ]; then
+    ## every value comes from the fit file as with --gpx-merge OVERWRITE, the gopro telemetry(GPMF) of the clip
+    ## is not read, so EXTEND is not there
+    ./gpx_video/dashboard.py --layout-xml ./layouts/my-layout.xml --units-speed kph --units-distance km -t $fit_file $infile $outfile
 else
     gopro-dashboard.py --layout xml --layout-xml ./layouts/my-layout.xml --units-speed kph --units-distance km --gpx-merge $gpx_mode --fit $fit_file $infile $outfile
 fi
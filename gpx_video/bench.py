@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## benchmark the rendering pipeline with a synthetic track and local map tiles,
+## no network(tiles, timezone) is touched. eg:
+##   ./bench.py --points 3600 --shape loop --format fit --null-sink
+##   ./bench.py --points 7200 --stops 2 -s 1920 1080 --out bench.json
+
+import sys
+import os
+
+import io
+import math
+import json
+import shutil
+import argparse
+import resource
+import tempfile
+import zlib
+import functools
+
+import subprocess
+
+from datetime import datetime, timedelta, timezone
+
+import geotiler
+
+from PIL import Image, ImageDraw
+
+import util
+import perf
+import encoder
+import loading
+import pipeline
+import zoomplan
+import gpx_to_route
+
+
+# somewhere around Tianjin, where most of the rides are
+ORIGIN = (117.19064, 39.10304)
+
+SHAPES = ('line', 'loop', 'zigzag')
+
+
+def synthetic_track(num_point, shape='loop', speed=6.0, stops=0, stop_in_sec=600, origin=ORIGIN):
+    """ yield (seconds since start, lon, lat, speed) of a ride at 1Hz """
+    meter_per_deg_lat = 111320.0
+    meter_per_deg_lon = meter_per_deg_lat * math.cos(math.radians(origin[1]))
+
+    stop_at = set(int(num_point * (i + 1) / (stops + 1)) for i in range(stops))
+
+    t, d = 0, 0.0
+    for i in range(num_point):
+        if shape == 'line':
+            x, y = d, 0.0
+        elif shape == 'zigzag':
+            leg = 2000.0
+            n, r = divmod(d, leg)
+            x, y = n * leg / 2, r if n % 2 == 0 else leg - r
+        else:
+            r = speed * num_point / (2 * math.pi)
+            a = d / r
+            x, y = r * math.sin(a), r * (1 - math.cos(a))
+
+        yield t, origin[0] + x / meter_per_deg_lon, origin[1] + y / meter_per_deg_lat, speed
+
+        if i in stop_at:
+            for _ in range(stop_in_sec):
+                t += 1
+                yield t, origin[0] + x / meter_per_deg_lon, origin[1] + y / meter_per_deg_lat, 0.0
+
+        t += 1
+        d += speed
+
+
+def write_gpx(filename, points, start_time):
+    import gpxpy.gpx
+
+    gpx = gpxpy.gpx.GPX()
+    track = gpxpy.gpx.GPXTrack()
+    segment = gpxpy.gpx.GPXTrackSegment()
+    gpx.tracks.append(track)
+    track.segments.append(segment)
+
+    for t, lon, lat, _ in points:
+        segment.points.append(gpxpy.gpx.GPXTrackPoint(lat, lon, elevation=10.0, time=start_time + timedelta(seconds=t)))
+
+    with open(filename, 'w') as f:
+        f.write(gpx.to_xml())
+
+
+def write_fit(filename, points, start_time):
+    from fit_tool.fit_file_builder import FitFileBuilder
+    from fit_tool.profile.messages.file_id_message import FileIdMessage
+    from fit_tool.profile.messages.record_message import RecordMessage
+    from fit_tool.profile.messages.session_message import SessionMessage
+    from fit_tool.profile.profile_type import FileType, Manufacturer
+
+    start_ms = int(start_time.timestamp()) * 1000
+
+    builder = FitFileBuilder(auto_define=True)
+
+    message = FileIdMessage()
+    message.type = FileType.ACTIVITY
+    message.manufacturer = Manufacturer.DEVELOPMENT.value
+    message.product = 0
+    message.time_created = start_ms
+    message.serial_number = 0x12345678
+    builder.add(message)
+
+    distance, moving, t = 0.0, 0, 0
+    records = []
+    for t, lon, lat, speed in points:
+        distance += speed
+        if speed > 0: moving += 1
+
+        message = RecordMessage()
+        message.timestamp = start_ms + t * 1000
+        message.position_long = lon
+        message.position_lat = lat
+        message.altitude = 10.0
+        message.speed = speed
+        message.distance = distance
+        message.cadence = 80 if speed > 0 else 0
+        records.append(message)
+    builder.add_all(records)
+
+    message = SessionMessage()
+    message.timestamp = start_ms + t * 1000
+    message.start_time = start_ms
+    message.total_elapsed_time = t
+    message.total_timer_time = t
+    message.total_moving_time = moving
+    message.total_distance = distance
+    message.total_ascent = 0
+    message.max_speed = max(p[3] for p in points)
+    message.avg_speed = distance / max(1, moving)
+    builder.add(message)
+
+    builder.build().to_file(filename)
+
+
+def make_track_file(outdir, num_point, shape, fmt, stops, start_time):
+    points = list(synthetic_track(num_point, shape, stops=stops))
+
+    filename = os.path.join(outdir, 'synthetic-%s-%d.%s' % (shape, num_point, fmt))
+    if fmt == 'gpx': write_gpx(filename, points, start_time)
+    else: write_fit(filename, points, start_time)
+
+    return filename
+
+
+def stub_provider(tile_size=256):
+    return geotiler.provider.MapProvider({
+        'name': 'Stub', 'url': 'stub://{z}/{x}/{y}.{ext}', 'extension': 'png', 'limit': 8,
+        'tile-width': tile_size, 'tile-height': tile_size,
+    })
+
+
+@functools.lru_cache(maxsize=None)
+def stub_tile(url, tile_size=256):
+    """ a cheap, but not blank, tile: a tinted square with the grid lines """
+    h = zlib.crc32(url.encode())
+    im = Image.new('RGB', (tile_size, tile_size), (200 + h % 40, 210 + (h >> 8) % 40, 190 + (h >> 16) % 40))
+    draw = ImageDraw.Draw(im)
+    draw.rectangle((0, 0, tile_size-1, tile_size-1), outline=(160, 160, 160))
+    draw.line((0, tile_size//2, tile_size, tile_size//2), fill=(255, 255, 255), width=3)
+
+    f = io.BytesIO()
+    im.save(f, format='PNG')
+
+    return f.getvalue()
+
+
+async def stub_downloader(tiles, num_workers, **kw):
+    for t in tiles:
+        yield t._replace(img=stub_tile(t.url), error=None)
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is KB on linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def make_clip(outfile, window_size, fps, time_in_sec=2):
+    width, height = window_size
+    cmd_string = [
+        'ffmpeg',
+        '-y', '-hide_banner', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc=size={width}x{height}:rate={fps}',
+        '-t', str(time_in_sec)
+    ]
+    cmd_string.extend(encoder.video_args(encoder.get_profile('preview')))
+    cmd_string.append(outfile)
+    subprocess.run(cmd_string, check=True)
+
+
+STAGES = ('load', 'resample', 'map_render', 'frame_loop', 'encode', 'concat')
+FRAME_SPANS = ('crop', 'draw', 'tobytes', 'patch', 'pipe_write', 'queue_full')
+
+
+def run(args):
+    perf.enable()
+    window_size = tuple(args.size)
+    start_time = datetime(2023, 10, 5, 0, 0, 0, tzinfo=timezone.utc)
+
+    workdir = tempfile.mkdtemp(prefix='gpx-bench-')
+    try:
+        track_file = make_track_file(workdir, args.points, args.shape, args.format, args.stops, start_time)
+
+        with perf.span('load'):
+            points, sess, tz = loading.load_gps_data([track_file], timezone.utc)
+
+        with perf.span('resample'):
+            timestamps, positions, sess = gpx_to_route.resample_gps_point(points, sess, tz, args.fps, False, args.stop_compress)
+
+        photo_render = util.PhotoRender(None, timestamps, positions)
+
+        with perf.span('map_render'):
+            mm, extent, window_size = gpx_to_route.init_map_object(positions, False, window_size, args.zoom, stub_provider(),
+                                                                     limits=zoomplan.Limits(max_zoom_out=args.max_zoom_out, heading_up=args.heading_up))
+            map_image = geotiler.render_map(mm, downloader=stub_downloader)
+
+        output = os.path.join(workdir, 'bench.mp4')
+        if args.null_sink:
+            p = None
+            write_counter = gpx_to_route.WriteCounter(gpx_to_route.NullSink())
+        else:
+            p = gpx_to_route.open_video_sink(output, window_size, args.fps, False)
+            pipe = pipeline.PipeWriter(p.stdin, args.queue_depth) if args.queue_depth > 0 else p.stdin
+            write_counter = gpx_to_route.WriteCounter(pipe)
+
+        with perf.span('frame_loop'):
+            gpx_to_route.render_route(write_counter, window_size, args.fps, extent, mm, map_image, positions, timestamps, sess, photo_render, args.max_zoom_out, args.heading_up)
+
+        if p is not None:
+            with perf.span('encode'):
+                pipe.close(); p.wait()
+
+            clip = os.path.join(workdir, 'clip.mp4')
+            make_clip(clip, window_size, args.fps)
+
+            with perf.span('concat'):
+                gpx_to_route.ffmpeg_concat_main_and_clip(output, [(clip, 1.0)], False, False)
+    finally:
+        if not args.keep: shutil.rmtree(workdir, ignore_errors=True)
+
+    frame_num = write_counter.current_frame_num()
+    spans = perf.summary()['spans']
+    frame_loop = spans['frame_loop']['sec']
+
+    return {
+        'points': args.points, 'shape': args.shape, 'format': args.format, 'stops': args.stops, 'stop_compress': args.stop_compress, 'max_zoom_out': args.max_zoom_out, 'heading_up': args.heading_up, 'queue_depth': args.queue_depth,
+        'size': list(window_size), 'fps': args.fps, 'zoom': mm.zoom, 'map_size': list(mm.size),
+        'null_sink': args.null_sink,
+        'frames': frame_num,
+        'frames_per_sec': frame_num / frame_loop if frame_loop else 0.0,
+        'mb_piped': write_counter.byte_num / 2**20,
+        'mb_per_sec': write_counter.byte_num / 2**20 / frame_loop if frame_loop else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_children_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+        'stages': {k: spans[k]['sec'] for k in STAGES if k in spans},
+        'per_frame_ms': {k: spans[k]['sec'] * 1000 / spans[k]['count'] for k in FRAME_SPANS if k in spans},
+        'counters': perf.summary()['counters'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the route rendering with a synthetic track.')
+    parser.add_argument('--points', type=int, default=3600, help='number of gps point(1Hz) of the track')
+    parser.add_argument('--shape', choices=SHAPES, default='loop', help='shape of the track')
+    parser.add_argument('--format', choices=('gpx', 'fit'), default='fit', help='format of the track file')
+    parser.add_argument('--stops', type=int, default=0, help='number of 10 minute stops in the track')
+    parser.add_argument('--stop-compress', type=int, default=0, help='play the stops N times faster')
+    parser.add_argument('--max-zoom-out', type=float, default=1.0, help='zoom the map out up to N times when riding fast')
+    parser.add_argument('--heading-up', action='store_true', help='turn the map to the riding direction')
+    parser.add_argument('--queue-depth', type=int, default=8, help='frames queued for the ffmpeg writer thread, 0 to write from the render loop')
+    parser.add_argument('-s', '--size', nargs=2, type=int, default=(960, 540), help='size of video')
+    parser.add_argument('-z', '--zoom', type=int, default=15, help='zoom of map, 0 for auto')
+    parser.add_argument('-f', '--fps', type=int, default=30, help='fps of video')
+    parser.add_argument('--null-sink', action='store_true', help='drop the frames instead of piping them to ffmpeg')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary files')
+    parser.add_argument('--out', default=None, help='write the json report to the file')
+    parser.add_argument('--profile-out', default=None, help='save the chrome trace to the file')
+    args = parser.parse_args()
+
+    if args.out: args.out = os.path.abspath(args.out)
+    if args.profile_out: args.profile_out = os.path.abspath(args.profile_out)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    result = run(args)
+
+    s = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f: f.write(s + '\n')
+    print(s)
+
+    if args.profile_out: perf.save(args.profile_out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## the camera of every frame planned once over the whole projected(map pixel) track: it looks
+## ahead of the cursor by the distance of the next `look_ahead` seconds, zooms out(up to
+## max_zoom_out times) when riding fast, and moves with a bounded acceleration.
+
+import sys
+import os
+
+import math
+
+
+def prefix_sum(values):
+    s = [0.0]
+    for v in values: s.append(s[-1] + v)
+    return s
+
+
+def window_mean(prefix, start, end):
+    return (prefix[end] - prefix[start]) / (end - start)
+
+
+def plan_camera(plots, window_size, fps, max_zoom_out=1.0, look_ahead=1.0, back=7, margin=0.2, max_accel=None, max_zoom_rate=0.01):
+    """
+    (centers, zooms) of every frame, a frame shows window_size * zoom map pixels around its center.
+
+    the target is the mean of the points from `back` frames before to `look_ahead` seconds after,
+    the zoom fits the distance ridden in the look ahead into the half window. the camera follows
+    the target with at most max_accel px/frame**2 and keeps the cursor `margin` inside the window.
+    """
+    n = len(plots)
+    if n == 0: return [], []
+
+    ahead = max(1, int(fps * look_ahead))
+    half = min(window_size) / 2
+    if max_accel is None: max_accel = max(0.5, half / fps / 4)
+
+    px, py = prefix_sum([p[0] for p in plots]), prefix_sum([p[1] for p in plots])
+    step = [0.0] + [math.dist(plots[i-1], plots[i]) for i in range(1, n)]
+    ps = prefix_sum(step)
+
+    centers, zooms = [], []
+    cx, cy = plots[0]
+    ux = uy = 0.0
+    zoom = 1.0
+    tx, ty = plots[0]
+    for i in range(n):
+        start, end = max(0, i - back), min(n, i + ahead + 1)
+        last_tx, last_ty = tx, ty
+        tx, ty = window_mean(px, start, end), window_mean(py, start, end)
+
+        if max_zoom_out > 1:
+            # pixels ridden in the look ahead, from the speed around the point
+            speed = window_mean(ps, max(0, i - ahead), min(n, i + ahead + 1))
+            want = min(max_zoom_out, max(1.0, speed * ahead / (half * (1 - 2 * margin))))
+            zoom += max(-max_zoom_rate, min(max_zoom_rate, want - zoom))
+
+        # the velocity of the target plus the one closing the distance to it in about a second,
+        # reached with bounded acceleration
+        ax, ay = tx - last_tx + (tx - cx) / fps - ux, ty - last_ty + (ty - cy) / fps - uy
+        a = math.hypot(ax, ay)
+        if a > max_accel: ax, ay = ax * max_accel / a, ay * max_accel / a
+        ux, uy = ux + ax, uy + ay
+        cx, cy = cx + ux, cy + uy
+
+        # never let the cursor out of the inner window
+        limit_x, limit_y = window_size[0] * zoom * (0.5 - margin), window_size[1] * zoom * (0.5 - margin)
+        x, y = plots[i]
+        if abs(x - cx) > limit_x:
+            nx = x - math.copysign(limit_x, x - cx)
+            ux, cx = nx - (cx - ux), nx
+        if abs(y - cy) > limit_y:
+            ny = y - math.copysign(limit_y, y - cy)
+            uy, cy = ny - (cy - uy), ny
+
+        centers.append((cx, cy))
+        zooms.append(zoom)
+
+    return centers, zooms
+
+
+def plan_heading(plots, fps, smooth_sec=2.0, max_turn=60.0, step=0.5):
+    """
+    travel direction(degrees, clockwise from up of the map image) of every frame for the heading-up mode.
+
+    the direction of the points `smooth_sec` around the frame, turning at most `max_turn` degrees
+    a second and in `step` degrees, so the frames of a straight road share the same heading.
+    """
+    n = len(plots)
+    k = max(1, int(fps * smooth_sec / 2))
+    max_step = max_turn / fps
+
+    headings, heading = [], None
+    for i in range(n):
+        a, b = plots[max(0, i - k)], plots[min(n - 1, i + k)]
+        dx, dy = b[0] - a[0], b[1] - a[1]
+
+        if dx or dy:
+            want = math.degrees(math.atan2(dx, -dy))
+            if heading is None: heading = want
+
+            turn = (want - heading + 180) % 360 - 180
+            if abs(turn) >= step: heading += max(-max_step, min(max_step, turn))
+
+        headings.append(round((heading or 0.0) / step) * step % 360)
+
+    return headings
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## the dashboard of a layout xml(as gopro-dashboard.py reads it, eg. ../layouts/my-layout.xml)
+## put on a gopro clip by us: the layout is parsed once into a plan, the static parts(text,
+## icon, unit) are drawn into one layer, and the metric/datetime/map components are bound to
+## the track.Track columns sampled at the frame times. a frame redraws only the components whose
+## value changed since the last one, on top of the static layer.
+
+import sys
+import os
+
+import bisect
+import pathlib
+import argparse
+import functools
+
+import subprocess
+
+from collections import namedtuple
+from datetime import datetime
+from xml.etree import ElementTree
+
+import util
+import perf
+import probe
+import markers
+import pipeline
+import loading
+import overlay
+import gpx_to_route
+
+
+HERE = pathlib.Path(__file__).resolve().parent
+FONT_FILE = str(HERE / 'font/Gidole-Regular.ttf')
+
+ANCHORS = {'left': 'la', 'right': 'ra', 'centre': 'ma', 'center': 'ma'}
+
+# value per si unit and the label of the unit
+UNITS = {
+    'speed': {'kph': (3.6, 'km/h'), 'mph': (2.2369363, 'mph'), 'mps': (1.0, 'm/s'), 'knot': (1.9438445, 'kn')},
+    'distance': {'km': (0.001, 'km'), 'mile': (1 / 1609.344, 'mi'), 'm': (1.0, 'm'), 'nmi': (1 / 1852, 'nmi')},
+    'alt': {'metre': (1.0, 'm'), 'foot': (3.2808399, 'ft')},
+    'temp': {'degC': (1.0, '°C'), 'degF': (1.8, '°F')},
+}
+
+METRIC_COLUMNS = {'speed': 'speed', 'odo': 'odo', 'alt': 'alt', 'temp': 'temp', 'cadence': 'cadence', 'hr': 'hr',
+                  'lat': 'lat', 'lon': 'lon', 'gradient': 'gradient'}
+
+Component = namedtuple('Component', ['type', 'x', 'y', 'attrs', 'text'])
+Frame = namedtuple('Frame', ['x', 'y', 'attrs', 'children'])
+
+
+def parse_layout(filename, include=None, exclude=()):
+    """ the components and frames of the layout at their absolute place, the top level ones filtered by name """
+    def walk(node, ox, oy, top):
+        for e in node:
+            if not isinstance(e.tag, str): continue   # comment
+
+            name = e.get('name')
+            if top and ((include and name not in include) or name in exclude): continue
+
+            x, y = ox + int(e.get('x', 0)), oy + int(e.get('y', 0))
+            if e.tag in ('composite', 'translate'):
+                yield from walk(e, x, y, False)
+            elif e.tag == 'frame':
+                yield Frame(x, y, dict(e.attrib), list(walk(e, 0, 0, False)))
+            elif e.tag == 'component':
+                yield Component(e.get('type'), x, y, dict(e.attrib), (e.text or '').strip())
+            else:
+                print('layout: unknown element', e.tag, file=sys.stderr)
+
+    return list(walk(ElementTree.parse(filename).getroot(), 0, 0, True))
+
+
+def parse_color(text, default=None):
+    if not text: return default
+    rgba = tuple(int(x) for x in text.split(','))
+    return rgba if len(rgba) == 4 else rgba + (255, )
+
+
+@functools.lru_cache(maxsize=64)
+def load_font(size):
+    from PIL import ImageFont
+    return ImageFont.truetype(FONT_FILE, size=size)
+
+
+@functools.lru_cache(maxsize=4096)
+def text_sprite(text, size, align='left', fill=(255, 255, 255, 255), stroke=(0, 0, 0, 255)):
+    """ (rgba image, dx, dy) of the text, the image put at (x + dx, y + dy) has the text anchored at (x, y) """
+    from PIL import Image, ImageDraw
+
+    font, anchor, stroke_width = load_font(size), ANCHORS.get(align, 'la'), max(1, size // 16)
+    x0, y0, x1, y1 = font.getbbox(text, anchor=anchor, stroke_width=stroke_width)
+
+    im = Image.new('RGBA', (max(1, x1 - x0), max(1, y1 - y0)))
+    ImageDraw.Draw(im).text((-x0, -y0), text, font=font, anchor=anchor, fill=fill, stroke_width=stroke_width, stroke_fill=stroke)
+
+    return im, x0, y0
+
+
+def draw_text(image, x, y, text, size, align):
+    im, dx, dy = text_sprite(text, size, align)
+    return markers.composite_at(image, im, x + dx, y + dy)
+
+
+def icon_dirs(layout_file, icon_dir=None):
+    """ where the icons of a layout are looked for: --icon-dir, next to the layout, the icons/ of
+    gopro-dashboard(beside the layouts/ the layout links to, or of the installed package), and icon/ """
+    dirs = [pathlib.Path(icon_dir)] if icon_dir else []
+    dirs.append(pathlib.Path(layout_file).absolute().parent)
+    dirs.append(pathlib.Path(layout_file).resolve().parent.parent / 'icons')
+
+    import importlib.util
+    try:
+        spec = importlib.util.find_spec('gopro_overlay')
+    except (ImportError, ValueError):
+        spec = None
+    if spec and spec.submodule_search_locations:
+        dirs.extend(pathlib.Path(x, 'icons') for x in spec.submodule_search_locations)
+
+    dirs.append(HERE / 'icon')
+    return dirs
+
+
+def find_icon(filename, dirs):
+    for d in dirs:
+        path = pathlib.Path(d, filename)
+        if path.exists(): return path
+    raise FileNotFoundError('layout: no icon %s in %s, give the dir of it by --icon-dir' % (filename, ', '.join(str(d) for d in dirs)))
+
+
+def gradient_column(alt, odo, window=50.0):
+    """ % of the climb over the last window meters at every point """
+    out, j = [], 0
+    for i in range(len(odo)):
+        while j < i and odo[i] - odo[j + 1] >= window: j += 1
+        d = odo[i] - odo[j]
+        out.append((alt[i] - alt[j]) / d * 100 if d > 0 else 0.0)
+    return out
+
+
+class Sampler(object):
+    """ linear interpolation of the point columns at the frame times, clamped to the first and the last point """
+    def __init__(self, times, frame_seconds):
+        self.index, self.ratio = [], []
+        n = len(times)
+        for t in frame_seconds:
+            j = bisect.bisect_right(times, t)
+            if j == 0 or j == n:
+                self.index.append(min(j, n - 1))
+                self.ratio.append(0.0)
+            else:
+                self.index.append(j - 1)
+                self.ratio.append((t - times[j-1]) / (times[j] - times[j-1]))
+
+    def sample(self, column):
+        last = len(column) - 1
+        return [column[k] + (column[min(k + 1, last)] - column[k]) * r for k, r in zip(self.index, self.ratio)]
+
+
+class TextItem(object):
+    """ text per frame, anchored at (x, y) """
+    def __init__(self, x, y, texts, size, align):
+        self.x, self.y, self.texts, self.size, self.align = x, y, texts, size, align
+
+    def key(self, i):
+        return self.texts[i]
+
+    def rect(self, i):
+        im, dx, dy = text_sprite(self.texts[i], self.size, self.align)
+        return (self.x + dx, self.y + dy, self.x + dx + im.width, self.y + dy + im.height)
+
+    def draw(self, image, i, origin=(0, 0)):
+        return draw_text(image, origin[0] + self.x, origin[1] + self.y, self.texts[i], self.size, self.align)
+
+
+class MovingMapItem(object):
+    """ the map around the cursor at the zoom, with the whole route on it when journey """
+    def __init__(self, x, y, size, map_image, cursors, cursor_radius=5):
+        self.x, self.y, self.size = x, y, size
+        self.map_image, self.cursors, self.cursor_radius = map_image, cursors, cursor_radius
+        self.view = None
+
+    def key(self, i):
+        return tuple(int(round(v)) for v in self.cursors[i])
+
+    def rect(self, i):
+        return (self.x, self.y, self.x + self.size, self.y + self.size)
+
+    def draw(self, image, i, origin=(0, 0)):
+        from PIL import ImageDraw
+
+        cx, cy = self.key(i)
+        h, r = self.size // 2, self.cursor_radius
+
+        with perf.span('crop'):
+            view = self.map_image.crop((cx - h, cy - h, cx - h + self.size, cy - h + self.size))
+        ImageDraw.Draw(view).ellipse((h - r, h - r, h + r, h + r), fill=(255, 255, 255, 255), outline=(0, 0, 0, 255))
+
+        x0, y0 = origin[0] + self.x, origin[1] + self.y
+        image.paste(view, (x0, y0))
+        return (x0, y0, x0 + self.size, y0 + self.size)
+
+
+class JourneyMapItem(MovingMapItem):
+    """ the whole route fitted in the map, the cursor moving on it """
+    def draw(self, image, i, origin=(0, 0)):
+        from PIL import ImageDraw
+
+        x0, y0 = origin[0] + self.x, origin[1] + self.y
+        image.paste(self.map_image, (x0, y0))
+
+        (cx, cy), r = self.key(i), self.cursor_radius
+        ImageDraw.Draw(image).ellipse((x0 + cx - r, y0 + cy - r, x0 + cx + r, y0 + cy + r), fill=(255, 255, 255, 255), outline=(0, 0, 0, 255))
+        return (x0, y0, x0 + self.size, y0 + self.size)
+
+
+class FrameItem(object):
+    """ the children drawn on the background, cut to the rounded corners and faded by the opacity """
+    def __init__(self, x, y, attrs, children, static):
+        from PIL import Image, ImageDraw
+
+        self.x, self.y, self.children = x, y, children
+        self.size = (int(attrs.get('width', 0)), int(attrs.get('height', 0)))
+        self.static = static
+        self.outline = parse_color(attrs.get('outline'))
+        self.cr = int(attrs.get('cr', 0))
+
+        opacity = float(attrs.get('opacity', 1.0))
+        self.mask = Image.new('L', self.size, 0)
+        ImageDraw.Draw(self.mask).rounded_rectangle((0, 0, self.size[0] - 1, self.size[1] - 1), self.cr, fill=int(255 * opacity))
+
+    def key(self, i):
+        return tuple(c.key(i) for c in self.children)
+
+    def rect(self, i):
+        return (self.x, self.y, self.x + self.size[0], self.y + self.size[1])
+
+    def draw(self, image, i, origin=(0, 0)):
+        from PIL import ImageDraw, ImageChops
+
+        canvas = self.static.copy()
+        for c in self.children: c.draw(canvas, i)
+
+        canvas.putalpha(ImageChops.multiply(canvas.getchannel('A'), self.mask))
+        if self.outline: ImageDraw.Draw(canvas).rounded_rectangle((0, 0, self.size[0] - 1, self.size[1] - 1), self.cr, outline=self.outline, width=2)
+
+        return markers.composite_at(image, canvas, origin[0] + self.x, origin[1] + self.y)
+
+
+class Dashboard(object):
+    """ the layout bound to the frames: static layer plus the items redrawn when their key changes """
+    def __init__(self, nodes, size, frames, icon_dirs=(HERE / 'icon', )):
+        from PIL import Image
+
+        self.size = tuple(size)
+        self.frames = frames
+        self.icon_dirs = icon_dirs
+
+        self.static = Image.new('RGBA', self.size)
+        with perf.span('layout_bind'):
+            self.items = self.bind(nodes, self.static)
+
+        self.frame = self.static.copy()
+        self.keys = [None] * len(self.items)
+        self.rects = [None] * len(self.items)
+        self.last = None
+
+    def bind(self, nodes, layer):
+        """ draw the static nodes into the layer, the dynamic ones as items """
+        from PIL import Image, ImageOps
+
+        items = []
+        for node in nodes:
+            if isinstance(node, Frame):
+                attrs = node.attrs
+                background = Image.new('RGBA', (int(attrs.get('width', 0)), int(attrs.get('height', 0))), parse_color(attrs.get('bg'), (0, 0, 0, 0)))
+                item = FrameItem(node.x, node.y, attrs, self.bind(node.children, background), background)
+                if item.children: items.append(item)
+                else: item.draw(layer, 0)
+                continue
+
+            kind, a, size = node.type, node.attrs, int(node.attrs.get('size', 16))
+            align = a.get('align', 'left')
+
+            if kind == 'text':
+                draw_text(layer, node.x, node.y, node.text, size, align)
+            elif kind == 'metric_unit':
+                unit = self.frames.unit_label(a.get('units'))
+                text = unit if node.text in ('', '{:~c}', '{:~C}', '{:~P}') else node.text
+                draw_text(layer, node.x, node.y, text, size, align)
+            elif kind == 'icon':
+                path = find_icon(a['file'], self.icon_dirs)
+                im = ImageOps.contain(Image.open(path).convert('RGBA'), (size, size))
+                markers.composite_at(layer, im, node.x, node.y)
+            elif kind == 'metric':
+                items.append(TextItem(node.x, node.y, self.frames.metric_texts(a.get('metric'), a.get('units'), int(a.get('dp', 2))), size, align))
+            elif kind == 'datetime':
+                items.append(TextItem(node.x, node.y, self.frames.datetime_texts(a.get('format', '%H:%M:%S')), size, align))
+            elif kind in ('moving_map', 'moving_journey_map'):
+                map_image, cursors = self.frames.moving_map(int(a.get('zoom', 16)), size, kind == 'moving_journey_map')
+                items.append(MovingMapItem(node.x, node.y, size, map_image, cursors))
+            elif kind == 'journey_map':
+                map_image, cursors = self.frames.journey_map(size)
+                items.append(JourneyMapItem(node.x, node.y, size, map_image, cursors))
+            else:
+                print('layout: component not supported', kind, file=sys.stderr)
+
+        return items
+
+    def render(self, i):
+        """ rgba bytes of frame i """
+        keys = [item.key(i) for item in self.items]
+        changed = {k for k, key in enumerate(keys) if key != self.keys[k]}
+        if not changed and self.last is not None: return self.last
+
+        with perf.span('draw'):
+            # the old and new place of what changed, grown by the whole place of every item over it
+            redraw = set(changed)
+            dirty = [r for k in changed for r in (self.rects[k], self.items[k].rect(i)) if r]
+            grown = True
+            while grown:
+                grown = False
+                for k, item in enumerate(self.items):
+                    if k in redraw: continue
+                    rect = self.rects[k] or item.rect(i)
+                    if any(overlaps(rect, r) for r in dirty):
+                        redraw.add(k)
+                        dirty.append(rect)
+                        grown = True
+
+            # restore the static layer under all of it, and draw the items there again in layout order
+            for rect in dirty:
+                box = (max(0, rect[0]), max(0, rect[1]), min(self.size[0], rect[2]), min(self.size[1], rect[3]))
+                if box[0] < box[2] and box[1] < box[3]: self.frame.paste(self.static.crop(box), box[:2])
+
+            for k in sorted(redraw):
+                self.rects[k] = self.items[k].draw(self.frame, i)
+                self.keys[k] = keys[k]
+
+        with perf.span('tobytes'):
+            self.last = self.frame.tobytes()
+        return self.last
+
+
+def overlaps(a, b):
+    return a is not None and a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+class TrackFrames(object):
+    """ the columns of the track.Track at the frame times, in the units asked, and the maps of it """
+    def __init__(self, track, frame_seconds, units, tz=None, provider_id='osm', cache_dir=pathlib.Path.home() / '.cache/geotiler/'):
+        self.track = track
+        self.frame_seconds = frame_seconds
+        self.units = units
+        self.tz = tz
+        self.provider = gpx_to_route.find_provider(provider_id)
+        self.cache_dir = pathlib.Path(cache_dir)
+
+        self.sampler = Sampler(track.seconds(), frame_seconds)
+        self.positions = track.positions()
+        if self.provider.name.endswith('.mars_in_china'): self.positions = util.fix_mars_in_china(self.positions)
+
+    def unit_label(self, kind):
+        if kind not in UNITS: return ''
+        return UNITS[kind][self.units[kind]][1]
+
+    @functools.lru_cache(maxsize=None)
+    def column(self, name):
+        if name == 'gradient': return gradient_column(self.track['alt'], self.track['odo'])
+        return self.track[name]
+
+    def metric_texts(self, metric, kind=None, dp=2):
+        """ the metric text of every frame, '-' where the track has no value """
+        if metric not in METRIC_COLUMNS:
+            print('layout: metric not supported', metric, file=sys.stderr)
+            return [''] * len(self.frame_seconds)
+
+        values = self.sampler.sample(self.column(METRIC_COLUMNS[metric]))
+
+        scale = UNITS[kind][self.units[kind]][0] if kind in UNITS else 1.0
+        offset = 32.0 if kind == 'temp' and self.units[kind] == 'degF' else 0.0
+
+        fmt = '%%.%df' % dp
+        return ['-' if v != v else fmt % (v * scale + offset) for v in values]
+
+    def datetime_texts(self, format):
+        return [datetime.fromtimestamp(t, self.tz).strftime(format) for t in self.frame_seconds]
+
+    def frame_positions(self):
+        return list(zip(self.sampler.sample([p[0] for p in self.positions]), self.sampler.sample([p[1] for p in self.positions])))
+
+    def moving_map(self, zoom, size, journey):
+        """ the map of the track part in the clip with a margin of size, and the cursor of every frame on it """
+        import geotiler
+
+        cursors = self.frame_positions()
+        x, y = zip(*cursors)
+        mm = geotiler.Map(extent=(min(x), min(y), max(x), max(y)), zoom=zoom, provider=self.provider)
+        mm.size = mm.size[0] + size, mm.size[1] + size
+
+        with perf.span('map_render'):
+            map_image = gpx_to_route.my_render_map(self.cache_dir)(mm).convert('RGBA')
+
+        if journey:
+            from PIL import ImageDraw
+            ImageDraw.Draw(map_image).line([mm.rev_geocode(p) for p in self.positions], fill=(255, 0, 0, 255), width=4, joint='curve')
+
+        return map_image, [mm.rev_geocode(p) for p in cursors]
+
+    def journey_map(self, size):
+        """ the whole route fitted in size x size, and the cursor of every frame on it """
+        import geotiler
+        from PIL import ImageDraw
+
+        x, y = zip(*self.positions)
+        mm = geotiler.Map(extent=(min(x), min(y), max(x), max(y)), size=(size, size), provider=self.provider)
+
+        with perf.span('map_render'):
+            map_image = gpx_to_route.my_render_map(self.cache_dir)(mm).convert('RGBA')
+        ImageDraw.Draw(map_image).line([mm.rev_geocode(p) for p in self.positions], fill=(255, 0, 0, 255), width=3, joint='curve')
+
+        return map_image, [mm.rev_geocode(p) for p in self.frame_positions()]
+
+
+def render_dashboard(clip, outfile, track, layout_file, include=None, exclude=(), units=None, tz=None, clip_offset=0,
+                     provider_id='osm', cache_dir=pathlib.Path.home() / '.cache/geotiler/', is_release=False, profile=None, queue_depth=8,
+                     icon_dir=None):
+    """ encode the clip with the dashboard of the track.Track on it """
+    width, height, fps_text, duration = util.probe_video(clip)
+    fps = overlay.parse_fps(fps_text)
+
+    clip_t0 = overlay.clip_start_time(clip, clip_offset).timestamp()
+    frame_seconds = [clip_t0 + k / fps for k in range(int(duration * fps))]
+
+    if frame_seconds[-1] < track['time'][0] / 1e9 or frame_seconds[0] > track['time'][-1] / 1e9:
+        print('the track has no point in %s' % clip, file=sys.stderr)
+
+    with perf.span('layout_parse'):
+        nodes = parse_layout(layout_file, include, exclude)
+
+    frames = TrackFrames(track, frame_seconds, units, tz, provider_id, cache_dir)
+    dashboard = Dashboard(nodes, (width, height), frames, icon_dirs(layout_file, icon_dir))
+
+    print('dashboard:', clip, len(frame_seconds), 'frames')
+    cmd_string = util.splice_overlay_cmd_string(clip, outfile, 0, None, (width, height), fps_text, ('0', '0'), is_release, profile)
+    p = perf.popen(cmd_string, 'ffmpeg.dashboard', stdin=subprocess.PIPE)
+    pipe = pipeline.PipeWriter(p.stdin, queue_depth) if queue_depth > 0 else p.stdin
+    write_counter = gpx_to_route.WriteCounter(pipe, progress=perf.Progress(len(frame_seconds)))
+    try:
+        with perf.span('frame_loop'):
+            for i in range(len(frame_seconds)):
+                write_counter.write(dashboard.render(i))
+    except BaseException:
+        p.kill()
+        if queue_depth > 0: pipe.abort()
+        p.wait()
+        raise
+    finally:
+        write_counter.progress.close()
+
+    with perf.span('encode'):
+        pipe.close(); perf.wait(p)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Put the dashboard of a layout xml on the gopro clip.')
+    parser.add_argument('-t', '--track', action='append', required=True, help='gpx or fit file')
+    parser.add_argument('--layout-xml', default=str(HERE.parent / 'layouts/my-layout.xml'), help='layout file')
+    parser.add_argument('--icon-dir', default=None, help='dir of the icons of the layout, looked in before the others')
+    parser.add_argument('--include', nargs='+', default=None, help='only the top level components of the names')
+    parser.add_argument('--exclude', nargs='+', default=(), help='leave out the top level components of the names')
+    parser.add_argument('--units-speed', choices=sorted(UNITS['speed']), default='kph', help='unit of speed')
+    parser.add_argument('--units-distance', choices=sorted(UNITS['distance']), default='km', help='unit of distance')
+    parser.add_argument('--units-altitude', choices=sorted(UNITS['alt']), default='metre', help='unit of altitude')
+    parser.add_argument('--units-temperature', choices=sorted(UNITS['temp']), default='degC', help='unit of temperature')
+    parser.add_argument('--tz', default=None, help='time zone of the datetime, eg. Asia/Shanghai, default the local one')
+    parser.add_argument('--clip-offset', type=float, default=0, help='second added to the clip creation time, -28800 for a gopro clock on UTC+8')
+    parser.add_argument('-p', '--provider', default='osm', help='map provider id')
+    parser.add_argument('--cache-dir', type=pathlib.Path, default=pathlib.Path.home() / '.cache/geotiler/', help='location of cache(map tile, ...)')
+    parser.add_argument('--release', dest='is_release', action='store_true', help='set it when the video is to publish')
+    parser.add_argument('--encoder', default=None, help='encoder profile in encoder_profiles.json')
+    parser.add_argument('--queue-depth', type=int, default=8, help='frames queued to the writer thread, 0 to write from the render loop')
+    parser.add_argument('--profile-out', default=None, help='save the stage timing in chrome trace format to the file')
+    parser.add_argument('clip', help='the gopro clip')
+    parser.add_argument('output', help='output video file')
+    args = parser.parse_args()
+
+    if args.profile_out: perf.enable()
+
+    tz = None
+    if args.tz:
+        from zoneinfo import ZoneInfo
+        tz = ZoneInfo(args.tz)
+
+    units = {'speed': args.units_speed, 'distance': args.units_distance, 'alt': args.units_altitude, 'temp': args.units_temperature}
+
+    args.cache_dir.mkdir(parents=True, exist_ok=True)
+    probe.open_cache(args.cache_dir / 'probe.json')
+
+    with perf.span('load_gps'):
+        track = loading.load_track(args.track, args.cache_dir)
+
+    render_dashboard(args.clip, args.output, track, args.layout_xml, args.include, args.exclude, units, tz, args.clip_offset,
+                     args.provider, args.cache_dir, args.is_release, args.encoder, args.queue_depth, args.icon_dir)
+
+    probe.save()
+    if args.profile_out: perf.save(args.profile_out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## named encoder profiles(codec, preset, crf, threads, pix_fmt, tune) shared by all the ffmpeg command builders,
+## and a calibration which picks the fastest cpu encoder meeting a quality or size target. eg:
+##   ./encoder.py list
+##   ./encoder.py calibrate -s 1920 1080 --min-psnr 38 --set release
+
+import sys
+import os
+
+import re
+import json
+import time
+import argparse
+import tempfile
+import functools
+
+import subprocess
+
+
+PROFILE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'encoder_profiles.json')
+
+# presets tried by the calibration, fastest first
+CANDIDATES = {
+    'libx264': ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium'],
+    'libx265': ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast'],
+    'libsvtav1': ['12', '10', '8'],
+}
+
+
+@functools.lru_cache(maxsize=None)
+def load_profiles(filename=PROFILE_FILE):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def get_profile(name=None, is_release=False, filename=PROFILE_FILE):
+    """ the profile by name, or the one the release/draft alias points to """
+    data = load_profiles(filename)
+
+    if name is None: name = data['release' if is_release else 'draft']
+    if name in data and isinstance(data[name], str): name = data[name]
+
+    if name not in data['profiles']:
+        raise ValueError('unknown encoder profile: %s, choose from: %s' % (name, ', '.join(data['profiles'])))
+
+    return data['profiles'][name]
+
+
+def video_args(profile):
+    """ ffmpeg output options of the profile """
+    args = ['-c:v', profile['codec']]
+
+    if profile.get('preset') is not None: args.extend(['-preset', str(profile['preset'])])
+    if profile.get('crf') is not None: args.extend(['-crf', str(profile['crf'])])
+    if profile.get('tune'): args.extend(['-tune', profile['tune']])
+    if profile.get('pix_fmt'): args.extend(['-pix_fmt', profile['pix_fmt']])
+    if profile.get('threads') is not None: args.extend(['-threads', str(profile['threads'])])
+
+    return args
+
+
+def available_encoders():
+    r = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True)
+    names = set(line.split()[1] for line in r.stdout.splitlines() if line.startswith(' V'))
+    return [x for x in CANDIDATES if x in names]
+
+
+def synthetic_source(window_size, fps, time_in_sec):
+    width, height = window_size
+    return ['-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}:duration={time_in_sec}']
+
+
+def measure(profile, window_size, fps, time_in_sec, workdir):
+    outfile = os.path.join(workdir, 'calibrate.mp4')
+
+    cmd_string = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error'] + synthetic_source(window_size, fps, time_in_sec)
+    cmd_string += video_args(profile) + [outfile]
+
+    start = time.perf_counter()
+    r = subprocess.run(cmd_string, capture_output=True)
+    wall = time.perf_counter() - start
+    if r.returncode != 0: return None
+
+    cmd_string = ['ffmpeg', '-hide_banner', '-i', outfile] + synthetic_source(window_size, fps, time_in_sec)
+    cmd_string += ['-lavfi', '[0:v][1:v]psnr', '-f', 'null', '-']
+    r = subprocess.run(cmd_string, capture_output=True, text=True)
+    m = re.search(r'average:([0-9.]+|inf)', r.stderr)
+    psnr = float(m.group(1)) if m else 0.0
+
+    return {
+        'fps': fps * time_in_sec / wall,
+        'psnr': psnr,
+        'kbps': os.path.getsize(outfile) * 8 / 1000 / time_in_sec,
+    }
+
+
+def calibrate(window_size, fps, time_in_sec=4, min_psnr=None, max_kbps=None, crf=23, threads=None):
+    """ measure every candidate, return (best profile, all the measurements) """
+    results = []
+    with tempfile.TemporaryDirectory(prefix='gpx-encoder-') as workdir:
+        for codec in available_encoders():
+            for preset in CANDIDATES[codec]:
+                profile = {'codec': codec, 'preset': preset, 'crf': crf, 'pix_fmt': 'yuv420p'}
+                if threads is not None: profile['threads'] = threads
+
+                m = measure(profile, window_size, fps, time_in_sec, workdir)
+                if m is None: continue
+
+                print('%-10s %-10s %7.1f fps  psnr %5.2f  %8.0f kbps' % (codec, preset, m['fps'], m['psnr'], m['kbps']))
+                results.append((profile, m))
+
+    ok = [(p, m) for p, m in results
+          if (min_psnr is None or m['psnr'] >= min_psnr) and (max_kbps is None or m['kbps'] <= max_kbps)]
+    if not ok: return None, results
+
+    return max(ok, key=lambda x: x[1]['fps'])[0], results
+
+
+def save_profile(name, profile, alias=None, filename=PROFILE_FILE):
+    data = dict(load_profiles(filename))
+    data['profiles'] = dict(data['profiles'], **{name: profile})
+    if alias: data[alias] = name
+
+    with open(filename, 'w') as f:
+        json.dump(data, f, indent=4)
+        f.write('\n')
+
+    load_profiles.cache_clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Encoder profiles of the ffmpeg commands.')
+    parser.add_argument('--profiles', default=PROFILE_FILE, help='the profile file')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('list', help='show the profiles')
+
+    p = sub.add_parser('calibrate', help='benchmark the cpu encoders on a synthetic clip and save the fastest good one')
+    p.add_argument('-s', '--size', nargs=2, type=int, default=(1920, 1080), help='size of the clip')
+    p.add_argument('-f', '--fps', type=int, default=30, help='fps of the clip')
+    p.add_argument('-t', '--time', type=int, default=4, help='length of the clip in second')
+    p.add_argument('--crf', type=int, default=23, help='crf of every candidate')
+    p.add_argument('--threads', type=int, default=None, help='encoder threads, default by ffmpeg')
+    p.add_argument('--min-psnr', type=float, default=None, help='quality target')
+    p.add_argument('--max-kbps', type=float, default=None, help='size target')
+    p.add_argument('--name', default='calibrated', help='save the result as this profile')
+    p.add_argument('--set', dest='alias', choices=('release', 'draft', 'clip'), default=None, help='and use it for')
+
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        data = load_profiles(args.profiles)
+        for name, profile in data['profiles'].items():
+            used = [k for k, v in data.items() if v == name]
+            print('%-14s %-18s %s' % (name, ','.join(used), ' '.join(video_args(profile))))
+        return
+
+    best, _ = calibrate(tuple(args.size), args.fps, args.time, args.min_psnr, args.max_kbps, args.crf, args.threads)
+    if best is None:
+        print('no encoder meets the target')
+        sys.exit(1)
+
+    print('best:', best)
+    save_profile(args.name, best, args.alias, args.profiles)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## when and where a photo(or video) was taken, read from the header bytes only: the tiff
+## tags of the jpeg APP1 segment, and the creation time of the mp4/mov mvhd atom. the
+## files are read in a thread pool and the result is cached by path, size and mtime.
+
+import sys
+import os
+
+import json
+import struct
+
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+IMAGE_SUFFIX = ('.jpg', '.jpeg', '.png')
+VIDEO_SUFFIX = ('.mp4', '.mov')
+
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_OFFSET_TIME = 0x9010
+
+GPS_LATITUDE_REF, GPS_LATITUDE, GPS_LONGITUDE_REF, GPS_LONGITUDE = 1, 2, 3, 4
+GPS_TIMESTAMP, GPS_DATESTAMP = 7, 0x1d
+
+TYPE_SIZE = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+
+
+def list_media(dirname):
+    """ the photos and videos under the dir, sorted by path """
+    return sorted(str(x) for x in Path(dirname).rglob('*') if x.suffix.lower() in IMAGE_SUFFIX + VIDEO_SUFFIX)
+
+
+def read_jpeg_app1(f):
+    """ the tiff bytes of the exif APP1 segment, the segments are skipped by their length up to the image data """
+    if f.read(2) != b'\xff\xd8': return None
+
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xff: return None
+        if marker[1] == 0xda or marker[1] == 0xd9: return None
+
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker[1] == 0xe1:
+            data = f.read(length - 2)
+            if data.startswith(b'Exif\x00\x00'): return data[6:]
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_ifd(tiff, offset, endian):
+    """ {tag: value} of the ifd at offset, ascii as str, rational as float """
+    tags = {}
+    if offset + 2 > len(tiff): return tags
+
+    num = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    for k in range(num):
+        pos = offset + 2 + k * 12
+        if pos + 12 > len(tiff): break
+
+        tag, typ, count = struct.unpack_from(endian + 'HHI', tiff, pos)
+        if typ not in TYPE_SIZE: continue
+
+        size = TYPE_SIZE[typ] * count
+        data_pos = pos + 8 if size <= 4 else struct.unpack_from(endian + 'I', tiff, pos + 8)[0]
+        if data_pos + size > len(tiff): continue
+
+        if typ == 2:
+            value = tiff[data_pos:data_pos+size].split(b'\x00')[0].decode('ascii', 'replace')
+        elif typ in (5, 10):
+            fmt = endian + ('%dI' if typ == 5 else '%di') % (2 * count)
+            v = struct.unpack_from(fmt, tiff, data_pos)
+            value = [v[i] / v[i+1] if v[i+1] else 0.0 for i in range(0, len(v), 2)]
+        elif typ == 3:
+            value = list(struct.unpack_from(endian + '%dH' % count, tiff, data_pos))
+        elif typ in (4, 9):
+            value = list(struct.unpack_from(endian + ('%dI' if typ == 4 else '%di') % count, tiff, data_pos))
+        else:
+            value = tiff[data_pos:data_pos+size]
+
+        if isinstance(value, list) and len(value) == 1: value = value[0]
+        tags[tag] = value
+
+    return tags
+
+
+def parse_exif(tiff):
+    """ (datetime, lon, lat) of the tiff header as PhotoRender used the exif package: DateTime with OffsetTime, or the gps time """
+    endian = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if endian is None: return None
+
+    ifd0 = read_ifd(tiff, struct.unpack_from(endian + 'I', tiff, 4)[0], endian)
+    exif_ifd = read_ifd(tiff, ifd0[TAG_EXIF_IFD], endian) if TAG_EXIF_IFD in ifd0 else {}
+    gps_ifd = read_ifd(tiff, ifd0[TAG_GPS_IFD], endian) if TAG_GPS_IFD in ifd0 else {}
+
+    if ifd0.get(TAG_DATETIME) and exif_ifd.get(TAG_OFFSET_TIME):
+        dt_string = ifd0[TAG_DATETIME] + exif_ifd[TAG_OFFSET_TIME].replace(':', '')
+    elif gps_ifd.get(GPS_DATESTAMP) and isinstance(gps_ifd.get(GPS_TIMESTAMP), list):
+        dt_string = gps_ifd[GPS_DATESTAMP] + ' ' + '%02d:%02d:%02d' % tuple(gps_ifd[GPS_TIMESTAMP]) + 'Z'
+    else:
+        return None
+
+    try:
+        dt = datetime.strptime(dt_string, '%Y:%m:%d %H:%M:%S%z')
+    except ValueError:
+        return None
+
+    def degree(key, ref_key, negative_ref):
+        value = gps_ifd.get(key)
+        if not isinstance(value, list): return None
+        d = float(sum([x / (60 ** i) for i, x in enumerate(value)]))
+        return -d if gps_ifd.get(ref_key) == negative_ref else d
+
+    lon = degree(GPS_LONGITUDE, GPS_LONGITUDE_REF, 'W')
+    lat = degree(GPS_LATITUDE, GPS_LATITUDE_REF, 'S')
+    if lon is None or lat is None: lon, lat = None, None
+
+    return dt, lon, lat
+
+
+def read_mvhd_time(f, end=None):
+    """ creation time of the movie header atom, the atoms are skipped by their size down to moov/mvhd """
+    while end is None or f.tell() < end:
+        header = f.read(8)
+        if len(header) < 8: return None
+
+        size, kind = struct.unpack('>I4s', header)
+        start = f.tell() - 8
+        if size == 1: size = struct.unpack('>Q', f.read(8))[0]
+        elif size == 0: size = None
+
+        if kind == b'moov':
+            return read_mvhd_time(f, start + size if size else None)
+        elif kind == b'mvhd':
+            version = f.read(4)[0]
+            seconds = struct.unpack('>Q', f.read(8))[0] if version == 1 else struct.unpack('>I', f.read(4))[0]
+            return MP4_EPOCH + timedelta(seconds=seconds) if seconds else None
+
+        if size is None or size < 8: return None
+        f.seek(start + size)
+
+    return None
+
+
+def read_exif_full(filename):
+    """ the other images, with the exif package """
+    import exif
+
+    with open(filename, 'rb') as image_file:
+        my_image = exif.Image(image_file)
+
+    if not my_image.has_exif: return None
+
+    if my_image.get('datetime') is not None and my_image.get('offset_time') is not None:
+        dt_string = my_image.datetime + my_image.offset_time.replace(':', '')
+    elif my_image.get('gps_datestamp') is not None and my_image.get('gps_timestamp') is not None:
+        dt_string = my_image.gps_datestamp + ' ' + '%02d:%02d:%02d' % my_image.gps_timestamp + 'Z'
+    else:
+        return None
+
+    dt = datetime.strptime(dt_string, '%Y:%m:%d %H:%M:%S%z')
+
+    if my_image.get('gps_longitude') is None or my_image.get('gps_latitude') is None:
+        lon, lat = None, None
+    else:
+        lon = float(sum([x / (60 ** i) for i, x in enumerate(my_image.gps_longitude)]))
+        lat = float(sum([x / (60 ** i) for i, x in enumerate(my_image.gps_latitude)]))
+        # same as parse_exif, west and south are negative
+        if my_image.get('gps_longitude_ref') == 'W': lon = -lon
+        if my_image.get('gps_latitude_ref') == 'S': lat = -lat
+
+    return dt, lon, lat
+
+
+def read_media(filename):
+    """ (datetime, lon, lat) of a photo, (datetime, None, None) of a video, None when not found """
+    suffix = Path(filename).suffix.lower()
+    try:
+        with open(filename, 'rb') as f:
+            if suffix in VIDEO_SUFFIX:
+                dt = read_mvhd_time(f)
+                return (dt, None, None) if dt else None
+
+            tiff = read_jpeg_app1(f)
+    except (OSError, struct.error, IndexError):
+        return None
+
+    if tiff is not None:
+        try:
+            return parse_exif(tiff)
+        except (struct.error, KeyError, IndexError, TypeError):
+            return None
+
+    return None if suffix in ('.jpg', '.jpeg') else read_exif_full(filename)
+
+
+class MediaCache(object):
+    """ {abs path: [size, mtime_ns, iso datetime, lon, lat]} saved as json, a file of another VERSION is read again """
+    VERSION = 2
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}
+        self.changed = False
+
+        if filename and os.path.exists(filename):
+            try:
+                with open(filename) as f: data = json.load(f)
+                if data.get('version') == self.VERSION: self.entries = data['entries']
+            except (ValueError, AttributeError, KeyError):
+                self.entries = {}
+
+    @staticmethod
+    def key(filename):
+        st = os.stat(filename)
+        return os.path.abspath(filename), st.st_size, st.st_mtime_ns
+
+    def get(self, key):
+        path, size, mtime = key
+        entry = self.entries.get(path)
+        if entry is None or entry[:2] != [size, mtime]: return False, None
+
+        return True, (None if entry[2] is None else (datetime.fromisoformat(entry[2]), entry[3], entry[4]))
+
+    def put(self, key, result):
+        path, size, mtime = key
+        self.entries[path] = [size, mtime] + ([None, None, None] if result is None else [result[0].isoformat(), result[1], result[2]])
+        self.changed = True
+
+    def save(self):
+        if not self.filename or not self.changed: return
+
+        tmp = str(self.filename) + '.tmp'
+        with open(tmp, 'w') as f: json.dump({'version': self.VERSION, 'entries': self.entries}, f)
+        os.replace(tmp, self.filename)
+        self.changed = False
+
+
+def scan(filename_list, cache_file=None, workers=8):
+    """ {filename: (datetime, lon, lat) or None}, only the files not in the cache are read """
+    cache = MediaCache(cache_file)
+
+    result, todo = {}, []
+    for filename in filename_list:
+        key = MediaCache.key(filename)
+        found, value = cache.get(key)
+        if found: result[filename] = value
+        else: todo.append((filename, key))
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for (filename, key), value in zip(todo, executor.map(read_media, [x for x, _ in todo])):
+                result[filename] = value
+                cache.put(key, value)
+
+        cache.save()
+
+    print('media scan: %d files, %d read' % (len(filename_list), len(todo)))
+
+    return result
+
+
+if __name__ == '__main__':
+    for k, v in scan(sys.argv[1:]).items(): print(k, v)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## keep the last frame of the route as bytes, and when the viewport did not move
+## patch only the changed rectangles(new trail segment, old and new cursor) into it,
+## instead of crop + draw + tobytes of the whole viewport every frame.
+
+import sys
+import os
+
+import math
+import functools
+
+import perf
+
+
+@functools.lru_cache(maxsize=1024)
+def heading_axes(heading):
+    """ map directions of the right and the up of a view turned to the heading(degrees clockwise from up) """
+    t = math.radians(heading)
+    up = (math.sin(t), -math.cos(t))
+    return (-up[1], up[0]), up
+
+
+def clip_rect(rect, size):
+    x0, y0, x1, y1 = max(0, rect[0]), max(0, rect[1]), min(size[0], rect[2]), min(size[1], rect[3])
+    return (x0, y0, x1, y1) if x0 < x1 and y0 < y1 else None
+
+
+def line_rect(p1, p2, width):
+    """ map pixels a draw.line of the width may touch """
+    m = width // 2 + 2
+    return (int(min(p1[0], p2[0])) - m, int(min(p1[1], p2[1])) - m,
+            int(max(p1[0], p2[0])) + m + 1, int(max(p1[1], p2[1])) + m + 1)
+
+
+class FrameBuffer(object):
+    def __init__(self, image, window_size, cursor_radius=5, cursor_fill=(255, 255, 255)):
+        self.image = image
+        self.size = tuple(int(x) for x in window_size)
+        self.stride = self.size[0] * 4
+        self.cursor_radius = cursor_radius
+        self.cursor_fill = cursor_fill
+
+        self.box = None
+        self.frame = None
+        self.buf = None
+        self.cursor = None
+        self.cursor_rect = None
+        self.dirty = []
+
+        # the turned map of the heading-up mode, its (heading, zoom) and the map point at its center
+        self.canvas = None
+        self.canvas_key = None
+        self.canvas_anchor = None
+
+    def invalidate(self, rect):
+        """ tell the rect of the map image has been drawn on """
+        self.dirty.append(rect)
+
+    def render(self, box, cursor):
+        """
+        bytes of the viewport at box(of the map image) with the cursor(map coordinate) on it, and whether it is a repeat.
+
+        the image is cropped at the rounded box as PIL does, the cursor is placed relative to the unrounded one.
+        """
+        from PIL import ImageDraw
+
+        cursor = (cursor[0] - box[0], cursor[1] - box[1])
+        box = tuple(int(round(x)) for x in box)
+        dirty, self.dirty = self.dirty, []
+
+        if box != self.box or self.frame is None:
+            with perf.span('crop'):
+                view = self.image.crop(box)
+
+            with perf.span('draw'):
+                x, y = cursor
+                r = self.cursor_radius
+                ImageDraw.Draw(view).ellipse((x-r, y-r, x+r, y+r), fill=self.cursor_fill)
+
+            with perf.span('tobytes'):
+                self.frame = view.tobytes()
+
+            self.box, self.buf = box, None
+            self.cursor, self.cursor_rect = cursor, self._cursor_rect(cursor)
+            return self.frame, False
+
+        dirty = [r for r in (clip_rect(self._to_view(x), self.size) for x in dirty) if r]
+        if not dirty and cursor == self.cursor:
+            perf.count('frame.repeat')
+            return self.frame, True
+
+        perf.count('frame.patch')
+        with perf.span('patch'):
+            if self.buf is None: self.buf = bytearray(self.frame)
+
+            for rect in dirty + [self.cursor_rect]:
+                if rect: self._patch(rect, self._crop(rect).tobytes())
+
+            self.cursor, self.cursor_rect = cursor, self._cursor_rect(cursor)
+            if self.cursor_rect:
+                x0, y0 = self.cursor_rect[:2]
+                x, y = cursor[0] - x0, cursor[1] - y0
+                r = self.cursor_radius
+
+                small = self._crop(self.cursor_rect)
+                ImageDraw.Draw(small).ellipse((x-r, y-r, x+r, y+r), fill=self.cursor_fill)
+                self._patch(self.cursor_rect, small.tobytes())
+
+            self.frame = bytes(self.buf)
+
+        return self.frame, False
+
+    def render_scaled(self, box, cursor):
+        """ bytes of the viewport shrunk from box(larger than the window) of the map image, with the cursor on it """
+        from PIL import ImageDraw
+
+        scale = (box[2] - box[0]) / self.size[0]
+        with perf.span('crop'):
+            view = self.image.resize(self.size, box=box)
+
+        with perf.span('draw'):
+            x, y = (cursor[0] - box[0]) / scale, (cursor[1] - box[1]) / scale
+            r = self.cursor_radius
+            ImageDraw.Draw(view).ellipse((x-r, y-r, x+r, y+r), fill=self.cursor_fill)
+
+        with perf.span('tobytes'):
+            frame = view.tobytes()
+
+        # the next frame of the window size crops again
+        self.box, self.frame, self.buf, self.dirty = None, None, None, []
+        return frame
+
+    def rotated_view(self, center, heading, zoom=1.0, size=None):
+        """
+        the viewport(or a view of the size) around the center turned to the heading: the map square under it
+        is cropped and affine transformed, PIL converts the image it transforms to RGBa and so only that square.
+        """
+        from PIL import Image
+
+        (rx, ry), (ux, uy) = heading_axes(heading)
+        w, h = size or self.size
+        r = math.hypot(w, h) / 2 * zoom + 2
+        x0, y0 = int(center[0] - r), int(center[1] - r)
+        a, b, d, e = zoom * rx, -zoom * ux, zoom * ry, -zoom * uy
+        data = (a, b, center[0] - x0 - a * w / 2 - b * h / 2, d, e, center[1] - y0 - d * w / 2 - e * h / 2)
+
+        with perf.span('crop'):
+            square = self.image.crop((x0, y0, int(center[0] + r) + 1, int(center[1] + r) + 1))
+            return square.transform((w, h), Image.AFFINE, data, resample=Image.BILINEAR)
+
+    def _to_canvas(self, p):
+        """ the canvas pixel of the map point p """
+        (rx, ry), (ux, uy) = heading_axes(self.canvas_key[0])
+        zoom = self.canvas_key[1]
+        dx, dy = p[0] - self.canvas_anchor[0], p[1] - self.canvas_anchor[1]
+        return self.canvas.width / 2 + (dx * rx + dy * ry) / zoom, self.canvas.height / 2 - (dx * ux + dy * uy) / zoom
+
+    def _from_canvas(self, q):
+        (rx, ry), (ux, uy) = heading_axes(self.canvas_key[0])
+        zoom = self.canvas_key[1]
+        du, dv = (q[0] - self.canvas.width / 2) * zoom, (q[1] - self.canvas.height / 2) * zoom
+        return self.canvas_anchor[0] + du * rx - dv * ux, self.canvas_anchor[1] + du * ry - dv * uy
+
+    def _make_canvas(self, center, heading, zoom, ahead):
+        """ a turned canvas holding the window around the center and around as many of the ahead centers as fit in two windows """
+        (rx, ry), (ux, uy) = heading_axes(heading)
+        w, h = self.size
+        u0 = u1 = v0 = v1 = 0.0
+        for c in ahead:
+            dx, dy = c[0] - center[0], c[1] - center[1]
+            u, v = (dx * rx + dy * ry) / zoom, -(dx * ux + dy * uy) / zoom
+            nu0, nu1, nv0, nv1 = min(u0, u), max(u1, u), min(v0, v), max(v1, v)
+            if nu1 - nu0 > w or nv1 - nv0 > h: break
+            u0, u1, v0, v1 = nu0, nu1, nv0, nv1
+
+        size = (w + int(math.ceil(u1 - u0)) + 2, h + int(math.ceil(v1 - v0)) + 2)
+        # the canvas center, as a map point, is the middle of the centers it holds
+        mu, mv = (u0 + u1) / 2, (v0 + v1) / 2
+        anchor = (center[0] + (mu * rx - mv * ux) * zoom, center[1] + (mu * ry - mv * uy) * zoom)
+
+        perf.count('rotate.canvas')
+        self.canvas = self.rotated_view(anchor, heading, zoom, size)
+        self.canvas_key, self.canvas_anchor = (heading, zoom), anchor
+
+    def _update_canvas(self, dirty):
+        """ transform the rects drawn on the map again, only the canvas pixels they cover """
+        for rect in dirty:
+            corners = [self._to_canvas(p) for p in ((rect[0], rect[1]), (rect[2], rect[1]), (rect[0], rect[3]), (rect[2], rect[3]))]
+            box = clip_rect((int(min(q[0] for q in corners)) - 2, int(min(q[1] for q in corners)) - 2,
+                             int(max(q[0] for q in corners)) + 3, int(max(q[1] for q in corners)) + 3), self.canvas.size)
+            if not box: continue
+
+            size = (box[2] - box[0], box[3] - box[1])
+            part = self.rotated_view(self._from_canvas((box[0] + size[0] / 2, box[1] + size[1] / 2)), self.canvas_key[0], self.canvas_key[1], size)
+            self.canvas.paste(part, box[:2])
+
+    def render_rotated(self, center, heading, zoom, cursor, ahead=()):
+        """
+        bytes of the heading-up viewport with the cursor on it, the last frame when nothing changed.
+
+        the map is turned once into a canvas for a heading and zoom, large enough for the ahead centers(the next frames
+        of the same heading and zoom), a frame is then a crop of it; the rects drawn on the map are turned into it again.
+        """
+        from PIL import ImageDraw
+
+        key = (center, heading, zoom, cursor)
+        dirty, self.dirty = self.dirty, []
+        if key == self.box and not dirty and self.frame is not None:
+            perf.count('frame.repeat')
+            return self.frame
+
+        w, h = self.size
+        box = None
+        if self.canvas is not None and self.canvas_key == (heading, zoom):
+            q = self._to_canvas(center)
+            box = int(round(q[0] - w / 2)), int(round(q[1] - h / 2))
+            if box[0] < 0 or box[1] < 0 or box[0] + w > self.canvas.width or box[1] + h > self.canvas.height: box = None
+
+        if box is None:
+            self._make_canvas(center, heading, zoom, ahead)
+            q = self._to_canvas(center)
+            box = int(round(q[0] - w / 2)), int(round(q[1] - h / 2))
+        elif dirty:
+            with perf.span('patch'):
+                self._update_canvas(dirty)
+
+        with perf.span('crop'):
+            view = self.canvas.crop((box[0], box[1], box[0] + w, box[1] + h))
+
+        with perf.span('draw'):
+            x, y = self._to_canvas(cursor)
+            x, y = x - box[0], y - box[1]
+            r = self.cursor_radius
+            ImageDraw.Draw(view).ellipse((x-r, y-r, x+r, y+r), fill=self.cursor_fill)
+
+        with perf.span('tobytes'):
+            self.frame = view.tobytes()
+
+        self.box, self.buf = key, None
+        return self.frame
+
+    def _to_view(self, rect):
+        return rect[0] - self.box[0], rect[1] - self.box[1], rect[2] - self.box[0], rect[3] - self.box[1]
+
+    def _cursor_rect(self, cursor):
+        x, y = cursor
+        m = self.cursor_radius + 2
+        return clip_rect((int(x) - m, int(y) - m, int(x) + m + 2, int(y) + m + 2), self.size)
+
+    def _crop(self, rect):
+        bx, by = self.box[:2]
+        return self.image.crop((rect[0] + bx, rect[1] + by, rect[2] + bx, rect[3] + by))
+
+    def _patch(self, rect, data):
+        x0, y0, x1, y1 = rect
+        row = (x1 - x0) * 4
+        offset = y0 * self.stride + x0 * 4
+
+        buf, view = self.buf, memoryview(data)
+        for i in range(y1 - y0):
+            buf[offset:offset+row] = view[i*row:(i+1)*row]
+            offset += self.stride
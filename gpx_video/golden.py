@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## golden frame check of the render loop(render_route with the starter, show_full_route and
+## draw_gauge): short synthetic rides(one written to a fit file and loaded back, for its speed
+## column) are rendered on the stub tiles of bench.py into memory, no network or ffmpeg. record keeps the hash of every frame, some frames as png and the
+## frames/s of every stage; check renders again and fails on any frame whose hash changed(the
+## sampled ones are compared with the png to show how much), or a stage slower than the recorded
+## frames/s / --slack. eg:
+##   ./golden.py record
+##   ./golden.py check --slack 1.5
+
+import sys
+import os
+
+import json
+import shutil
+import hashlib
+import tempfile
+import argparse
+
+from datetime import datetime, timezone
+
+import geotiler
+
+import util
+import perf
+import stats
+import track
+import bench
+import loading
+import zoomplan
+import gpx_to_route
+
+
+CASES = {
+    'loop': dict(points=600, shape='loop'),
+    'zigzag-stops': dict(points=900, shape='zigzag', stops=1, stop_compress=8),
+    'zoom-out': dict(points=600, shape='line', max_zoom_out=2.0),
+    'heading-up': dict(points=600, shape='zigzag', heading_up=True),
+    'fit-stops': dict(points=900, shape='zigzag', stops=1, stop_compress=8, format='fit'),
+}
+
+SIZE = (480, 270)
+FPS = 30
+ZOOM = 15
+SAMPLES = 8
+
+
+class MemorySink(object):
+    """ the hash of every frame, and the frames at the sample indexes """
+    def __init__(self, samples=()):
+        self.hashes = []
+        self.samples = set(samples)
+        self.frames = {}
+
+    def write(self, something):
+        i = len(self.hashes)
+        self.hashes.append(hashlib.blake2b(something, digest_size=8).hexdigest())
+        if i in self.samples: self.frames[i] = bytes(something)
+
+    def close(self):
+        pass
+
+
+def synthetic_ride(points, shape='loop', stops=0, start_time=datetime(2023, 10, 5, tzinfo=timezone.utc)):
+    """ track.Track and session of a bench ride, without writing and loading a file """
+    t0 = start_time.timestamp()
+    ride = track.Track.from_rows(((t0 + t, lon, lat) for t, lon, lat, _ in bench.synthetic_track(points, shape, stops=stops)), ('time', 'lon', 'lat'))
+
+    start_dt, end_dt = (datetime.fromtimestamp(ride['time'][i] / 1e9, timezone.utc) for i in (0, -1))
+    sess = stats.TrackStats(ride).session(start_dt, end_dt)
+    return ride, sess
+
+
+def loaded_ride(points, shape, stops, fmt, start_time=datetime(2023, 10, 5, tzinfo=timezone.utc)):
+    """ track.Track and session of a bench ride written to a gpx/fit file and loaded back, with the speed column of a fit file """
+    workdir = tempfile.mkdtemp(prefix='gpx-golden-')
+    try:
+        ride, sess, _ = loading.load_gps_data([bench.make_track_file(workdir, points, shape, fmt, stops, start_time)], timezone.utc)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return ride, sess
+
+
+def render_case(case, samples=()):
+    """ the sink holding the frames of the case and the frames/s of the stages """
+    perf.enable()
+    perf.reset()
+
+    if case.get('format'):
+        ride, sess = loaded_ride(case['points'], case['shape'], case.get('stops', 0), case['format'])
+    else:
+        ride, sess = synthetic_ride(case['points'], case['shape'], case.get('stops', 0))
+    timestamps, positions, sess = gpx_to_route.resample_gps_point(ride, sess, timezone.utc, FPS, False, case.get('stop_compress', 0))
+
+    photo_render = util.PhotoRender(None, timestamps, positions)
+    mm, extent, window_size = gpx_to_route.init_map_object(positions, False, SIZE, ZOOM, bench.stub_provider(),
+                                                                 limits=zoomplan.Limits(max_zoom_out=case.get('max_zoom_out', 1.0), heading_up=case.get('heading_up', False)))
+    map_image = geotiler.render_map(mm, downloader=bench.stub_downloader)
+
+    sink = MemorySink(samples)
+    write_counter = gpx_to_route.WriteCounter(sink)
+    with perf.span('frame_loop'):
+        gpx_to_route.render_route(write_counter, window_size, FPS, extent, mm, map_image, positions, timestamps, sess, photo_render,
+                                  case.get('max_zoom_out', 1.0), case.get('heading_up', False))
+
+    # the frames of the starter, the photos and the outro(with its hold) as render_route counted them written, the route is the rest
+    summary = perf.summary()
+    sec = lambda name: summary['spans'][name]['sec'] if name in summary['spans'] else 0.0
+    frames = {name: summary['counters'].get('frames.' + name, 0) for name in ('starter', 'photo', 'outro')}
+    frames['route'] = len(sink.hashes) - sum(frames.values())
+    spans = {'starter': sec('starter'), 'photo': sec('photo_frames'), 'outro': sec('outro')}
+    spans['route'] = sec('frame_loop') - sum(spans.values())
+
+    fps = {name: frames[name] / spans[name] if frames[name] and spans[name] > 0 else 0.0 for name in ('starter', 'route', 'photo', 'outro')}
+    return sink, window_size, fps
+
+
+def sample_indexes(frame_num, n=SAMPLES):
+    """ the first and last frame and some between, in all of the starter, the route and the outro """
+    return sorted(set([0, frame_num - 1] + [frame_num * k // (n - 1) for k in range(1, n - 1)]))
+
+
+def frame_image(data, size):
+    from PIL import Image
+    return Image.frombytes('RGB' if len(data) == size[0] * size[1] * 3 else 'RGBA', size, data)
+
+
+def frame_diff(a, b):
+    """ mean absolute difference(0..255) of the two frames """
+    from PIL import ImageChops, ImageStat
+
+    if a.size != b.size or a.mode != b.mode: return 255.0
+    return sum(ImageStat.Stat(ImageChops.difference(a, b)).mean) / len(a.getbands())
+
+
+def record(name, case, golden_dir):
+    # a first run to learn the frame count, the samples are taken in the second
+    sink, _, _ = render_case(case)
+    samples = sample_indexes(len(sink.hashes))
+    sink, window_size, fps = render_case(case, samples)
+
+    frame_dir = os.path.join(golden_dir, name)
+    shutil.rmtree(frame_dir, ignore_errors=True)
+    os.makedirs(frame_dir)
+    for i, data in sink.frames.items():
+        frame_image(data, window_size).save(os.path.join(frame_dir, '%05d.png' % i))
+
+    golden = {'case': case, 'size': list(window_size), 'fps': FPS, 'zoom': ZOOM, 'frames_per_sec': fps,
+              'samples': samples, 'hashes': sink.hashes}
+    with open(os.path.join(golden_dir, name + '.json'), 'w') as f: json.dump(golden, f, indent=1)
+
+    print('%s: %d frames recorded, %s' % (name, len(sink.hashes), ', '.join('%s %.1f fps' % x for x in fps.items())))
+    return True
+
+
+def check(name, golden_dir, slack=2.0, diff_dir=None):
+    """ True when every frame hash matches and no stage is slower than the golden fps / slack """
+    from PIL import Image, ImageChops
+
+    with open(os.path.join(golden_dir, name + '.json')) as f: golden = json.load(f)
+
+    sink, window_size, fps = render_case(golden['case'], golden['samples'])
+    errors = []
+
+    changed = [i for i, (a, b) in enumerate(zip(sink.hashes, golden['hashes'])) if a != b]
+    if len(sink.hashes) != len(golden['hashes']):
+        first = changed[0] if changed else min(len(sink.hashes), len(golden['hashes']))
+        errors.append('%d frames, the golden has %d, first changed %d' % (len(sink.hashes), len(golden['hashes']), first))
+    elif changed:
+        errors.append('%d of %d frames changed, first %d' % (len(changed), len(sink.hashes), changed[0]))
+
+        # how much the sampled frames changed
+        for i in golden['samples']:
+            if sink.hashes[i] == golden['hashes'][i]: continue
+
+            a = frame_image(sink.frames[i], window_size)
+            b = Image.open(os.path.join(golden_dir, name, '%05d.png' % i)).convert(a.mode)
+            errors.append('frame %d differs by %.2f' % (i, frame_diff(a, b)))
+            if diff_dir:
+                os.makedirs(diff_dir, exist_ok=True)
+                a.save(os.path.join(diff_dir, '%s-%05d.png' % (name, i)))
+                ImageChops.difference(a, b).save(os.path.join(diff_dir, '%s-%05d-diff.png' % (name, i)))
+
+    for stage, golden_fps in golden['frames_per_sec'].items():
+        if golden_fps and fps.get(stage, 0.0) < golden_fps / slack:
+            errors.append('%s %.1f fps, the golden is %.1f' % (stage, fps.get(stage, 0.0), golden_fps))
+
+    print('%s: %s, %s' % (name, 'FAIL' if errors else 'ok', ', '.join('%s %.1f fps' % x for x in fps.items())))
+    for e in errors: print('    ' + e)
+
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record or check the golden frames and speed of the render loop.')
+    parser.add_argument('command', choices=('record', 'check'))
+    parser.add_argument('case', nargs='*', help='cases to run, default all: ' + ', '.join(CASES))
+    parser.add_argument('--golden-dir', default=None, help='dir of the golden frames, default golden/ next to the script')
+    parser.add_argument('--slack', type=float, default=2.0, help='a stage fails when slower than the golden frames/s divided by it')
+    parser.add_argument('--diff-dir', default=None, help='save the failed frames and their differences to the dir')
+    args = parser.parse_args()
+
+    unknown = [x for x in args.case if x not in CASES]
+    if unknown: parser.error('unknown case: %s' % ', '.join(unknown))
+
+    args.golden_dir = os.path.abspath(args.golden_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden'))
+    if args.diff_dir: args.diff_dir = os.path.abspath(args.diff_dir)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    ok = True
+    for name in args.case or CASES:
+        if args.command == 'record':
+            os.makedirs(args.golden_dir, exist_ok=True)
+            ok = record(name, CASES[name], args.golden_dir) and ok
+        else:
+            ok = check(name, args.golden_dir, args.slack, args.diff_dir) and ok
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
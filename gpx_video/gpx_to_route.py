@@ -10,68 +10,158 @@ import shutil
 import pathlib
 import argparse
 import functools
+import importlib.util
 
 import subprocess
 
-from geopy.distance import geodesic
-
-import geotiler
-
-from PIL import Image, ImageDraw, ImageFont
+from dataclasses import dataclass, field, replace
 
 import util
+import perf
+import encoder
+import framebuf
+import timeline
+import simplify
+import camera
+import pipeline
+import probe
 import loading
+import zoomplan
 
 
 class WriteCounter(object):
-    def __init__(self, writer, frame_num=0):
+    def __init__(self, writer, frame_num=0, progress=None):
         self.writer = writer
         self.frame_num = 0
+        self.byte_num = 0
+        self.progress = progress
 
     def write(self, something):
         self.frame_num += 1
-        self.writer.write(something)
+        self.byte_num += len(something)
+        with perf.span('pipe_write'):
+            self.writer.write(something)
+
+        if self.progress is not None: self.progress.update(self.frame_num)
 
     def current_frame_num(self):
         return self.frame_num
 
 
+class NullSink(object):
+    """ stand-in for the ffmpeg stdin, drop every frame """
+    def write(self, something):
+        pass
+
+    def close(self):
+        pass
+
+
+class FinishedProc(object):
+    """ stand-in for a popen that has nothing to do """
+    pid, args, returncode = None, ['true'], 0
+    stdin = NullSink()
+
+    def wait(self):
+        return 0
+
+    def kill(self):
+        pass
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def open_tile_db(filename):
+    from sqlitedict import SqliteDict
+    return SqliteDict(filename=filename, autocommit=True)
+
+
+@functools.lru_cache(maxsize=None)
+def find_provider(provider_id):
+    import geotiler
+    return geotiler.provider.find_provider(provider_id)
+
+
+def tile_key(url, template, subdomains):
+    """ the tile cache key of the url: the url by the first subdomain, as geotiler cycles them over the tiles """
+    prefix = template.split('{subdomain}')[0]
+    if not subdomains or len(prefix) == len(template) or '{' in prefix or not url.startswith(prefix): return url
+
+    rest = url[len(prefix):]
+    for s in sorted(subdomains, key=len, reverse=True):
+        if rest.startswith(s): return prefix + subdomains[0] + rest[len(s):]
+    return url
+
+
+def memo(cache, key, make):
+    """ make() once per key when a warm cache(render server) is given """
+    if cache is None: return make()
+    return cache.get_or_make(key, make)
+
+
 def my_render_map(cache_dir=pathlib.Path('./'), cache_file='tilecache.sqlite', is_cache=True):
+    import geotiler
+
     if not is_cache:
         return geotiler.render_map
 
     from sqlitedict import SqliteDict
 
-    def sqlite_downloader(db: SqliteDict, timeout=3600*24*30):
+    def sqlite_downloader(db: SqliteDict, provider, timeout=3600*24*30):
         from geotiler.cache import caching_downloader
         from geotiler.tile.io import fetch_tiles
 
-        def get_key(key):
-            return db.get(key, None)
+        def get_key(url):
+            key = tile_key(url, provider.url, provider.subdomains)
+            value = db.get(key, None)
+            if value is None and key != url: value = db.get(url, None)   # cached by its own subdomain before
+            perf.count('tile_cache.miss' if value is None else 'tile_cache.hit')
+            return value
 
-        def set_key(key, value):
+        def set_key(url, value):
             if value:
-                db.setdefault(key, value)
+                db.setdefault(tile_key(url, provider.url, provider.subdomains), value)
+
+        async def counting_fetch_tiles(tiles, num_workers, **kw):
+            async for t in fetch_tiles(tiles, num_workers, **kw):
+                if t.img: perf.count('tile.bytes_downloaded', len(t.img))
+                yield t
 
-        return functools.partial(caching_downloader, get_key, set_key, fetch_tiles)
+        return functools.partial(caching_downloader, get_key, set_key, counting_fetch_tiles)
 
-    db = SqliteDict(filename=str(cache_dir.joinpath(cache_file)), autocommit=True)
-    downloader = sqlite_downloader(db)
-    return functools.partial(geotiler.render_map, downloader=downloader)
+    db = open_tile_db(str(cache_dir.joinpath(cache_file)))
 
+    def render_map(mm, **kw):
+        return geotiler.render_map(mm, downloader=sqlite_downloader(db, mm.provider), **kw)
+    return render_map
 
-def load_gps_point(filename, fps, is_mars_in_china):
-    timestamps, positions, sess = loading.load_gps_data(filename)
 
-    num_p = int(len(positions) / (240 / fps))
+def load_gps_point(filename, fps, is_mars_in_china, tz=None, stop_compress=0, straight_speedup=0, keep_times=()):
+    points, sess, tz = loading.load_gps_data(filename, tz)
 
-    r = 1.0 * len(positions) / num_p
-    new_positions = [positions[int(r*i)] for i in range(num_p)]
-    new_positions.append(positions[-1])
-    new_timestamps = [timestamps[int(r*i)] for i in range(num_p)]
-    new_timestamps.append(timestamps[-1])
+    return resample_gps_point(points, sess, tz, fps, is_mars_in_china, stop_compress, straight_speedup, keep_times)
 
-    print('origin gps num:%d, used gps num:%d' % (len(positions), len(new_positions)))
+
+def resample_gps_point(points, sess, tz, fps, is_mars_in_china, stop_compress=0, straight_speedup=0, keep_times=()):
+    """ timestamps and positions of the points of the track.Track shown as frames, only those are made objects """
+    if stop_compress > 1 or straight_speedup > 1:
+        weights = timeline.point_weights(points.seconds(), points.positions(), stop_compress, straight_speedup, points['speed'])
+        keep_index = timeline.keep_index_of(points['time'], [int(dt.timestamp() * 1e9) for dt in keep_times])
+        index = timeline.select_frames(weights, 240 / fps, keep_index)
+    else:
+        num_p = int(len(points) / (240 / fps))
+
+        r = 1.0 * len(points) / num_p
+        index = [int(r*i) for i in range(num_p)]
+        index.append(len(points) - 1)
+
+    frames = points.take(index)
+    new_timestamps, new_positions = frames.timestamps(tz), frames.positions()
+
+    print('origin gps num:%d, used gps num:%d' % (len(points), len(new_positions)))
 
     if is_mars_in_china: new_positions = util.fix_mars_in_china(new_positions)
 
@@ -93,16 +183,12 @@ def view_window(window_size, map_size, current_p):
     return (lr[0], tb[0]), (lr[1], tb[1])
 
 
-def init_map_object(positions, auto_orientation, video_size, zoom, provider):
+def init_map_object(positions, auto_orientation, video_size, zoom, provider, zoom_out=0, limits=None):
+    import geotiler
+
     x, y = zip(*positions)
     extent = min(x), min(y), max(x), max(y)
 
-    if zoom == 0:
-        distance = geodesic((extent[1], extent[0]), (extent[3], extent[2])).km
-        print('max distance: ', distance)
-
-        zoom = 14 if distance > 7.0 else 15
-
     if auto_orientation:
         if (extent[2] - extent[0]) > (extent[3] - extent[1]):
             # landscape
@@ -111,25 +197,48 @@ def init_map_object(positions, auto_orientation, video_size, zoom, provider):
             # portrait
             video_size = [min(video_size), max(video_size)]
 
+    if limits is None: limits = zoomplan.Limits()
+    if zoom == 0:
+        zoom = zoomplan.choose_zoom(positions, video_size, limits)
+    else:
+        zoomplan.check_zoom(positions, video_size, zoom, limits)
+
+    zoom = max(1, zoom - zoom_out)
+
     mm = geotiler.Map(extent=extent, zoom=zoom, provider=provider)
 
     # mm = geotiler.Map(size=(mm.size[0]+video_size[0], mm.size[1]+video_size[1]), extent=extent, provider=provider)
-    mm.size = max(video_size[0], mm.size[0]+video_size[0]//2), max(video_size[1], mm.size[1]+video_size[1]//2)
+    if limits.heading_up:
+        # a window turned to any heading(and zoomed out) around a center over the route stays on the map
+        pad = map_padding(video_size, limits)
+        mm.size = mm.size[0] + 2 * pad, mm.size[1] + 2 * pad
+    else:
+        mm.size = max(video_size[0], mm.size[0]+video_size[0]//2), max(video_size[1], mm.size[1]+video_size[1]//2)
 
     print('map size:', mm.size, ', map zoom:', mm.zoom, ', map extent:', mm.extent)
 
     return mm, extent, video_size
 
 
-def rotate_image(image, current_p, i, fps):
-    return image
+def map_padding(video_size, limits):
+    """ map pixels around the route of the heading-up mode: half the diagonal of the window zoomed out the most """
+    return int(math.ceil(math.hypot(*video_size) / 2 * limits.max_zoom_out)) + 2
 
-    image_rotated = image.rotate((i*2/fps) % 360, center=current_p)
 
-    return image_rotated
+def same_view_runs(headings, zooms, max_len):
+    """ end(exclusive) of the frames from every frame on having the same heading and zoom, at most max_len of them """
+    n = len(headings)
+    ends = [n] * n
+    for i in range(n - 2, -1, -1):
+        if (headings[i], zooms[i]) == (headings[i+1], zooms[i+1]): ends[i] = ends[i+1]
+        else: ends[i] = i + 1
+    return [min(e, i + max_len) for i, e in enumerate(ends)]
 
 
+@functools.lru_cache(maxsize=64)
 def find_best_font(text, window_size, align='center', font_file='./font/Gidole-Regular.ttf'):
+    from PIL import ImageFont
+
     align_list = ('center', '1/3')
 
     if align not in align_list: align = align_list[0]
@@ -148,6 +257,8 @@ def find_best_font(text, window_size, align='center', font_file='./font/Gidole-R
 
 
 def draw_gauge(im, sess):
+    from PIL import ImageDraw
+
     if sess.total_distance == 0: return im
 
     hour = int(sess.total_moving_time)
@@ -156,22 +267,23 @@ def draw_gauge(im, sess):
     text = 'distance: %.1f km, elevation: %d m\ntime: %s, speed: %.1f km/h' %  (sess.total_distance, sess.total_ascent, time_text, sess.avg_speed)
     if im.width < im.height: text = text.replace(', ', '\n')
 
-    if not hasattr(draw_gauge, 'font'):
-        draw_gauge.font = find_best_font(text, im.size)
-    text_spacing = draw_gauge.font.size // 3
+    font = find_best_font(text, im.size)
+    text_spacing = font.size // 3
 
     draw = ImageDraw.Draw(im)
-    box = draw.textbbox((0, 0), text, draw_gauge.font, spacing=text_spacing)
+    box = draw.textbbox((0, 0), text, font, spacing=text_spacing)
 
     x = (im.width // 2) - ((box[2] - box[0]) // 2)
     y = (im.height // 3) - ((box[3] - box[1]) // 2)
 
-    draw.text((x, y), text, fill=(0, 0, 255), font=draw_gauge.font, spacing=text_spacing)
+    draw.text((x, y), text, fill=(0, 0, 255), font=font, spacing=text_spacing)
 
     return im
 
 
 def show_starter(write_counter, im, sess, fps, time_in_sec=3):
+    from PIL import ImageDraw
+
     text_date = sess.start_time.strftime('%B %d, %Y')
 
     text_begin_time = sess.start_time.strftime('%H:%M:%S')
@@ -202,7 +314,7 @@ def show_starter(write_counter, im, sess, fps, time_in_sec=3):
         write_counter.write(im.tobytes())
 
 
-def show_full_route(writer, mm, map_image, extent, window_size, fps, current_p, sess, time_in_sec=3):
+def show_full_route(writer, mm, map_image, extent, window_size, fps, current_p, sess, time_in_sec=3, scaled_maps=None):
     num_frame = int(fps * time_in_sec)
 
     p1, p2 = mm.rev_geocode((extent[0], extent[1])), mm.rev_geocode((extent[2], extent[3]))
@@ -228,7 +340,13 @@ def show_full_route(writer, mm, map_image, extent, window_size, fps, current_p,
         p1, p2 = view_window((box_width, box_height), map_image.size, new_current_p)
         # print(i, new_current_p, p1, p2)
 
-        image_view = map_image.resize(window_size, box=(p1[0], p1[1], p2[0], p2[1]))
+        # the zoomed out frames are shrunk from the map of the nearest level above, with the route simplified for it
+        k = scaled_maps.level_of(box_width / window_size[0]) if scaled_maps else 0
+        if k:
+            box = tuple(x / 2 ** k for x in (p1[0], p1[1], p2[0], p2[1]))
+            image_view = scaled_maps.image(k).resize(window_size, box=box)
+        else:
+            image_view = map_image.resize(window_size, box=(p1[0], p1[1], p2[0], p2[1]))
         image_view = draw_gauge(image_view, sess)
 
         writer.write(image_view.tobytes())
@@ -236,65 +354,98 @@ def show_full_route(writer, mm, map_image, extent, window_size, fps, current_p,
     for i in range(2 * fps): writer.write(image_view.tobytes())
 
 
-def smooth_center(rev_geocode, location_list, i, window2=7):
-    start, end = max(0, i-window2), min(len(location_list), i+window2)
-    p_list = [rev_geocode(l) for l in location_list[start:end]]
+def open_video_sink(output, window_size, fps, is_release, profile=None, outputs=()):
+    cmd_string = util.splice_main_cmd_string(output, window_size, fps, is_release, profile, outputs)
 
-    x = sum([a for a, _ in p_list]) / len(p_list)
-    y = sum([a for _, a in p_list]) / len(p_list)
+    return perf.popen(cmd_string, 'ffmpeg.encode', stdin=subprocess.PIPE)
 
-    # print(rev_geocode(location_list[i]), (x, y))
 
-    return (x, y)
+def estimate_frame_num(timestamps, fps, photo_render):
+    """ starter + one frame per gps point + photos + full route """
+    return fps * 3 + len(timestamps) + photo_render.frame_num(fps) + int(fps * 3) + 2 * fps
 
 
-def render_route(output, window_size, fps, extent, mm, map_image, positions, timestamps, sess, is_release):
-    cmd_string = util.splice_main_cmd_string(output, window_size, fps, is_release)
-
-    p = subprocess.Popen(cmd_string, stdin=subprocess.PIPE)
-    write_counter = WriteCounter(p.stdin)
+def render_route(write_counter, window_size, fps, extent, mm, map_image, positions, timestamps, sess, photo_render, max_zoom_out=1.0, heading_up=False):
+    from PIL import ImageDraw
 
     draw = ImageDraw.Draw(map_image)
 
     line_width = 5
+    cursor_radius = line_width
+    frame_buffer = framebuf.FrameBuffer(map_image, window_size, cursor_radius)
+
+    with perf.span('lod'):
+        plots_list = [mm.rev_geocode(p) for p in positions]
+        lod = simplify.RouteLOD(plots_list)
+        vertex_set = set(lod.index())
+
+        max_r = min(map_image.size[0] / window_size[0], map_image.size[1] / window_size[1])
+        scaled_maps = simplify.ScaledMaps(map_image, lod, max_r, line_width)
+    print('route lod points:', lod.stats())
+
+    with perf.span('camera'):
+        # turned to any heading the cursor may be off along the short side, so heading up plans on a square of it
+        camera_window = (min(window_size), min(window_size)) if heading_up else window_size
+        centers, zooms = camera.plan_camera(plots_list, camera_window, fps, min(max_zoom_out, max_r))
+        if heading_up:
+            headings = camera.plan_heading(plots_list, fps)
+            view_ends = same_view_runs(headings, zooms, 10 * fps)
+
+            # the map is padded by the turned window around the route(init_map_object), a center kept over the route stays on it
+            xs, ys = [p[0] for p in plots_list], [p[1] for p in plots_list]
+            centers = [(max(min(xs), min(max(xs), x)), max(min(ys), min(max(ys), y))) for x, y in centers]
+
+    # the points between two vertexes of the lod are within half a pixel of the line joining them,
+    # so the trail waits for the next vertex as long as its end is still under the cursor
+    max_gap = cursor_radius - line_width / 2
+    tail = plots_list[0]
     clip_starttime_list = []
+    photo_render.start(timestamps, window_size)
     for i, dt in enumerate(timestamps):
-        if i == 0:
-            plots = [mm.rev_geocode(positions[i]), mm.rev_geocode(positions[i])]
-        else:
-            plots = [mm.rev_geocode(positions[i-1]), mm.rev_geocode(positions[i])]
-            draw.line(plots, fill=(255, 0, 0), width=line_width)
-
-        # center_point = plots[1]
-        center_point = smooth_center(mm.rev_geocode, positions, i)
-        p1, p2 = view_window(window_size, map_image.size, center_point)
-        image_view = map_image.crop((p1[0], p1[1], p2[0], p2[1]))
-
-        if i == 0: show_starter(write_counter, image_view, sess, fps)
+        current_p = plots_list[i]
 
-        new_plot_1 = (plots[1][0] - p1[0], plots[1][1] - p1[1])
+        with perf.span('draw'):
+            if current_p != tail and (i in vertex_set or math.dist(tail, current_p) > max_gap):
+                draw.line([tail, current_p], fill=(255, 0, 0), width=line_width)
+                frame_buffer.invalidate(framebuf.line_rect(tail, current_p, line_width))
+                tail = current_p
+                perf.count('trail.line')
 
-        new_draw = ImageDraw.Draw(image_view)
-        x, y = new_plot_1
-        new_draw.ellipse((x-line_width, y-line_width, x+line_width, y+line_width), fill=(255, 255, 255))
+        center_point, zoom = centers[i], zooms[i]
+        view_size = (window_size[0] * zoom, window_size[1] * zoom) if zoom > 1 else window_size
+        if not heading_up: p1, p2 = view_window(view_size, map_image.size, center_point)
 
-        # image_view = rotate_image(image_view, new_plot_1, i, fps)
-
-        write_counter.write(image_view.tobytes())
+        if i == 0:
+            starter_start = write_counter.current_frame_num()
+            with perf.span('starter'):
+                if heading_up:
+                    im = frame_buffer.rotated_view(center_point, headings[i], zoom)
+                else:
+                    box = (p1[0], p1[1], p2[0], p2[1])
+                    im = map_image.resize(window_size, box=box) if zoom > 1 else map_image.crop(box)
+                show_starter(write_counter, im, sess, fps)
+            perf.count('frames.starter', write_counter.current_frame_num() - starter_start)
+
+        if heading_up:
+            frame = frame_buffer.render_rotated(center_point, headings[i], zoom, current_p, centers[i+1:view_ends[i]])
+        elif zoom > 1:
+            frame = frame_buffer.render_scaled((p1[0], p1[1], p2[0], p2[1]), current_p)
+        else:
+            frame, _ = frame_buffer.render((p1[0], p1[1], p2[0], p2[1]), current_p)
+        write_counter.write(frame)
 
-        photo_info_list = photo_render.render_photo_if_need(p.stdin, write_counter, window_size, dt, fps)
+        photo_info_list = photo_render.insert_at(write_counter, i, fps)
 
         clip_starttime_list.extend([(pi.photo_name, write_counter.current_frame_num()/fps) for pi in photo_info_list if pi.is_video])
 
-    show_full_route(write_counter, mm, map_image, extent, window_size, fps, plots[1], sess)
+    photo_render.close()
 
-    print('frame num:', write_counter.current_frame_num())
+    route_end = write_counter.current_frame_num()
+    with perf.span('outro'):
+        show_full_route(write_counter, mm, map_image, extent, window_size, fps, current_p, sess, scaled_maps=scaled_maps)
+    perf.count('frames.outro', write_counter.current_frame_num() - route_end)
 
-    # p.stdin.flush()
-    p.stdin.close(); p.wait()
-
-    map_image.save(output+'.png')
-    shutil.copy2(output, output+'.route.mp4')
+    print('frame num:', write_counter.current_frame_num())
 
     return clip_starttime_list
 
@@ -304,15 +455,26 @@ def scale_video_clip(video_list, window_size, fps):
     for video in video_list:
         outfile = video + '.' + str(window_size) + '.scale.mp4'
 
-        if not os.path.exists(outfile):
+        try:
+            is_matched = probe.matches(probe.probe(video), window_size, fps)
+        except (subprocess.CalledProcessError, ValueError) as e:
+            # ffprobe can not read it, leave it to ffmpeg
+            print('probe failed: %s, %s' % (video, e))
+            is_matched = False
+
+        if is_matched:
+            # already of the size and fps
+            outfile = video
+            p = FinishedProc()
+        elif not os.path.exists(outfile):
             print('scale clip:', video)
             cmd_string = util.splice_scale_cmd_string(video, outfile, window_size, fps)
-        else:
-            cmd_string = ['true']
 
-        ## NOTE: MUST open it with stdin when run parallel, https://stackoverflow.com/a/6659191/1079820
-        p = subprocess.Popen(cmd_string, stdin=subprocess.PIPE)
-        # p.stdin.close(); p.wait()
+            ## NOTE: MUST open it with stdin when run parallel, https://stackoverflow.com/a/6659191/1079820
+            p = perf.popen(cmd_string, 'ffmpeg.scale', stdin=subprocess.PIPE)
+            # p.stdin.close(); p.wait()
+        else:
+            p = FinishedProc()
 
         clip_scale_proc_dict[video] = [p, outfile]
 
@@ -323,7 +485,7 @@ def wait_proc_and_add_silent_audio(clip_starttime_list, clip_scale_proc_dict, ke
     new_clip_starttime_list = []
     for clip, starttime in clip_starttime_list:
         p, clip = clip_scale_proc_dict[clip]
-        p.stdin.close(); p.wait()
+        p.stdin.close(); perf.wait(p)
 
         if keep_audio and not util.exists_audio(clip):
             new_clip = clip + '.silent.mp4'
@@ -335,7 +497,7 @@ def wait_proc_and_add_silent_audio(clip_starttime_list, clip_scale_proc_dict, ke
     return new_clip_starttime_list
 
 
-def ffmpeg_concat_main_and_clip(main_video, clip_starttime_list, keep_audio, is_release):
+def ffmpeg_concat_main_and_clip(main_video, clip_starttime_list, keep_audio, is_release, profile=None):
     if not clip_starttime_list: return
 
     clip_list, filter_complex = [], []
@@ -367,8 +529,8 @@ def ffmpeg_concat_main_and_clip(main_video, clip_starttime_list, keep_audio, is_
     # print(filter_complex)
 
     outfile = main_video + '.concat.mp4'
-    cmd_string = util.splice_concat_cmd_string2([main_video] + clip_list, outfile, ''.join(filter_complex), video_map, audio_map, is_release)
-    subprocess.run(cmd_string)
+    cmd_string = util.splice_concat_cmd_string2([main_video] + clip_list, outfile, ''.join(filter_complex), video_map, audio_map, is_release, profile)
+    perf.run(cmd_string, 'ffmpeg.concat')
 
     os.rename(outfile, main_video)
 
@@ -400,7 +562,7 @@ def ffmpeg_add_audio(video_file, audio_file, outfile=None):
         rename = False
 
     cmd_string = util.splice_audio_cmd_string(outfile, video_file, audio_file)
-    subprocess.run(cmd_string)
+    perf.run(cmd_string, 'ffmpeg.audio')
 
     if rename: os.rename(outfile, video_file)
 
@@ -408,90 +570,308 @@ def ffmpeg_add_audio(video_file, audio_file, outfile=None):
 ffmpeg_add_silent_audio = functools.partial(ffmpeg_add_audio, audio_file=None)
 
 
-#
-# parse arguments
-#
-desc = """
-Read positions from set of GPX files and draw them on a map.
-"""
-
-parser = argparse.ArgumentParser(description=desc)
-parser.add_argument(
-    '-v', '--verbose', dest='verbose', help='Make a bunch of noise',
-    action='store_true'
-)
-parser.add_argument(
-    '--cache-dir', dest='cache_dir', type=pathlib.Path, default=pathlib.Path.home() / '.cache/geotiler/',
-    help='location of cache(map tile, ...)'
-)
-parser.add_argument(
-    '--release', dest='is_release', action='store_true',
-    help='set it when the video is to publish'
-)
-providers = geotiler.providers()
-parser.add_argument(
-    '-p', '--provider', dest='provider', choices=providers, default='osm',
-    help='map provider id'
-)
-parser.add_argument(
-    '-s', '--size', dest='size', nargs=2, type=int, default=(540, 960),
-    help='size of map image'
-)
-parser.add_argument(
-    '--auto-orientation', dest='auto_orientation', action='store_true',
-    help='swap the size by the shape of route automatically'
-)
-parser.add_argument(
-    '-z', '--zoom', dest='zoom', type=int, default=0,
-    help='zoom of map'
-)
-parser.add_argument(
-    '-f', '--fps', dest='fps', type=int, default=30,
-    help='fps of video'
-)
-parser.add_argument(
-    '--audio', dest='audio', default = None,
-    help='the audio to play'
-)
-parser.add_argument(
-    '--photo', dest='photo', default = None,
-    help='a file with photo name and [or] datetime as line'
-)
-parser.add_argument(
-    '--keep-audio', dest='keep_audio', action='store_true',
-    help='keep the clip audio or not'
-)
-parser.add_argument('filename', nargs='+', help='GPX file')
-parser.add_argument('output', help='Output video file')
-
-args = parser.parse_args()
-
-args.cache_dir.mkdir(parents=True, exist_ok=True)
-
-provider = geotiler.provider.find_provider(args.provider)
-is_mars_in_china = provider.name.endswith('.mars_in_china')
-
-print('load gps data...')
-timestamps, positions, sess = load_gps_point(args.filename, args.fps, is_mars_in_china)
-
-photo_render = util.PhotoRender(args.photo, timestamps, positions, is_mars_in_china, args.is_release)
-photo_render.debug()
-
-print('render_map...')
-mm, extent, args.size = init_map_object(positions, args.auto_orientation, args.size, args.zoom, provider)
-clip_scale_proc_dict = scale_video_clip(photo_render.videos(), args.size, args.fps)
-map_image = my_render_map(args.cache_dir)(mm)
-
-photo_render.draw_camera_icon(mm, map_image)
-
-print('render route...')
-clip_starttime_list = render_route(args.output, args.size, args.fps, extent, mm, map_image, positions, timestamps, sess, args.is_release)
-
-if args.keep_audio: ffmpeg_add_audio(args.output, args.audio)
-
-print('wait scale...')
-new_clip_starttime_list = wait_proc_and_add_silent_audio(clip_starttime_list, clip_scale_proc_dict, args.keep_audio)
-
-print('concat clips...')
-ffmpeg_concat_main_and_clip(args.output, new_clip_starttime_list, args.keep_audio, args.is_release)
-if not args.keep_audio and args.audio: ffmpeg_add_audio(args.output, args.audio)
+def finish_output(output, clip_starttime_list, clip_scale_proc_dict, config):
+    """ add the audio and the clips to the route video, return the clip list inserted """
+    shutil.copy2(output, output+'.route.mp4')
+
+    with perf.span('audio'):
+        if config.keep_audio: ffmpeg_add_audio(output, config.audio)
+
+    print('wait scale...')
+    with perf.span('scale'):
+        new_clip_starttime_list = wait_proc_and_add_silent_audio(clip_starttime_list, clip_scale_proc_dict, config.keep_audio)
+
+    print('concat clips...')
+    with perf.span('concat'):
+        ffmpeg_concat_main_and_clip(output, new_clip_starttime_list, config.keep_audio, config.is_release, config.encoder)
+        if not config.keep_audio and config.audio: ffmpeg_add_audio(output, config.audio)
+
+    return new_clip_starttime_list
+
+
+def provider_ids():
+    """ ids of the geotiler map providers, read from its source dir without importing geotiler """
+    spec = importlib.util.find_spec('geotiler')
+    if spec is None or not spec.submodule_search_locations: return []
+
+    source_dir = pathlib.Path(spec.submodule_search_locations[0], 'source')
+    return sorted(x.stem for x in source_dir.glob('*.json'))
+
+
+@dataclass
+class RenderConfig(object):
+    filename: list
+    output: str
+    provider: str = 'osm'
+    size: tuple = (540, 960)
+    zoom: int = 0
+    fps: int = 30
+    is_release: bool = False
+    auto_orientation: bool = False
+    audio: str = None
+    photo: str = None
+    keep_audio: bool = False
+    cache_dir: pathlib.Path = field(default_factory=lambda: pathlib.Path.home() / '.cache/geotiler/')
+    encoder: str = None
+    stop_compress: int = 0
+    straight_speedup: int = 0
+    max_zoom_out: float = 1.0
+    heading_up: bool = False
+    cluster_icons: int = 0
+    preview: bool = False
+    outputs: list = field(default_factory=list)
+    queue_depth: int = 8
+    max_mem: int = 0
+    max_tiles: int = 4000
+    profile_out: str = None
+    verbose: bool = False
+    tz: object = None
+
+    def validate(self):
+        """ cheap checks before any heavy import, raise ValueError """
+        missing = [x for x in self.filename if not os.path.exists(x)]
+        if missing: raise ValueError('gps file not found: %s' % ', '.join(missing))
+
+        for x in self.filename:
+            if pathlib.Path(x).suffix.lower() not in ('.gpx', '.fit'):
+                raise ValueError(f"Don't recognise filetype from {x} - support .gpx and .fit")
+
+        providers = provider_ids()
+        if providers and self.provider not in providers:
+            raise ValueError('unknown map provider: %s, choose from: %s' % (self.provider, ', '.join(providers)))
+
+        if len(self.size) != 2 or min(self.size) <= 0: raise ValueError('bad video size: %s' % (self.size, ))
+        if self.fps <= 0: raise ValueError('bad fps: %d' % self.fps)
+        if self.zoom < 0: raise ValueError('bad zoom: %d' % self.zoom)
+        if self.max_zoom_out < 1: raise ValueError('bad max zoom out: %s' % self.max_zoom_out)
+        if self.max_mem < 0: raise ValueError('bad max mem: %d' % self.max_mem)
+        if self.max_tiles < 0: raise ValueError('bad max tiles: %d' % self.max_tiles)
+        for _, out_size in self.outputs:
+            if len(out_size) != 2 or min(out_size) <= 0: raise ValueError('bad output size: %s' % (out_size, ))
+
+        encoder.get_profile(self.encoder, self.is_release)
+
+        if self.audio and not os.path.exists(self.audio): raise ValueError('audio not found: %s' % self.audio)
+        if self.photo and not os.path.exists(self.photo): raise ValueError('photo file not found: %s' % self.photo)
+
+        return self
+
+
+def render(config, make_progress=perf.Progress, cache=None):
+    """
+    render the route video of config.filename to config.output, return the clip list inserted.
+
+    make_progress(total) gives the object told of every frame written, it may raise RenderCancelled to stop;
+    cache keeps parsed tracks and rendered maps between calls(see render_server.py).
+    """
+    config.validate()
+
+    if config.preview:
+        # half size, at most 15 fps, the map one zoom level out and the cheapest encoder
+        config = replace(config, size=tuple(x // 4 * 2 for x in config.size), fps=min(config.fps, 15), encoder=config.encoder or 'preview',
+                         outputs=[(x, tuple(y // 4 * 2 for y in out_size)) for x, out_size in config.outputs])
+
+    if config.profile_out: perf.enable()
+
+    config.cache_dir = pathlib.Path(config.cache_dir)
+    config.cache_dir.mkdir(parents=True, exist_ok=True)
+    probe.open_cache(config.cache_dir / 'probe.json')
+
+    provider = find_provider(config.provider)
+    is_mars_in_china = provider.name.endswith('.mars_in_china')
+
+    with perf.span('photo'):
+        photo_render = util.PhotoRender(config.photo, None, None, is_mars_in_china, config.is_release, config.cache_dir / 'media.json')
+    keep_times = tuple(sorted(photo_render.times()))
+
+    print('load gps data...')
+    with perf.span('load'):
+        track_key = ('track', tuple((x, os.path.getmtime(x)) for x in config.filename), config.fps, is_mars_in_china,
+                     config.stop_compress, config.straight_speedup, keep_times)
+        timestamps, positions, sess = memo(cache, track_key, lambda: load_gps_point(
+            config.filename, config.fps, is_mars_in_china, config.tz, config.stop_compress, config.straight_speedup, keep_times))
+
+    photo_render.locate(timestamps, positions)
+    photo_render.debug()
+
+    print('render_map...')
+    with perf.span('map_render'):
+        limits = zoomplan.Limits(config.max_mem * 1e6, config.max_tiles, config.fps, config.max_zoom_out, config.heading_up)
+        mm, extent, size = init_map_object(positions, config.auto_orientation, config.size, config.zoom, provider, int(config.preview), limits)
+        clip_scale_proc_dict = scale_video_clip(photo_render.videos(), size, config.fps)
+        map_key = ('map', provider.name, mm.zoom, tuple(mm.extent), tuple(mm.size))
+        map_image = memo(cache, map_key, lambda: my_render_map(config.cache_dir)(mm)).copy()
+
+        photo_render.draw_camera_icon(mm, map_image, cluster_radius=config.cluster_icons)
+
+    print('render route...')
+    p = open_video_sink(config.output, size, config.fps, config.is_release, config.encoder, config.outputs)
+    pipe = pipeline.PipeWriter(p.stdin, config.queue_depth) if config.queue_depth > 0 else p.stdin
+    progress = make_progress(estimate_frame_num(timestamps, config.fps, photo_render))
+    try:
+        with perf.span('frame_loop'):
+            clip_starttime_list = render_route(WriteCounter(pipe, progress=progress), size, config.fps, extent, mm, map_image, positions, timestamps, sess, photo_render,
+                                               config.max_zoom_out, config.heading_up)
+    except BaseException:
+        photo_render.close()
+        p.kill()
+        if pipe is not p.stdin: pipe.abort()
+        p.wait()
+        for x, _ in clip_scale_proc_dict.values(): x.kill(); x.wait()
+        raise
+    finally:
+        progress.close()
+
+    with perf.span('encode'):
+        # p.stdin.flush()
+        pipe.close(); perf.wait(p)
+
+    map_image.save(config.output+'.png')
+
+    # the clips of the other outputs are scaled while the main one is finished
+    extra_list = [(x, scale_video_clip(photo_render.videos(), out_size, config.fps)) for x, out_size in config.outputs]
+
+    new_clip_starttime_list = finish_output(config.output, clip_starttime_list, clip_scale_proc_dict, config)
+    for output, proc_dict in extra_list:
+        finish_output(output, clip_starttime_list, proc_dict, config)
+
+    probe.save()
+    if config.profile_out: perf.save(config.profile_out)
+
+    return new_clip_starttime_list
+
+
+def make_parser():
+    #
+    # parse arguments
+    #
+    desc = """
+    Read positions from set of GPX files and draw them on a map.
+    """
+
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument(
+        '-v', '--verbose', dest='verbose', help='Make a bunch of noise',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--cache-dir', dest='cache_dir', type=pathlib.Path, default=pathlib.Path.home() / '.cache/geotiler/',
+        help='location of cache(map tile, ...)'
+    )
+    parser.add_argument(
+        '--release', dest='is_release', action='store_true',
+        help='set it when the video is to publish'
+    )
+    parser.add_argument(
+        '-p', '--provider', dest='provider', default='osm',
+        help='map provider id, one of the geotiler source/*.json'
+    )
+    parser.add_argument(
+        '-s', '--size', dest='size', nargs=2, type=int, default=(540, 960),
+        help='size of map image'
+    )
+    parser.add_argument(
+        '--auto-orientation', dest='auto_orientation', action='store_true',
+        help='swap the size by the shape of route automatically'
+    )
+    parser.add_argument(
+        '-z', '--zoom', dest='zoom', type=int, default=0,
+        help='zoom of map, 0 for the most detailed one within --max-mem/--max-tiles'
+    )
+    parser.add_argument(
+        '-f', '--fps', dest='fps', type=int, default=30,
+        help='fps of video'
+    )
+    parser.add_argument(
+        '--audio', dest='audio', default = None,
+        help='the audio to play'
+    )
+    parser.add_argument(
+        '--photo', dest='photo', default = None,
+        help='a file with photo name and [or] datetime as line, or a dir of photos and videos'
+    )
+    parser.add_argument(
+        '--keep-audio', dest='keep_audio', action='store_true',
+        help='keep the clip audio or not'
+    )
+    parser.add_argument(
+        '--encoder', dest='encoder', default=None,
+        help='encoder profile in encoder_profiles.json, default by --release'
+    )
+    parser.add_argument(
+        '--stop-compress', dest='stop_compress', type=int, default=0,
+        help='play the stops(slower than 3.6km/h for a minute) N times faster'
+    )
+    parser.add_argument(
+        '--straight-speedup', dest='straight_speedup', type=int, default=0,
+        help='play the straight stretches N times faster'
+    )
+    parser.add_argument(
+        '--max-zoom-out', dest='max_zoom_out', type=float, default=1.0,
+        help='zoom the map out up to N times when riding fast, 1 for a fixed zoom'
+    )
+    parser.add_argument(
+        '--heading-up', dest='heading_up', action='store_true',
+        help='turn the map to the riding direction'
+    )
+    parser.add_argument(
+        '--cluster-icons', dest='cluster_icons', type=int, default=0,
+        help='draw the photo icons closer than N pixels as one with the count on it'
+    )
+    parser.add_argument(
+        '--preview', dest='preview', action='store_true',
+        help='a quick look: half size, 15 fps, the map one zoom out and the preview encoder'
+    )
+    parser.add_argument(
+        '--also-output', dest='outputs', nargs=3, action='append', default=[], metavar=('FILE', 'WIDTH', 'HEIGHT'),
+        help='encode another video of the size from the same frames(the middle of them when the aspect differs)'
+    )
+    parser.add_argument(
+        '--queue-depth', dest='queue_depth', type=int, default=8,
+        help='frames queued for the ffmpeg writer thread, 0 to write from the render loop'
+    )
+    parser.add_argument(
+        '--max-mem', dest='max_mem', type=int, default=0,
+        help='MB the map may take while rendering when the zoom is chosen(-z 0), 0 for half of the memory'
+    )
+    parser.add_argument(
+        '--max-tiles', dest='max_tiles', type=int, default=4000,
+        help='tiles the map may have when the zoom is chosen(-z 0), 0 for no limit'
+    )
+    parser.add_argument(
+        '--profile-out', dest='profile_out', default=None,
+        help='save stage and per-frame timing in chrome trace format to the file'
+    )
+    parser.add_argument('filename', nargs='+', help='GPX file')
+    parser.add_argument('output', help='Output video file')
+
+    return parser
+
+
+def config_from_args(args):
+    return RenderConfig(
+        filename=args.filename, output=args.output, provider=args.provider, size=tuple(args.size),
+        zoom=args.zoom, fps=args.fps, is_release=args.is_release, auto_orientation=args.auto_orientation,
+        audio=args.audio, photo=args.photo, keep_audio=args.keep_audio, cache_dir=args.cache_dir,
+        encoder=args.encoder, stop_compress=args.stop_compress, straight_speedup=args.straight_speedup,
+        max_zoom_out=args.max_zoom_out, heading_up=args.heading_up,
+        cluster_icons=args.cluster_icons, preview=args.preview,
+        outputs=[(x, (int(w), int(h))) for x, w, h in args.outputs], queue_depth=args.queue_depth,
+        max_mem=args.max_mem, max_tiles=args.max_tiles, profile_out=args.profile_out, verbose=args.verbose,
+    )
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+
+    try:
+        config = config_from_args(args).validate()
+    except ValueError as e:
+        parser.error(str(e))
+
+    render(config)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## the rides of a season on one map: the gps files are loaded, projected and simplified in a
+## process pool one by one, their segments are indexed by the map tile(256 px at the zoom) they
+## fall in, and only the tiles with data are rasterized, in parallel, as the number of rides
+## over every pixel(density) or the rides colored by date. eg:
+##   ./heatmap.py -z 12 -o season.png --mode density ~/rides/2023-*.fit
+
+import sys
+import os
+
+import math
+import pathlib
+import argparse
+
+from datetime import datetime, timezone
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import simplify
+
+
+TILE_SIZE = 256
+# 400 MB of rgba
+MAX_PIXELS = 100 * 2**20
+
+
+def project(lon, lat, zoom):
+    """ web mercator pixel of the whole world map at the zoom """
+    n = TILE_SIZE * 2 ** zoom
+    lat = max(-85.05112878, min(85.05112878, lat))
+    s = math.sin(math.radians(lat))
+    return (lon + 180) / 360 * n, (0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * n
+
+
+def unproject(x, y, zoom):
+    n = TILE_SIZE * 2 ** zoom
+    return x / n * 360 - 180, math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+
+def load_ride(filename, zoom, tolerance=0.5):
+    """ (start datetime, [pixel]) of a gps file, simplified within tolerance pixels at the zoom """
+    import loading
+
+    try:
+        t = loading.load_track([filename])
+    except Exception as e:
+        print('skip %s: %s' % (filename, e), file=sys.stderr)
+        return None
+
+    if len(t) < 2: return None
+
+    plots = [project(lon, lat, zoom) for lon, lat in zip(t['lon'], t['lat'])]
+    return datetime.fromtimestamp(t['time'][0] / 1e9, timezone.utc), [plots[i] for i in simplify.douglas_peucker(plots, tolerance)]
+
+
+class TileIndex(object):
+    """ {(tx, ty): [(ride, [pixel...])]}, the runs of every ride's consecutive segments touching the tile(within margin pixels) """
+    def __init__(self, margin=0):
+        self.margin = margin
+        self.tiles = defaultdict(list)
+        self.rides = []
+        self.segments = 0
+
+    def add(self, start_dt, plots):
+        ride = len(self.rides)
+        self.rides.append(start_dt)
+
+        # a segment belongs to the tiles its line, as wide as drawn, touches, or it is cut at the tile edge
+        m = self.margin
+        for a, b in zip(plots, plots[1:]):
+            tx0, tx1 = int((min(a[0], b[0]) - m) // TILE_SIZE), int((max(a[0], b[0]) + m) // TILE_SIZE)
+            ty0, ty1 = int((min(a[1], b[1]) - m) // TILE_SIZE), int((max(a[1], b[1]) + m) // TILE_SIZE)
+
+            for tx in range(tx0, tx1 + 1):
+                for ty in range(ty0, ty1 + 1):
+                    runs = self.tiles[(tx, ty)]
+                    if runs and runs[-1][0] == ride and runs[-1][1][-1] == a: runs[-1][1].append(b)
+                    else: runs.append((ride, [a, b]))
+            self.segments += 1
+
+    def extent(self):
+        """ tile range (tx0, ty0, tx1, ty1) holding data, end exclusive """
+        xs, ys = [t[0] for t in self.tiles], [t[1] for t in self.tiles]
+        return min(xs), min(ys), max(xs) + 1, max(ys) + 1
+
+
+def heat_color(v):
+    """ rgba of the density 0..1: dark red, red, yellow, white """
+    stops = [(0.0, (80, 0, 0)), (0.4, (255, 0, 0)), (0.8, (255, 255, 0)), (1.0, (255, 255, 255))]
+    for (v0, c0), (v1, c1) in zip(stops, stops[1:]):
+        if v <= v1:
+            r = (v - v0) / (v1 - v0)
+            return tuple(int(c0[k] + (c1[k] - c0[k]) * r) for k in range(3)) + (255, )
+    return stops[-1][1] + (255, )
+
+
+def date_color(v):
+    """ rgba of the place 0..1 in the season: blue, green, red """
+    h = (1 - v) * 2 / 3
+    i, f = int(h * 6) % 6, h * 6 - int(h * 6)
+    p, q, t = 0, int(255 * (1 - f)), int(255 * f)
+    return [(255, t, p), (q, 255, p), (p, 255, t), (p, q, 255), (t, p, 255), (255, p, q)][i] + (255, )
+
+
+def density_luts(saturate):
+    """ the r, g, b, a point tables from the ride count(0..255) to the heat color, log scaled up to saturate """
+    colors = [(0, 0, 0, 0)] + [heat_color(math.log1p(min(c, saturate)) / math.log1p(saturate)) for c in range(1, 256)]
+    return [[c[k] for c in colors] for k in range(4)]
+
+
+def render_tile(job):
+    """ rgba bytes of the tile: (tx, ty), runs in world pixels, mode, colors by ride(date mode) or saturate, line width """
+    from PIL import Image, ImageDraw, ImageChops
+
+    (tx, ty), runs, mode, param, line_width = job
+    ox, oy = tx * TILE_SIZE, ty * TILE_SIZE
+    to_tile = lambda pts: [(x - ox, y - oy) for x, y in pts]
+
+    if mode == 'date':
+        im = Image.new('RGBA', (TILE_SIZE, TILE_SIZE))
+        draw = ImageDraw.Draw(im)
+        for ride, pts in runs: draw.line(to_tile(pts), fill=param[ride], width=line_width, joint='curve')
+        return (tx, ty), im.tobytes()
+
+    # one mask per ride, so a ride counts once where it crosses itself; L clips the count at 255
+    count = Image.new('L', (TILE_SIZE, TILE_SIZE))
+    by_ride = defaultdict(list)
+    for ride, pts in runs: by_ride[ride].append(pts)
+    for pts_list in by_ride.values():
+        mask = Image.new('L', (TILE_SIZE, TILE_SIZE))
+        draw = ImageDraw.Draw(mask)
+        for pts in pts_list: draw.line(to_tile(pts), fill=1, width=line_width, joint='curve')
+        count = ImageChops.add(count, mask)
+
+    luts = density_luts(param)
+    return (tx, ty), Image.merge('RGBA', [count.point(lut) for lut in luts]).tobytes()
+
+
+def bounded_map(executor, fn, jobs, window):
+    """ executor.map, but with at most window jobs(and their results) in flight, so the rendered tiles never pile up """
+    pending = deque()
+    for job in jobs:
+        pending.append(executor.submit(fn, job))
+        if len(pending) >= window: yield pending.popleft().result()
+    while pending: yield pending.popleft().result()
+
+
+def render(files, output, zoom=12, mode='density', saturate=20, line_width=2, workers=None, provider_id=None,
+           cache_dir=pathlib.Path.home() / '.cache/geotiler/', tiles_dir=None, max_pixels=MAX_PIXELS):
+    """ the rides on one image at output, or only as tiles in tiles_dir when the image would be over max_pixels """
+    from PIL import Image
+
+    index = TileIndex(line_width / 2 + 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for ride in executor.map(load_ride, files, [zoom] * len(files), chunksize=4):
+            if ride: index.add(*ride)
+
+        if not index.tiles: raise ValueError('no ride with points')
+        print('rides: %d, segments: %d, tiles: %d' % (len(index.rides), index.segments, len(index.tiles)))
+
+        if mode == 'date':
+            order = sorted(range(len(index.rides)), key=index.rides.__getitem__)
+            param = [None] * len(order)
+            for k, ride in enumerate(order): param[ride] = date_color(k / max(1, len(order) - 1))
+        else:
+            param = min(255, max(1, saturate))
+
+        tx0, ty0, tx1, ty1 = index.extent()
+        size = ((tx1 - tx0) * TILE_SIZE, (ty1 - ty0) * TILE_SIZE)
+        print('image size:', size)
+
+        # far apart rides at a high zoom span a huge image, then only the tiles with data are written
+        image = None
+        if size[0] * size[1] <= max_pixels:
+            image = render_basemap(size, (tx0, ty0), zoom, provider_id, cache_dir)
+        else:
+            if not tiles_dir: tiles_dir = os.path.splitext(output)[0] + '_tiles'
+            print('over %d pixels, no single image, the tiles are written to %s' % (max_pixels, tiles_dir))
+
+        jobs = ((tile, index.tiles.pop(tile), mode, param, line_width) for tile in sorted(index.tiles))
+        for (tx, ty), data in bounded_map(executor, render_tile, jobs, 4 * (workers or os.cpu_count() or 1)):
+            tile = Image.frombytes('RGBA', (TILE_SIZE, TILE_SIZE), data)
+            if image: image.alpha_composite(tile, dest=((tx - tx0) * TILE_SIZE, (ty - ty0) * TILE_SIZE))
+
+            if tiles_dir:
+                path = pathlib.Path(tiles_dir, str(zoom), str(tx))
+                path.mkdir(parents=True, exist_ok=True)
+                tile.save(path / ('%d.png' % ty))
+
+    if image:
+        image.save(output)
+        print('saved:', output)
+
+
+def render_basemap(size, tile_origin, zoom, provider_id, cache_dir):
+    """ the map under the tile range, or a dark background without a provider """
+    from PIL import Image
+
+    if not provider_id: return Image.new('RGBA', size, (16, 16, 16, 255))
+
+    import geotiler
+    import gpx_to_route
+
+    cx, cy = tile_origin[0] * TILE_SIZE + size[0] / 2, tile_origin[1] * TILE_SIZE + size[1] / 2
+    mm = geotiler.Map(center=unproject(cx, cy, zoom), zoom=zoom, size=size, provider=gpx_to_route.find_provider(provider_id))
+    return gpx_to_route.my_render_map(pathlib.Path(cache_dir))(mm).convert('RGBA')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Draw many rides on one map, as a heatmap or colored by date.')
+    parser.add_argument('-o', '--output', default='heatmap.png', help='output image')
+    parser.add_argument('-z', '--zoom', type=int, default=12, help='zoom of map')
+    parser.add_argument('--mode', choices=('density', 'date'), default='density', help='ride count over every pixel, or the rides colored by date')
+    parser.add_argument('--saturate', type=int, default=20, help='ride count shown as the hottest color(at most 255)')
+    parser.add_argument('--line-width', type=int, default=2, help='width of the rides')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='processes, default the cpu count')
+    parser.add_argument('-p', '--provider', default=None, help='map provider id of the base map, none for a dark background')
+    parser.add_argument('--cache-dir', type=pathlib.Path, default=pathlib.Path.home() / '.cache/geotiler/', help='location of cache(map tile, ...)')
+    parser.add_argument('--tiles-dir', default=None, help='also save the tiles with data as DIR/zoom/x/y.png')
+    parser.add_argument('--max-pixels', type=int, default=MAX_PIXELS, help='above it only the tiles are saved(to --tiles-dir, or OUTPUT_tiles), no single image')
+    parser.add_argument('filename', nargs='+', help='gpx or fit files')
+    args = parser.parse_args()
+
+    render(args.filename, args.output, args.zoom, args.mode, args.saturate, args.line_width, args.workers,
+           args.provider, args.cache_dir, args.tiles_dir, args.max_pixels)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,8 +13,15 @@ from pathlib import Path
 import bz2
 import gzip
 import lzma
+import hashlib
+
+from array import array
 
 import util
+import merge
+import stats
+import timeline
+import track
 
 
 class Session(object):
@@ -32,29 +39,6 @@ class Session(object):
     def __str__(self):
         return f'datetime:{self.dt}, start_time:{self.start_time}, total_elapsed_time:{self.total_elapsed_time}, total_moving_time:{self.total_moving_time}, total_distance:{self.total_distance}, total_ascent:{self.total_ascent}, max_speed:{self.max_speed}, avg_speed:{self.avg_speed}'
 
-    def merge(self, b):
-        self.dt = max(self.dt, b.dt)
-        self.start_time = min(self.start_time, b.start_time)
-        self.total_elapsed_time += b.total_elapsed_time
-        self.total_moving_time += b.total_moving_time
-
-        self.total_distance += b.total_distance
-        self.total_ascent += b.total_ascent
-        self.max_speed = max(self.max_speed, b.max_speed)
-        self.avg_speed = self.total_distance / self.total_moving_time
-
-    @staticmethod
-    def merge_session(sess_list):
-        if not sess_list: return None
-
-        sess = sess_list[0]
-        for s in sess_list[1:]:
-            sess.merge(s)
-
-        print(sess)
-
-        return sess
-
 
 def log(s):
     print(s, file=sys.stderr)
@@ -65,24 +49,126 @@ def fatal(s, error=True):
     exit(exitcode)
 
 
-def load_gps_data(filepath_list):
-    timestamp, positions, sess_list = [], [], []
+def load_gps_data(filepath_list, tz=None):
+    """ the track.Track of the files merged by time, its session and the time zone(of the first point when not given) """
+    tracks, sessions = [], []
     for filepath in filepath_list:
         suffix = Path(filepath).suffix.lower()
         if suffix == ".gpx":
-            t, p, sess = load_gpx_file(filepath)
+            t, sess, tz = load_gpx_file(filepath, tz)
         elif suffix == ".fit":
-            t, p, sess = load_fit_file(filepath)
+            t, sess, tz = load_fit_file(filepath, tz)
         else:
             fatal(f"Don't recognise filetype from {filepath} - support .gpx and .fit")
 
-        timestamp.extend(t)
-        positions.extend(p)
-        sess_list.append(sess)
+        tracks.append(t)
+        sessions.append(sess)
+
+    t, sess = merge.merge(tracks, sessions, tz)
+    return t, sess, tz
+
+
+COLUMNS = ('time', 'lon', 'lat', 'alt', 'speed', 'odo', 'cadence', 'hr', 'temp')
+
+# bumped when the columns read from a file change, the tracks saved before are read again
+TRACK_VERSION = 2
+
+
+def load_track(filepath_list, cache_dir=None):
+    """
+    the points of all the files by time as a track.Track(nan where a file has no value), the
+    distance counted on over the files. with cache_dir the track is saved there and mapped back
+    next time, without parsing the files, while they are not changed.
+    """
+    cache_file = None
+    if cache_dir:
+        stamp = [(os.path.abspath(x), os.stat(x).st_size, os.stat(x).st_mtime_ns) for x in filepath_list]
+        cache_file = Path(cache_dir, 'tracks', hashlib.sha1(repr((TRACK_VERSION, stamp)).encode()).hexdigest() + '.trk')
+        if cache_file.exists():
+            try:
+                return track.Track.open(cache_file)
+            except ValueError:
+                pass
+
+    rows = []
+    for filepath in filepath_list:
+        suffix = Path(filepath).suffix.lower()
+        if suffix == ".gpx":
+            rows.extend(read_gpx_rows(filepath))
+        elif suffix == ".fit":
+            rows.extend(read_fit_rows(filepath))
+        else:
+            fatal(f"Don't recognise filetype from {filepath} - support .gpx and .fit")
+
+    t = track.Track.from_rows(rows, COLUMNS)
+    fill_distance(t, keep_odo=len(filepath_list) == 1)
+
+    if cache_file:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        t.save(cache_file)
+
+    return t
+
+
+def fill_distance(t, keep_odo=True):
+    """
+    the odo of the track from its points where the file has none(or not keep_odo, eg. the odo of several
+    files starts over in each), and the speed where the file has none
+    """
+    if len(t) == 0: return
+
+    seconds = t.seconds()
+    seconds = [x - seconds[0] for x in seconds]
+    meters = [0.0]
+    for d in stats.segment_meters(t.positions()): meters.append(meters[-1] + d)
+
+    odo = t['odo']
+    if not keep_odo or any(v != v for v in odo): odo[:] = array('d', meters)
 
-    sess = Session.merge_session(sess_list)
+    speed = t['speed']
+    for i, v in enumerate(timeline.point_speeds(seconds, meters)):
+        if speed[i] != speed[i]: speed[i] = v
 
-    return timestamp, positions, sess
+
+def read_gpx_rows(filename):
+    import gpxpy
+
+    f_open = FILE_OPENER.get(os.path.splitext(filename)[1][1:], open)
+    with f_open(filename) as f:
+        gpx = gpxpy.parse(f)
+
+    for gpx_track in gpx.tracks:
+        for segment in gpx_track.segments:
+            for point in segment.points:
+                # garmin TrackPointExtension: hr, cad, atemp
+                ext = {}
+                for e in point.extensions:
+                    for x in e.iter():
+                        try:
+                            ext[x.tag.rsplit('}', 1)[-1]] = float(x.text)
+                        except (TypeError, ValueError):
+                            pass
+
+                yield (point.time.timestamp(), point.longitude, point.latitude, point.elevation,
+                       None, None, ext.get('cad'), ext.get('hr'), ext.get('atemp'))
+
+
+def fit_row(message):
+    """ the row(as COLUMNS) of a fit record message, None when it has no position """
+    if message.position_long is None or message.position_long > 179.9999: return None
+
+    return (message.timestamp / 1000, message.position_long, message.position_lat, message.altitude,
+            message.speed, message.distance, message.cadence, message.heart_rate, message.temperature)
+
+
+def read_fit_rows(filename):
+    from fit_tool.fit_file import FitFile
+    from fit_tool.profile.messages.record_message import RecordMessage
+
+    for record in FitFile.from_file(filename).records:
+        if isinstance(record.message, RecordMessage):
+            row = fit_row(record.message)
+            if row: yield row
 
 
 FILE_OPENER = {
@@ -112,63 +198,35 @@ def load_gpx_file_xxxx(filename):
         return (get_point(n) for n in nodes)
 
 
-def load_gpx_file(filename):
-    import gpxpy
+def load_gpx_file(filename, tz=None):
+    t = track.Track.from_rows(read_gpx_rows(filename), COLUMNS)
 
-    timestamp, lon, lat, alt = [], [], [], []
-    speed, distance, cadence = [], [], []
+    if tz is None: tz = util.get_tz(t['lon'][0], t['lat'][0])
 
-    _, ext = os.path.splitext(filename)
-    ext = ext[1:]
-    f_open = FILE_OPENER.get(ext, open)
+    start_dt, end_dt = (datetime.fromtimestamp(t['time'][i] / 1e9, tz) for i in (0, -1))
+    session = stats.TrackStats(t).session(start_dt, end_dt)
 
-    with f_open(filename) as f:
-        gpx = gpxpy.parse(f)
+    return t, session, tz
 
-        for track in gpx.tracks:
-            for segment in track.segments:
-                for point in segment.points:
-                    timestamp.append(point.time)
-                    lon.append(point.longitude)
-                    lat.append(point.latitude)
-                    alt.append(point.elevation)
 
-    tz = util.get_tz(lon[0], lat[0])
-
-    start_dt, end_dt = timestamp[0].astimezone(tz), timestamp[-1].astimezone(tz)
-    total_elapsed_time = (end_dt - start_dt).seconds
-
-    session = Session(end_dt, start_dt, total_elapsed_time, total_elapsed_time)
-
-    return timestamp, zip(lon, lat), session
-
-
-def load_fit_file(filename):
+def load_fit_file(filename, tz=None):
     from fit_tool.fit_file import FitFile
     from fit_tool.profile.messages.record_message import RecordMessage
     from fit_tool.profile.messages.session_message import SessionMessage
 
-    timestamp, lon, lat, alt = [], [], [], []
-    speed, distance, cadence = [], [], []
+    rows = []
     session = None
-    tz = None
 
     ff = FitFile.from_file(filename)
     for record in ff.records:
         message = record.message
         if isinstance(message, RecordMessage):
-            if message.position_long is None or message.position_long > 179.9999: continue
+            row = fit_row(message)
+            if row is None: continue
 
             if tz is None: tz = util.get_tz(message.position_long, message.position_lat)
 
-            timestamp.append(datetime.fromtimestamp(message.timestamp//1000).astimezone(tz))
-            lon.append(message.position_long)
-            lat.append(message.position_lat)
-            alt.append(message.altitude)
-
-            speed.append(message.speed)
-            distance.append(message.distance)
-            cadence.append(message.cadence)
+            rows.append(row)
         elif isinstance(message, SessionMessage):
             session = Session(datetime.fromtimestamp(message.timestamp//1000).astimezone(tz),
                     datetime.fromtimestamp(message.start_time//1000).astimezone(tz),
@@ -177,7 +235,7 @@ def load_fit_file(filename):
 
     # print(session)
 
-    return timestamp, zip(lon, lat), session
+    return track.Track.from_rows(rows, COLUMNS), session, tz
 
 
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## the icons(photo/video markers) put on the map image: each one is blended only inside its
+## own box with alpha_composite(dest=...), instead of a map sized layer per icon. markers closer
+## than the cluster radius(map pixels at the zoom) are drawn as one icon with their count on it.
+
+import sys
+import os
+
+import math
+import functools
+
+from collections import namedtuple
+
+
+Marker = namedtuple('Marker', ['x', 'y', 'icon_file'])
+
+
+@functools.lru_cache(maxsize=64)
+def sprite(icon_file, icon_size, count=1):
+    """ the rgba icon fitted in icon_size, with a badge of the count when it stands for several markers """
+    from PIL import Image, ImageOps, ImageDraw
+
+    im = ImageOps.contain(Image.open(icon_file), icon_size).convert('RGBA')
+    if count == 1: return im
+
+    im = im.copy()
+    r = max(8, im.width // 5)
+    draw = ImageDraw.Draw(im)
+    draw.ellipse((im.width - 2 * r, 0, im.width - 1, 2 * r - 1), fill=(255, 0, 0, 255))
+    draw.text((im.width - r, r), str(count), fill=(255, 255, 255, 255), anchor='mm')
+
+    return im
+
+
+def cluster_markers(markers, radius):
+    """ [(x, y, icon_file, count)], a marker joins the first cluster(in the order given) whose center is within radius """
+    if radius <= 0: return [(m.x, m.y, m.icon_file, 1) for m in markers]
+
+    clusters, grid = [], {}
+    for m in markers:
+        cx, cy = int(m.x // radius), int(m.y // radius)
+
+        found = None
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for k in grid.get((gx, gy), ()):
+                    c = clusters[k]
+                    if math.hypot(c[0] - m.x, c[1] - m.y) <= radius and (found is None or k < found): found = k
+
+        if found is None:
+            grid.setdefault((cx, cy), []).append(len(clusters))
+            clusters.append([m.x, m.y, m.icon_file, 1])
+        else:
+            # the cluster stays at its first marker, so the grid cell it is in never changes
+            clusters[found][3] += 1
+
+    return [tuple(c) for c in clusters]
+
+
+def composite(map_image, im, x, y):
+    """ blend im centered at (x, y) into the map image, clipped to it """
+    return composite_at(map_image, im, int(x - im.width // 2), int(y - im.height // 2))
+
+
+def composite_at(map_image, im, x0, y0):
+    """ blend im with its top left at (x0, y0) into the map image, clipped to it; the box blended or None """
+    sx0, sy0 = max(0, -x0), max(0, -y0)
+    sx1, sy1 = min(im.width, map_image.width - x0), min(im.height, map_image.height - y0)
+    if sx0 >= sx1 or sy0 >= sy1: return None
+
+    map_image.alpha_composite(im, dest=(x0 + sx0, y0 + sy0), source=(sx0, sy0, sx1, sy1))
+    return (x0 + sx0, y0 + sy0, x0 + sx1, y0 + sy1)
+
+
+class MarkerLayer(object):
+    def __init__(self, icon_size=(60, 60)):
+        self.icon_size = tuple(icon_size)
+        self.markers = []
+
+    def add(self, x, y, icon_file):
+        self.markers.append(Marker(x, y, icon_file))
+
+    def draw(self, map_image, cluster_radius=0):
+        """ the markers in the order added, later ones on top """
+        for x, y, icon_file, count in cluster_markers(self.markers, cluster_radius):
+            composite(map_image, sprite(icon_file, self.icon_size, count), x, y)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## merge the tracks(track.Track) of several gps files into one by time: a k-way merge of the sorted tracks,
+## where two tracks overlap the one already playing keeps its points, the other's are dropped,
+## and the gaps(no point for a while) of the merged track are reported.
+
+import sys
+import os
+
+import heapq
+
+from datetime import datetime
+
+import track
+
+
+GAP_SEC = 60
+
+
+def points(times, k):
+    return ((t, k, i) for i, t in enumerate(times))
+
+
+def merge_tracks(tracks, gap_sec=GAP_SEC):
+    """
+    the (track, point) index of the merged points of the track.Track list, the seconds of every track covered
+    by the points kept of it and the gaps([start, end] epoch ns).
+
+    a point is dropped when its time is not after the last one kept, or another track
+    covers its time and was playing before it.
+    """
+    times = [x['time'] for x in tracks]
+    start_list = [x[0] if len(x) else None for x in times]
+    end_list = [x[-1] if len(x) else None for x in times]
+
+    picks, gaps = [], []
+    kept = [0.0] * len(tracks)
+    last, active = None, None
+    for t, k, i in heapq.merge(*(points(x, k) for k, x in enumerate(times))):
+        if last is not None and t <= last: continue
+        if active is not None and k != active and end_list[active] >= t: continue
+
+        if last is not None:
+            if t - last > gap_sec * 1e9: gaps.append((last, t))
+            # the segment to the point is the track's from its start on, also the one where the source switches to it
+            kept[k] += (t - max(last, start_list[k])) / 1e9
+
+        picks.append((k, i))
+        last, active = t, k
+
+    return picks, kept, gaps
+
+
+def take(tracks, picks):
+    """ a new track.Track of the picked (track, point) """
+    merged = track.Track.allocate(len(picks))
+    for name, out in merged.columns.items():
+        columns = [x[name] for x in tracks]
+        for j, (k, i) in enumerate(picks): out[j] = columns[k][i]
+    return merged
+
+
+def elapsed(t):
+    return (t['time'][-1] - t['time'][0]) / 1e9 if len(t) > 1 else 0.0
+
+
+def merge_session(tracks, sessions, kept, merged):
+    """ the session of the merged track, the totals of every track are counted by the part of it kept """
+    from loading import Session
+
+    sess_list = [(s, kept[k] / elapsed(x) if elapsed(x) else 0.0) for k, (x, s) in enumerate(zip(tracks, sessions)) if s]
+    if not sess_list: return None
+
+    if len(tracks) == 1:
+        sess = sess_list[0][0]
+    else:
+        tz = sess_list[0][0].start_time.tzinfo
+        start_dt, end_dt = (datetime.fromtimestamp(merged['time'][i] / 1e9, tz) for i in (0, -1))
+
+        moving = sum(s.total_moving_time * 3600 * f for s, f in sess_list)
+        distance = sum(s.total_distance * 1000 * f for s, f in sess_list)
+        ascent = sum(s.total_ascent * f for s, f in sess_list)
+        max_speed = max([s.max_speed / 3.6 for s, f in sess_list if f > 0] or [0.0])
+        avg_speed = distance / moving if moving else 0.0
+
+        sess = Session(end_dt, start_dt, (end_dt - start_dt).total_seconds(), moving, distance, ascent, max_speed, avg_speed)
+
+    return sess
+
+
+def merge(tracks, sessions, tz=None, gap_sec=GAP_SEC):
+    """ the track.Track and session of the tracks merged """
+    picks, kept, gaps = merge_tracks(tracks, gap_sec)
+    merged = tracks[0] if len(tracks) == 1 and len(picks) == len(tracks[0]) else take(tracks, picks)
+
+    total = sum(len(x) for x in tracks)
+    if total != len(picks): print('merge: %d of %d points dropped as overlap' % (total - len(picks), total))
+    for start, end in gaps: print('gap: %s -- %s' % (datetime.fromtimestamp(start / 1e9, tz), datetime.fromtimestamp(end / 1e9, tz)))
+
+    sess = merge_session(tracks, sessions, kept, merged)
+    print(sess)
+
+    return merged, sess
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## picture-in-picture: the animated map of the track put on the gopro footage in one ffmpeg
+## pass. the clip is lined up with the track by the creation time of the clip(mvhd), the map
+## frames are rendered at the clip fps and piped as rgba into the overlay filter.
+
+import sys
+import os
+
+import bisect
+import pathlib
+import argparse
+
+import subprocess
+
+from datetime import timedelta
+
+import util
+import perf
+import camera
+import framebuf
+import exifscan
+import pipeline
+import probe
+import loading
+import gpx_to_route
+
+
+POSITIONS = {
+    'tl': ('20', '20'),
+    'tr': ('W-w-20', '20'),
+    'bl': ('20', 'H-h-20'),
+    'br': ('W-w-20', 'H-h-20'),
+}
+
+
+def parse_time(text):
+    """ seconds of HH:MM:SS[.ffffff] """
+    h, m, s = text.split(':')
+    return int(h) * 3600 + int(m) * 60 + float(s)
+
+
+def parse_fps(text):
+    num, _, den = str(text).partition('/')
+    return float(num) / float(den or 1)
+
+
+def read_timeline(filename):
+    """ the cuts of timeline.txt(as cut_add_add.py reads it): [(clip, start, end, name)] and the fit file """
+    indir, fit_file, cuts = './', None, []
+    for line in open(filename):
+        line = line.strip()
+
+        if line == '' or line[0] == '#': continue
+
+        if line.startswith('indir'):
+            indir = line.split('=')[1]
+            continue
+        elif line.startswith('fit_file'):
+            fit_file = line.split('=')[1]
+            continue
+
+        infile, start, end, xx = line.split()
+        if xx == 'no': continue
+
+        cuts.append((os.path.join(indir, infile), parse_time(start), parse_time(end), infile + '-' + start))
+
+    return cuts, fit_file
+
+
+def clip_start_time(clip, clip_offset=0):
+    """ the datetime the clip starts, gopro writes its local clock in mvhd so give clip_offset(second) to fix it """
+    with open(clip, 'rb') as f:
+        dt = exifscan.read_mvhd_time(f)
+
+    if dt is None: raise ValueError('no creation time in %s' % clip)
+
+    return dt + timedelta(seconds=clip_offset)
+
+
+def cursor_list(seconds, plots, frame_seconds):
+    """ the map pixel of every frame time, linear between the two points around it """
+    cursors = []
+    for t in frame_seconds:
+        j = bisect.bisect_right(seconds, t)
+        if j == 0: cursors.append(plots[0])
+        elif j == len(seconds): cursors.append(plots[-1])
+        else:
+            r = (t - seconds[j-1]) / (seconds[j] - seconds[j-1])
+            a, b = plots[j-1], plots[j]
+            cursors.append((a[0] + (b[0] - a[0]) * r, a[1] + (b[1] - a[1]) * r))
+    return cursors
+
+
+def render_overlay(writer, mm, map_image, window_size, fps, seconds, plots, frame_seconds, line_width=5):
+    """ write the map frame of every frame time, the trail is drawn up to the cursor """
+    from PIL import ImageDraw
+
+    draw = ImageDraw.Draw(map_image)
+    frame_buffer = framebuf.FrameBuffer(map_image, window_size, line_width)
+
+    cursors = cursor_list(seconds, plots, frame_seconds)
+    centers, _ = camera.plan_camera(cursors, window_size, fps)
+
+    j = bisect.bisect_right(seconds, frame_seconds[0]) if frame_seconds else 0
+    tail = cursors[0] if cursors else None
+    for t, cursor, center in zip(frame_seconds, cursors, centers):
+        with perf.span('draw'):
+            # through the points passed since the last frame to the cursor
+            passed = [tail]
+            while j < len(seconds) and seconds[j] <= t:
+                passed.append(plots[j])
+                j += 1
+            passed.append(cursor)
+
+            draw.line(passed, fill=(255, 0, 0), width=line_width, joint='curve')
+            for a, b in zip(passed, passed[1:]): frame_buffer.invalidate(framebuf.line_rect(a, b, line_width))
+            tail = cursor
+
+        p1, p2 = gpx_to_route.view_window(window_size, map_image.size, center)
+        frame, _ = frame_buffer.render((p1[0], p1[1], p2[0], p2[1]), cursor)
+        writer.write(frame)
+
+
+def composite(clip, outfile, track, start=0.0, end=None, size=(480, 270), position='tr', zoom=16, provider_id='osm',
+              cache_dir=pathlib.Path.home() / '.cache/geotiler/', clip_offset=0, is_release=False, profile=None):
+    """ encode the clip from start to end second(the whole clip when None) with the map of the track.Track on it """
+
+    _, _, fps_text, duration = util.probe_video(clip)
+    fps = parse_fps(fps_text)
+    if end is None or end > duration: end = duration
+
+    clip_t0 = clip_start_time(clip, clip_offset).timestamp()
+    frame_seconds = [clip_t0 + start + k / fps for k in range(int((end - start) * fps))]
+    if not frame_seconds: raise ValueError('no frame from %s to %s of %s, shorter than a frame at %s fps' % (start, end, clip, fps_text))
+
+    seconds = track.seconds()
+    first, last = bisect.bisect_left(seconds, frame_seconds[0]), bisect.bisect_right(seconds, frame_seconds[-1])
+    if first >= last: raise ValueError('the track has no point from %s to %s of %s' % (start, end, clip))
+
+    # the part of the track in the clip, with a point on either side
+    first, last = max(0, first - 1), min(len(seconds), last + 1)
+    seconds, positions = seconds[first:last], track[first:last].positions()
+
+    provider = gpx_to_route.find_provider(provider_id)
+    if provider.name.endswith('.mars_in_china'): positions = util.fix_mars_in_china(positions)
+
+    with perf.span('map_render'):
+        mm, _, size = gpx_to_route.init_map_object(positions, False, size, zoom, provider)
+        map_image = gpx_to_route.my_render_map(pathlib.Path(cache_dir))(mm)
+    plots = [mm.rev_geocode(p) for p in positions]
+
+    print('overlay:', clip, start, end, len(frame_seconds), 'frames')
+    cmd_string = util.splice_overlay_cmd_string(clip, outfile, start, end, size, fps_text, POSITIONS[position], is_release, profile)
+    p = perf.popen(cmd_string, 'ffmpeg.overlay', stdin=subprocess.PIPE)
+    pipe = pipeline.PipeWriter(p.stdin)
+    progress = perf.Progress(len(frame_seconds))
+    try:
+        with perf.span('frame_loop'):
+            render_overlay(gpx_to_route.WriteCounter(pipe, progress=progress), mm, map_image, size, fps, seconds, plots, frame_seconds)
+    except BaseException:
+        p.kill(); pipe.abort(); p.wait()
+        raise
+    finally:
+        progress.close()
+
+    with perf.span('encode'):
+        pipe.close(); perf.wait(p)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Put the animated map of the track on the gopro clips.')
+    parser.add_argument('-t', '--track', action='append', default=[], help='gpx or fit file, default the fit_file of the timeline')
+    parser.add_argument('--timeline', default=None, help='the cuts of timeline.txt instead of a whole clip')
+    parser.add_argument('--outdir', default='./gopro/pip/', help='dir of the timeline outputs')
+    parser.add_argument('-s', '--size', nargs=2, type=int, default=(480, 270), help='size of the map')
+    parser.add_argument('--position', choices=sorted(POSITIONS), default='tr', help='corner of the map')
+    parser.add_argument('-z', '--zoom', type=int, default=16, help='zoom of map')
+    parser.add_argument('-p', '--provider', default='osm', help='map provider id')
+    parser.add_argument('--cache-dir', type=pathlib.Path, default=pathlib.Path.home() / '.cache/geotiler/', help='location of cache(map tile, ...)')
+    parser.add_argument('--clip-offset', type=float, default=0, help='second added to the clip creation time, -28800 for a gopro clock on UTC+8')
+    parser.add_argument('--release', dest='is_release', action='store_true', help='set it when the video is to publish')
+    parser.add_argument('--encoder', default=None, help='encoder profile in encoder_profiles.json')
+    parser.add_argument('--profile-out', default=None, help='save the stage timing in chrome trace format to the file')
+    parser.add_argument('clip', nargs='?', help='the clip, when no --timeline')
+    parser.add_argument('output', nargs='?', help='output video file, when no --timeline')
+    args = parser.parse_args()
+
+    if args.timeline:
+        cuts, fit_file = read_timeline(args.timeline)
+        jobs = [(clip, os.path.join(args.outdir, name + '.mp4'), start, end) for clip, start, end, name in cuts]
+        if not args.track and fit_file: args.track = [fit_file]
+        os.makedirs(args.outdir, exist_ok=True)
+    elif args.clip and args.output:
+        jobs = [(args.clip, args.output, 0.0, None)]
+    else:
+        parser.error('give --timeline or the clip and the output')
+
+    if not args.track: parser.error('no track, give -t')
+    if args.profile_out: perf.enable()
+
+    args.cache_dir.mkdir(parents=True, exist_ok=True)
+    probe.open_cache(args.cache_dir / 'probe.json')
+
+    points, _, _ = loading.load_gps_data(args.track)
+
+    for clip, outfile, start, end in jobs:
+        if os.path.exists(outfile): continue
+
+        composite(clip, outfile, points, start, end, tuple(args.size), args.position, args.zoom, args.provider,
+                  args.cache_dir, args.clip_offset, args.is_release, args.encoder)
+
+    probe.save()
+    if args.profile_out: perf.save(args.profile_out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## stage spans, per-frame counters and child process time, saved in chrome trace format
+## (open it in chrome://tracing or https://ui.perfetto.dev).
+## everything is a no-op until enable() is called, so it is safe to leave it in the hot path.
+
+import sys
+import os
+
+import json
+import time
+import resource
+import threading
+
+import subprocess
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add_span(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class Tracer(object):
+    def __init__(self):
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.events = []
+        self.totals = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def span(self, name, **args):
+        if not self.enabled: return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def add_span(self, name, start, end, args=None):
+        event = {
+            'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+            'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6,
+        }
+        if args: event['args'] = args
+
+        with self.lock:
+            self.events.append(event)
+            n, t = self.totals.get(name, (0, 0.0))
+            self.totals[name] = (n + 1, t + end - start)
+
+    def count(self, name, n=1):
+        if not self.enabled: return
+
+        with self.lock:
+            value = self.counters.get(name, 0) + n
+            self.counters[name] = value
+            self.events.append({
+                'name': name, 'ph': 'C', 'pid': os.getpid(),
+                'ts': (time.perf_counter() - self.origin) * 1e6, 'args': {name: value},
+            })
+
+    def reset(self):
+        """ forget the spans and counters so far, for a run after another in the same process """
+        with self.lock:
+            self.events, self.totals, self.counters = [], {}, {}
+
+    def summary(self):
+        return {
+            'spans': {k: {'count': n, 'sec': t} for k, (n, t) in sorted(self.totals.items())},
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms', 'otherData': self.summary()}, f)
+
+
+TRACER = Tracer()
+
+
+def enable():
+    TRACER.enabled = True
+
+
+def is_enabled():
+    return TRACER.enabled
+
+
+def span(name, **args):
+    return TRACER.span(name, **args)
+
+
+def count(name, n=1):
+    TRACER.count(name, n)
+
+
+def save(filename):
+    TRACER.save(filename)
+    print('profile saved:', filename)
+
+
+def summary():
+    return TRACER.summary()
+
+
+def reset():
+    TRACER.reset()
+
+
+_proc_start = {}
+
+def popen(cmd_string, name='ffmpeg', **kw):
+    p = subprocess.Popen(cmd_string, **kw)
+    _proc_start[p.pid] = (name, time.perf_counter())
+    return p
+
+
+def wait(p):
+    """ p.wait(), and record the wall and cpu time of the child process """
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    returncode = p.wait()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    name, start = _proc_start.pop(p.pid, ('proc', None))
+    if TRACER.enabled and start is not None:
+        cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+        TRACER.add_span(name, start, time.perf_counter(), {'cpu_sec': cpu, 'args': ' '.join(p.args[1:8])})
+        count(name + '.cpu_ms', int(cpu * 1000))
+
+    return returncode
+
+
+def run(cmd_string, name='ffmpeg', **kw):
+    p = popen(cmd_string, name, **kw)
+    wait(p)
+    return p.returncode
+
+
+class Progress(object):
+    """ a single line `frame 120/900 45.1 fps ETA 0:17` on stderr, refreshed twice a second """
+    def __init__(self, total, interval=0.5, out=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.out = out
+        self.is_tty = out.isatty()
+        self.start = self.last = time.perf_counter()
+
+    def update(self, done):
+        if not self.is_tty: return
+
+        now = time.perf_counter()
+        if now - self.last < self.interval: return
+        self.last = now
+
+        fps = done / (now - self.start)
+        eta = max(0, self.total - done) / fps if fps > 0 else 0
+        self.out.write('\rframe %d/%d %.1f fps ETA %d:%02d ' % (done, self.total, fps, eta // 60, eta % 60))
+        self.out.flush()
+
+    def close(self):
+        if not self.is_tty: return
+        self.out.write('\n')
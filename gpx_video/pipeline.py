@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## the frames go to ffmpeg through a bounded queue and a writer thread, so drawing the next
+## frame overlaps with the pipe write(which releases the GIL) and ffmpeg encoding. a full queue
+## blocks the render loop(backpressure), the time either side waits on the other is measured.
+
+import sys
+import os
+
+import time
+import queue
+import threading
+
+import perf
+
+
+_END = object()
+
+
+class PipeWriter(object):
+    """ write() queues the frame(bytes, never changed afterwards) for the writer thread; close() flushes and joins it """
+    def __init__(self, raw, depth=8):
+        self.raw = raw
+        self.queue = queue.Queue(maxsize=max(1, depth))
+        self.error = None
+
+        self.render_stall = 0.0   # render loop waiting on a full queue
+        self.writer_idle = 0.0    # writer waiting on an empty queue
+        self.writer_busy = 0.0    # writer in the pipe write
+
+        self.thread = threading.Thread(target=self._run, name='pipe-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, something):
+        if self.error is not None: raise self.error
+
+        try:
+            self.queue.put_nowait(something)
+        except queue.Full:
+            start = time.perf_counter()
+            with perf.span('queue_full'):
+                self.queue.put(something)
+            self.render_stall += time.perf_counter() - start
+
+    def close(self):
+        """ wait for the queued frames to be written, then close the pipe """
+        self.queue.put(_END)
+        self.thread.join()
+
+        perf.count('pipeline.render_stall_ms', int(self.render_stall * 1000))
+        perf.count('pipeline.writer_idle_ms', int(self.writer_idle * 1000))
+        print('pipeline: render stall %.1fs, writer busy %.1fs, idle %.1fs' % (self.render_stall, self.writer_busy, self.writer_idle))
+
+        if self.error is not None: raise self.error
+        self.raw.close()
+
+    def abort(self):
+        """ stop the writer without flushing, after the reader(ffmpeg) is killed """
+        self.error = self.error or BrokenPipeError('pipeline aborted')
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put(_END)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            start = time.perf_counter()
+            something = self.queue.get()
+            now = time.perf_counter()
+            self.writer_idle += now - start
+
+            if something is _END: return
+            if self.error is not None: continue   # drain, so the render loop never blocks on a dead pipe
+
+            try:
+                self.raw.write(something)
+            except BaseException as e:
+                self.error = e
+            self.writer_busy += time.perf_counter() - now
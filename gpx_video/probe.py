@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## what ffprobe tells of a media file(the format and all the streams, read from the headers without
+## demuxing the packets), one ffprobe per file, kept in memory and in a json file by path, size and
+## mtime. the json file is written by save(), once the render is done.
+
+import sys
+import os
+
+import json
+import threading
+
+import subprocess
+
+
+class ProbeCache(object):
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}
+        self.changed = False
+        self.lock = threading.Lock()
+
+        if filename and os.path.exists(filename):
+            try:
+                with open(filename) as f: self.entries = json.load(f)
+            except ValueError:
+                self.entries = {}
+
+    def get(self, media_file):
+        st = os.stat(media_file)
+        path, stamp = os.path.abspath(media_file), [st.st_size, st.st_mtime_ns]
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry['stamp'] == stamp: return entry['info']
+
+        info = run_ffprobe(media_file)
+
+        with self.lock:
+            self.entries[path] = {'stamp': stamp, 'info': info}
+            self.changed = True
+
+        return info
+
+    def save(self):
+        if not self.filename: return
+
+        with self.lock:
+            if not self.changed: return
+            tmp = str(self.filename) + '.tmp'
+            with open(tmp, 'w') as f: json.dump(self.entries, f)
+            os.replace(tmp, self.filename)
+            self.changed = False
+
+
+def run_ffprobe(media_file):
+    """ format and streams(size, r_frame_rate, avg_frame_rate, nb_frames, ...), raise CalledProcessError on a file ffprobe can not read """
+    r = subprocess.run(['ffprobe', '-hide_banner', '-loglevel', 'error', '-of', 'json', '-show_format', '-show_streams', media_file],
+                       capture_output=True, check=True)
+    data = json.loads(r.stdout)
+
+    return {'format': data.get('format', {}), 'streams': data.get('streams', [])}
+
+
+_cache = ProbeCache()
+_caches = {}
+_caches_lock = threading.Lock()
+_local = threading.local()
+
+
+def open_cache(filename):
+    """
+    keep the probes of the calling thread in the json file from now on. the cache of a file is
+    one for the whole process, so the render jobs of a server do not switch each other's.
+    """
+    with _caches_lock:
+        if filename not in _caches: _caches[filename] = ProbeCache(filename)
+        _local.cache = _caches[filename]
+    return _local.cache
+
+
+def probe(media_file):
+    return getattr(_local, 'cache', _cache).get(media_file)
+
+
+def save():
+    """ write the cache of the calling thread to its json file """
+    getattr(_local, 'cache', _cache).save()
+
+
+def video_stream(info):
+    return next((s for s in info['streams'] if s.get('codec_type') == 'video'), None)
+
+
+def has_audio(info):
+    return any(s.get('codec_type') == 'audio' for s in info['streams'])
+
+
+def frame_rate(stream):
+    num, _, den = stream.get('r_frame_rate', '0/1').partition('/')
+    return float(num) / float(den or 1) if float(den or 1) else 0.0
+
+
+def rotation(stream):
+    """ degree the player turns the video by, from the rotate tag(old ffmpeg) or the display matrix side data """
+    degree = stream.get('tags', {}).get('rotate', 0)
+    for side_data in stream.get('side_data_list', ()):
+        if 'rotation' in side_data: degree = side_data['rotation']
+
+    try:
+        return float(degree) % 360
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def matches(info, window_size, fps):
+    """ the video is already of the size and fps, so scaling it changes nothing; a turned one is autorotated by ffmpeg, so not """
+    stream = video_stream(info)
+    if stream is None: return False
+
+    return (stream.get('width'), stream.get('height')) == tuple(window_size) and abs(frame_rate(stream) - fps) < 0.01 \
+        and stream.get('sample_aspect_ratio', '1:1') in ('1:1', '0:1') and rotation(stream) == 0
+
+
+if __name__ == '__main__':
+    for x in sys.argv[1:]:
+        info = probe(x)
+        stream = video_stream(info)
+        print(x, info['format'].get('duration'), stream and (stream['width'], stream['height'], stream['r_frame_rate'], stream.get('nb_frames')),
+              'audio' if has_audio(info) else 'no audio')
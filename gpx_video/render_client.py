@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## submit a gpx_to_route job to render_server.py, with the same arguments as gpx_to_route.py. eg:
+##   ./render_client.py -s 960 540 -p gaode-map --photo ./p.txt a.fit ./gopro/a.fit.mp4
+##   ./render_client.py --status
+##   ./render_client.py --cancel 0123456789ab
+
+import sys
+import os
+
+import json
+import time
+import socket
+import argparse
+import http.client
+
+import gpx_to_route
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=30):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class Client(object):
+    def __init__(self, host='127.0.0.1', port=8765, unix_socket=None):
+        self.host, self.port, self.unix_socket = host, port, unix_socket
+
+    def request(self, method, path, obj=None):
+        if self.unix_socket: conn = UnixHTTPConnection(self.unix_socket)
+        else: conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+        body = json.dumps(obj) if obj is not None else None
+        conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+        r = conn.getresponse()
+        data = json.loads(r.read() or b'null')
+        conn.close()
+
+        if r.status >= 400: raise RuntimeError('%d %s' % (r.status, data.get('error') if data else ''))
+        return data
+
+    def submit(self, config):
+        return self.request('POST', '/jobs', {'config': config})
+
+    def status(self, job_id=None):
+        return self.request('GET', '/jobs/' + job_id if job_id else '/jobs')
+
+    def cancel(self, job_id):
+        return self.request('DELETE', '/jobs/' + job_id)
+
+
+def config_to_json(config):
+    """ the paths are sent absolute, the server runs in its own dir """
+    d = dict(vars(config))
+    d['filename'] = [os.path.abspath(x) for x in config.filename]
+    d['output'] = os.path.abspath(config.output)
+    for k in ('audio', 'photo', 'profile_out'):
+        if d[k]: d[k] = os.path.abspath(d[k])
+    d['cache_dir'] = str(config.cache_dir)
+    d['size'] = list(config.size)
+    d.pop('tz')
+
+    return d
+
+
+def wait_job(client, job):
+    try:
+        while job['status'] in ('queued', 'running'):
+            time.sleep(1)
+            job = client.status(job['id'])
+            eta = '%ds' % job['eta'] if job['eta'] is not None else '-'
+            sys.stderr.write('\r%s %s frame %d/%d %.1f fps ETA %s ' % (job['id'], job['status'], job['frame'], job['total_frame'], job['fps'], eta))
+            sys.stderr.flush()
+    except KeyboardInterrupt:
+        job = client.cancel(job['id'])
+    sys.stderr.write('\n')
+
+    print(json.dumps(job, indent=2))
+    return job
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Submit a gpx_to_route job to the render server.', add_help=False)
+    parser.add_argument('--server', default='127.0.0.1:8765', help='host:port of render_server.py')
+    parser.add_argument('--socket', default=None, help='unix socket of render_server.py')
+    parser.add_argument('--no-wait', dest='wait', action='store_false', help='return once the job is queued')
+    parser.add_argument('--status', nargs='?', const='', default=None, help='show all jobs or the job')
+    parser.add_argument('--cancel', default=None, help='cancel the job')
+    args, rest = parser.parse_known_args()
+
+    host, _, port = args.server.rpartition(':')
+    client = Client(host, int(port), args.socket)
+
+    if args.status is not None:
+        print(json.dumps(client.status(args.status or None), indent=2))
+        return
+    if args.cancel:
+        print(json.dumps(client.cancel(args.cancel), indent=2))
+        return
+
+    route_parser = gpx_to_route.make_parser()
+    route_parser.prog = os.path.basename(sys.argv[0])
+    route_args = route_parser.parse_args(rest)
+    try:
+        config = gpx_to_route.config_from_args(route_args).validate()
+    except ValueError as e:
+        route_parser.error(str(e))
+
+    job = client.submit(config_to_json(config))
+    print('submit job:', job['id'])
+
+    if args.wait:
+        job = wait_job(client, job)
+        if job['status'] != 'done': sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## a long-running render daemon: jobs come in over http(or a unix socket),
+## run on a bounded worker pool and share the warm caches(parsed tracks,
+## rendered maps, fonts, icons, provider configs, tile db handle).
+##
+##   POST   /jobs        {"config": {...RenderConfig fields...}}  -> {"id": ...}
+##   GET    /jobs                                                 -> [job, ...]
+##   GET    /jobs/<id>                                            -> job(status, progress)
+##   DELETE /jobs/<id>                                            -> cancel the job
+##
+## submit the jobs with render_client.py
+
+import sys
+import os
+
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import threading
+import traceback
+import socketserver
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gpx_to_route
+
+
+class WarmCache(object):
+    """ a thread safe LRU, make() runs once per key even when asked by several jobs at once """
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.hit = self.miss = 0
+
+    def get_or_make(self, key, make):
+        with self.lock:
+            if key in self.data:
+                self.hit += 1
+                self.data.move_to_end(key)
+                return self.data[key]
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                if key in self.data:
+                    self.hit += 1
+                    return self.data[key]
+
+            try:
+                value = make()
+                with self.lock:
+                    self.miss += 1
+                    self.data[key] = value
+                    while len(self.data) > self.max_entries: self.data.popitem(last=False)
+            finally:
+                # also when make() failed, a job asking again makes it again
+                with self.lock: self.key_locks.pop(key, None)
+
+        return value
+
+    def stats(self):
+        return {'entries': len(self.data), 'hit': self.hit, 'miss': self.miss}
+
+
+class Job(object):
+    def __init__(self, config):
+        self.id = uuid.uuid4().hex[:12]
+        self.config = config
+        self.status = 'queued'
+        self.error = None
+        self.total = self.done = 0
+        self.submit_time = time.time()
+        self.start_time = self.end_time = None
+        self.cancel_event = threading.Event()
+
+    def to_dict(self):
+        now = self.end_time or time.time()
+        elapsed = now - self.start_time if self.start_time else 0.0
+        fps = self.done / elapsed if elapsed > 0 else 0.0
+
+        return {
+            'id': self.id, 'status': self.status, 'error': self.error,
+            'output': self.config.output, 'filename': self.config.filename,
+            'frame': self.done, 'total_frame': self.total, 'fps': fps,
+            'eta': (self.total - self.done) / fps if fps > 0 and self.status == 'running' else None,
+            'submit_time': self.submit_time, 'start_time': self.start_time, 'end_time': self.end_time,
+        }
+
+
+class JobProgress(object):
+    """ the progress given to gpx_to_route.render, also where a cancel stops the frame loop """
+    def __init__(self, job, total):
+        self.job = job
+        self.job.total = total
+
+    def update(self, done):
+        self.job.done = done
+        if self.job.cancel_event.is_set(): raise gpx_to_route.RenderCancelled(self.job.id)
+
+    def close(self):
+        pass
+
+
+class RenderServer(object):
+    def __init__(self, workers=2, max_queue=32, max_cache=16, max_finished=100):
+        self.max_queue = max_queue
+        self.max_finished = max_finished
+        self.cache = WarmCache(max_cache)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render', initializer=self._init_worker)
+
+    @staticmethod
+    def _init_worker():
+        # geotiler.render_map runs the tile download on the thread's event loop
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+    def submit(self, config):
+        # the spans are kept process wide, a trace of a job would hold the spans of the jobs run with it
+        if config.profile_out: raise ValueError('profile_out is not supported by the server, run gpx_to_route.py --profile-out')
+        config.validate()
+
+        with self.lock:
+            self._evict()
+            pending = sum(1 for j in self.jobs.values() if j.status in ('queued', 'running'))
+            if pending >= self.max_queue: raise OverflowError('queue is full: %d jobs' % pending)
+
+            job = Job(config)
+            self.jobs[job.id] = job
+
+        self.pool.submit(self._run, job)
+        return job
+
+    def _evict(self):
+        """ forget the oldest finished jobs beyond max_finished, so a long-running server does not grow """
+        finished = [j.id for j in self.jobs.values() if j.status not in ('queued', 'running')]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]: del self.jobs[job_id]
+
+    def job_list(self):
+        """ a copy of the jobs, the submits and evictions of other threads change them """
+        with self.lock: return list(self.jobs.values())
+
+    def get(self, job_id):
+        with self.lock: return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """ the job cancelled, None when there is no such job """
+        job = self.get(job_id)
+        if job is None: return None
+
+        job.cancel_event.set()
+        if job.status == 'queued': job.status = 'cancelled'
+        return job
+
+    def _run(self, job):
+        if job.cancel_event.is_set(): return
+
+        job.status, job.start_time = 'running', time.time()
+        try:
+            gpx_to_route.render(job.config, lambda total: JobProgress(job, total), self.cache)
+            job.status = 'done'
+        except gpx_to_route.RenderCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            traceback.print_exc()
+            job.status, job.error = 'failed', '%s: %s' % (type(e).__name__, e)
+        finally:
+            job.end_time = time.time()
+
+
+def make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        def address_string(self):
+            # client_address is empty on a unix socket
+            return str(self.client_address[0]) if self.client_address else 'unix'
+
+        def reply(self, code, obj):
+            body = json.dumps(obj, default=str).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def job_id(self):
+            parts = self.path.strip('/').split('/')
+            return parts[1] if len(parts) == 2 and parts[0] == 'jobs' else None
+
+        def do_GET(self):
+            if self.path.rstrip('/') == '/jobs':
+                return self.reply(200, [j.to_dict() for j in server.job_list()])
+            if self.path.rstrip('/') == '/stats':
+                return self.reply(200, {'cache': server.cache.stats()})
+
+            job = server.get(self.job_id())
+            if job is None: return self.reply(404, {'error': 'no such job'})
+            self.reply(200, job.to_dict())
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/jobs': return self.reply(404, {'error': 'not found'})
+
+            try:
+                data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                job = server.submit(gpx_to_route.RenderConfig(**data['config']))
+            except OverflowError as e:
+                return self.reply(503, {'error': str(e)})
+            except (ValueError, TypeError, KeyError) as e:
+                return self.reply(400, {'error': str(e)})
+
+            self.reply(201, job.to_dict())
+
+        def do_DELETE(self):
+            job = server.cancel(self.job_id())
+            if job is None: return self.reply(404, {'error': 'no such job'})
+            self.reply(200, job.to_dict())
+
+    return Handler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address): os.unlink(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render gpx_to_route jobs in a long-running process.')
+    parser.add_argument('--host', default='127.0.0.1', help='listen address')
+    parser.add_argument('--port', type=int, default=8765, help='listen port')
+    parser.add_argument('--socket', default=None, help='listen on the unix socket instead of tcp')
+    parser.add_argument('-j', '--workers', type=int, default=2, help='number of jobs rendered at the same time')
+    parser.add_argument('--max-queue', type=int, default=32, help='reject new jobs when so many are pending')
+    parser.add_argument('--max-cache', type=int, default=16, help='number of tracks and maps kept warm')
+    parser.add_argument('--max-finished', type=int, default=100, help='number of finished jobs kept to be asked for')
+    args = parser.parse_args()
+
+    if args.socket: args.socket = os.path.abspath(args.socket)
+
+    # fonts and icons are found relative to the script, same as run.sh does
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    server = RenderServer(args.workers, args.max_queue, args.max_cache, args.max_finished)
+    handler = make_handler(server)
+
+    if args.socket:
+        httpd = UnixHTTPServer(args.socket, handler)
+        print('listen on', args.socket)
+    else:
+        httpd = ThreadingHTTPServer((args.host, args.port), handler)
+        print('listen on http://%s:%d' % (args.host, args.port))
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        for job in server.job_list(): job.cancel_event.set()
+        server.pool.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## douglas-peucker simplification of the projected(map pixel) route, and the level of detail polylines
+## of it: level k keeps the points a 2**k times zoomed out map can tell apart.
+
+import sys
+import os
+
+import math
+
+
+def segment_distance(p, a, b):
+    """ distance from p to the segment a-b """
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    d2 = dx * dx + dy * dy
+    if d2 == 0: return math.hypot(p[0] - a[0], p[1] - a[1])
+
+    t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / d2))
+    return math.hypot(p[0] - a[0] - t * dx, p[1] - a[1] - t * dy)
+
+
+def douglas_peucker(points, tolerance):
+    """ index of the points kept, every dropped point is within tolerance of the polyline of the kept ones """
+    n = len(points)
+    if n < 3: return list(range(n))
+
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        a, b = points[start], points[end]
+
+        index, farthest = 0, tolerance
+        for i in range(start + 1, end):
+            d = segment_distance(points[i], a, b)
+            if d > farthest: index, farthest = i, d
+
+        if index:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return [i for i in range(n) if keep[i]]
+
+
+class RouteLOD(object):
+    """
+    level k is the route simplified with tolerance * 2**k pixels of the full zoom map,
+    which is tolerance pixels once the map is scaled down 2**k times.
+    every level is simplified from the one above it, the index are into the full route.
+    """
+    def __init__(self, points, tolerance=0.5, max_level=8):
+        self.points = points
+        self.tolerance = tolerance
+
+        index = douglas_peucker(points, tolerance)
+        self.levels = [index]
+        for k in range(1, max_level + 1):
+            if len(index) <= 2: break
+
+            sub = douglas_peucker([points[i] for i in index], tolerance * 2 ** k)
+            index = [index[i] for i in sub]
+            self.levels.append(index)
+
+    def level_of(self, scale):
+        """ the level fits the map scaled down `scale` times """
+        k = int(math.floor(math.log2(scale))) if scale > 1 else 0
+        return min(k, len(self.levels) - 1)
+
+    def index(self, scale=1):
+        return self.levels[self.level_of(scale)]
+
+    def polyline(self, scale=1):
+        """ points of the level in the scaled map pixel """
+        return [(self.points[i][0] / scale, self.points[i][1] / scale) for i in self.index(scale)]
+
+    def stats(self):
+        return [len(x) for x in self.levels]
+
+
+class ScaledMaps(object):
+    """
+    the map zoomed out 2**k times(k >= 1) for the outro, taken before the route is drawn.
+    the route is drawn on level k by its level k polyline when first asked, instead of
+    shrinking the full zoom map with every point rasterized on it.
+    """
+    def __init__(self, map_image, lod, max_scale, line_width, fill=(255, 0, 0)):
+        self.lod = lod
+        self.line_width = line_width
+        self.fill = fill
+
+        self.images = [None]
+        image = map_image
+        while 2 ** len(self.images) <= max_scale and min(image.size) >= 4:
+            image = image.reduce(2)
+            self.images.append(image)
+
+        self.drawn = set()
+
+    def level_of(self, scale):
+        return min(self.lod.level_of(scale), len(self.images) - 1)
+
+    def image(self, k):
+        """ level k with the route on it """
+        from PIL import ImageDraw
+
+        if k not in self.drawn:
+            width = max(1, int(self.line_width / 2 ** k + 0.5))
+            ImageDraw.Draw(self.images[k]).line(self.lod.polyline(2 ** k), fill=self.fill, width=width, joint='curve')
+            self.drawn.add(k)
+
+        return self.images[k]
@@ -10,9 +10,31 @@
 # https://github.com/zhengjie9510/google-map-downloader
 
 
+## how many tiles(and bytes, map pixels) a track or bbox needs at every zoom, before rendering it:
+##   ./geo_to_tile_num.py plan -t ../a.fit --zoom 12 17 --buffer 480 --max-mem 2000
+## the tiles within the buffer of the track are listed once each in the order the track reaches
+## them, so a cache warmed with them(warm) is filled along the route.
+
 import sys
+import os
 
 import math
+import json
+import pathlib
+import argparse
+import urllib.request
+
+from datetime import timezone
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+
+TILE_SIZE = 256
+SOURCE_DIR = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(SOURCE_DIR.parent))
+
+# average bytes of a downloaded tile by the image type
+TILE_BYTES = {'png': 20000, 'jpg': 25000, 'jpeg': 25000}
 
 
 def deg2num(lat_deg, lon_deg, zoom):
@@ -31,33 +53,206 @@ def num2deg(xtile, ytile, zoom):
     return lat_deg, lon_deg
 
 
+def deg2pixel(points, zoom, tile_size=TILE_SIZE):
+    """ world pixels (x, y) of the (lon, lat) points at the zoom, the constants computed once """
+    n = tile_size * (1 << zoom)
+    k, c = n / 360.0, n / (4 * math.pi)
+    sin, log, rad = math.sin, math.log, math.radians
+
+    out = []
+    for lon, lat in points:
+        s = sin(rad(max(-85.0511, min(85.0511, lat))))
+        out.append(((lon + 180.0) * k, n / 2 - log((1 + s) / (1 - s)) * c))
+    return out
+
+
+def quadkey(x, y, zoom):
+    """ the bing tile key """
+    digits = []
+    for i in range(zoom, 0, -1):
+        mask = 1 << (i - 1)
+        digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+    return ''.join(digits)
+
+
+def bbox_tiles(extent, zoom):
+    """ the tiles covering extent(min lon, min lat, max lon, max lat), row by row """
+    x0, y0 = deg2num(extent[3], extent[0], zoom)
+    x1, y1 = deg2num(extent[1], extent[2], zoom)
+    return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+
+def corridor_tiles(points, zoom, buffer_px=0, tile_size=TILE_SIZE):
+    """ the tiles within buffer_px of the track, each once, in the order the track reaches them """
+    pixels = deg2pixel(points, zoom, tile_size)
+    seen, tiles = set(), []
+    last = None
+
+    def visit(x, y):
+        nonlocal last
+        # the tile range around the point, skipped when it is the one of the last point
+        r = (int((x - buffer_px) // tile_size), int((x + buffer_px) // tile_size),
+             int((y - buffer_px) // tile_size), int((y + buffer_px) // tile_size))
+        if r == last: return
+        last = r
+
+        for ty in range(r[2], r[3] + 1):
+            for tx in range(r[0], r[1] + 1):
+                if (tx, ty) not in seen:
+                    seen.add((tx, ty))
+                    tiles.append((tx, ty))
+
+    if pixels: visit(*pixels[0])
+
+    # long segments are walked at a quarter tile, so the tiles they only cross are counted
+    step = tile_size / 4
+    for (ax, ay), (bx, by) in zip(pixels, pixels[1:]):
+        k = max(1, math.ceil(math.hypot(bx - ax, by - ay) / step))
+        for j in range(1, k + 1): visit(ax + (bx - ax) * j / k, ay + (by - ay) * j / k)
+
+    return tiles
+
+
+Estimate = namedtuple('Estimate', ['zoom', 'tiles', 'download_bytes', 'map_size', 'canvas_bytes'])
+
+
+def estimate(tiles, zoom, extension='png', tile_size=TILE_SIZE):
+    """ the download of the tiles, and the size and rgba bytes of the map image holding all of them """
+    if not tiles: return Estimate(zoom, 0, 0, (0, 0), 0)
+
+    xs, ys = [t[0] for t in tiles], [t[1] for t in tiles]
+    size = ((max(xs) - min(xs) + 1) * tile_size, (max(ys) - min(ys) + 1) * tile_size)
+
+    return Estimate(zoom, len(tiles), len(tiles) * TILE_BYTES.get(extension, TILE_BYTES['png']), size, size[0] * size[1] * 4)
+
+
+def plan(points, zooms, buffer_px=0, extension='png', corridor=True):
+    """ the estimate of every zoom, of the corridor along the track or of its whole bbox """
+    plans = []
+    for zoom in zooms:
+        if corridor:
+            tiles = corridor_tiles(points, zoom, buffer_px)
+        else:
+            x, y = zip(*points)
+            tiles = bbox_tiles((min(x), min(y), max(x), max(y)), zoom)
+        plans.append((estimate(tiles, zoom, extension), tiles))
+    return plans
+
+
+def load_provider(name):
+    """ the provider json of source/, by the file or its name """
+    path = pathlib.Path(name)
+    if not path.exists(): path = SOURCE_DIR / (name + '.json')
+    with open(path) as f: return json.load(f)
+
+
+def fix_points(points, provider):
+    """ the points moved onto a mars_in_china map(gcj-02) as gpx_to_route draws them """
+    if not provider.get('name', '').endswith('.mars_in_china'): return points
+
+    import util
+    return util.fix_mars_in_china(list(points))
+
+
+def tile_url(provider, x, y, zoom, s=None):
+    """
+    the url of the tile by the template of the provider json: {x} {y} {z} {s}/{subdomain} {quad} {ext},
+    the subdomain s by the tile when not given.
+    """
+    subdomains = provider.get('subdomains') or ['']
+    if s is None: s = subdomains[(x + y) % len(subdomains)]
+    return provider['url'].format(x=x, y=y, z=zoom, s=s, subdomain=s, quad=quadkey(x, y, zoom), ext=provider.get('extension', 'png'))
+
+
+def fetch(url, timeout=30):
+    request = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0 gpx_video'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as r: return url, r.read()
+    except Exception as e:
+        print('fail: %s %s' % (url, e), file=sys.stderr)
+        return url, None
+
+
+def tile_key(provider, x, y, zoom):
+    """ the key of the tile in the sqlite tile cache: its url by the first subdomain(gpx_to_route.tile_key) """
+    return tile_url(provider, x, y, zoom, (provider.get('subdomains') or [''])[0])
+
+
+def warm_cache(provider, tiles, zoom, cache_file, workers=4):
+    """ download the tiles not in the sqlite tile cache(the one gpx_to_route renders from) yet """
+    from sqlitedict import SqliteDict
+
+    db = SqliteDict(filename=str(cache_file), autocommit=False)
+    missing = {tile_url(provider, x, y, zoom): tile_key(provider, x, y, zoom) for x, y in tiles}
+    missing = {url: key for url, key in missing.items() if key not in db}
+    print('tiles: %d, cached: %d, to download: %d' % (len(tiles), len(tiles) - len(missing), len(missing)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for k, (url, data) in enumerate(executor.map(fetch, missing)):
+            if data: db[missing[url]] = data
+            if k % 100 == 99: db.commit()
+    db.commit()
+    db.close()
+
+
+def load_points(args):
+    """ (lon, lat) of the tracks, or the corners of the bbox """
+    if args.bbox: return [(args.bbox[0], args.bbox[1]), (args.bbox[2], args.bbox[3])]
+
+    import loading
+
+    points, _, _ = loading.load_gps_data(args.track, timezone.utc)
+    return points.positions()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tile numbers, urls and the tile plan of a track.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('point', help='the tile of a point and its url of every provider json')
+    p.add_argument('-z', '--zoom', type=int, default=16)
+    p.add_argument('lon', type=float, nargs='?', default=117.1906400)
+    p.add_argument('lat', type=float, nargs='?', default=39.1030400)
+
+    for name, text in (('plan', 'tile count, download and map size of every zoom'), ('warm', 'download the tiles into the tile cache')):
+        p = sub.add_parser(name, help=text)
+        p.add_argument('-t', '--track', action='append', default=[], help='gpx or fit file')
+        p.add_argument('--bbox', nargs=4, type=float, default=None, metavar=('W', 'S', 'E', 'N'), help='extent instead of a track')
+        p.add_argument('--zoom', nargs='+', type=int, default=[16], help='zoom, or the first and last zoom of a range')
+        p.add_argument('--buffer', type=int, default=480, help='pixels around the track, half the video size for the route video')
+        p.add_argument('--whole-bbox', action='store_true', help='all tiles of the bbox instead of the corridor')
+        p.add_argument('--provider', default='esri-world-imagery', help='provider json of source/, by the file or its name')
+        p.add_argument('--max-mem', type=float, default=None, help='MB of the map image, the zooms over it are rejected')
+        p.add_argument('--max-tiles', type=int, default=None, help='tiles, the zooms over it are rejected')
+        p.add_argument('--cache-dir', type=pathlib.Path, default=pathlib.Path.home() / '.cache/geotiler/', help='location of the tile cache')
+        p.add_argument('--workers', type=int, default=4, help='download threads')
+
+    args = parser.parse_args()
+
+    if args.command == 'point':
+        print(*deg2num(args.lat, args.lon, args.zoom))
+        for path in sorted(SOURCE_DIR.glob('*.json')):
+            provider = load_provider(path)
+            (lon, lat), = fix_points([(args.lon, args.lat)], provider)
+            x, y = deg2num(lat, lon, args.zoom)
+            print(path.stem, tile_url(provider, x, y, args.zoom))
+        return
+
+    if not args.track and not args.bbox: parser.error('give -t or --bbox')
+
+    zooms = range(args.zoom[0], args.zoom[-1] + 1)
+    provider = load_provider(args.provider)
+    points = fix_points(load_points(args), provider)
+
+    for e, tiles in plan(points, zooms, args.buffer, provider.get('extension', 'png'), not args.whole_bbox):
+        too_big = (args.max_mem and e.canvas_bytes > args.max_mem * 1e6) or (args.max_tiles and e.tiles > args.max_tiles)
+        print('zoom %2d: %7d tiles, %8.1f MB download, map %6d x %-6d %8.1f MB%s'
+              % (e.zoom, e.tiles, e.download_bytes / 1e6, e.map_size[0], e.map_size[1], e.canvas_bytes / 1e6, ', rejected' if too_big else ''))
+
+        if args.command == 'warm' and not too_big:
+            args.cache_dir.mkdir(parents=True, exist_ok=True)
+            warm_cache(provider, tiles, e.zoom, args.cache_dir / 'tilecache.sqlite', args.workers)
+
+
 if __name__ == '__main__':
-    zoom = int(sys.argv[1]) if len(sys.argv) > 1 else 16
-
-    lon, lat = 117.1906400, 39.1030400
-    x, y = deg2num(lat, lon, zoom)
-    print(x, y)
-
-    print('http://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{0}/{2}/{1}'.format(zoom, x, y))
-    # print('http://server.arcgisonline.com/ArcGIS/rest/services/World_Physical_Map/MapServer/tile/{0}/{2}/{1}'.format(zoom, x, y))
-    # print('https://basemap.nationalmap.gov/arcgis/rest/services/USGSImageryOnly/MapServer/tile/{0}/{2}/{1}'.format(zoom, x, y))
-
-    # print('https://map1.vis.earthdata.nasa.gov/wmts-webmerc/MODIS_Terra_CorrectedReflectance_TrueColor/default/GoogleMapsCompatible_Level9/{0}/{2}/{1}.jpg'.format(zoom, x, y))
-
-    # m for map;
-    # s for satellite;
-    # y for satellite with label;
-    # t for terrain;
-    # p for terrain with label;
-    # h for label;
-    print('https://mt0.google.com/vt?lyrs=m&x={1}&s=&y={2}&z={0}'.format(zoom, x, y)) # google map
-    print('https://mt0.google.com/vt?lyrs=s&x={1}&s=&y={2}&z={0}'.format(zoom, x, y)) # google map satellite
-    print('https://mt0.google.com/vt?lyrs=y&x={1}&s=&y={2}&z={0}'.format(zoom, x, y)) # google map satellite with label
-    # print('https://mt0.google.com/vt?lyrs=t&x={1}&s=&y={2}&z={0}'.format(zoom, x, y)) # google map terrain
-    print('https://mt0.google.com/vt?lyrs=p&x={1}&s=&y={2}&z={0}'.format(zoom, x, y)) # google map terrain with label
-    print('https://mt0.google.com/vt?lyrs=h&x={1}&s=&y={2}&z={0}'.format(zoom, x, y)) # label
-
-    print('http://webrd01.is.autonavi.com/appmaptile?lang=zh_cn&size=1&scale=1&style=8&x={1}&y={2}&z={0}'.format(zoom, x, y))
-
-    # http://mts0.googleapis.com/vt?lyrs={style}&x={x}&y={y}&z={z}
-    # http://mt2.google.cn/vt/lyrs={style}&hl=zh-CN&gl=CN&src=app&x={x}&y={y}&z={z}
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## session statistics(distance, moving time, ascent, max/avg speed) computed from the track
+## itself, for the files without a session record(gpx).
+
+import sys
+import os
+
+import math
+
+import timeline
+
+
+STOP_SPEED = 1.0
+GAP_SEC = 60
+ASCENT_HYSTERESIS = 3.0
+
+
+def segment_meters(positions):
+    """ haversine meters between the neighbour (lon, lat), one pass with cos(lat) computed once per point """
+    if len(positions) < 2: return []
+
+    rad = math.pi / 180
+    lon = [p[0] * rad for p in positions]
+    lat = [p[1] * rad for p in positions]
+    cos_lat = [math.cos(x) for x in lat]
+
+    sin, asin, sqrt = math.sin, math.asin, math.sqrt
+    d = 2 * timeline.EARTH_R
+    return [d * asin(sqrt(min(1.0, sin((lat[i] - lat[i-1]) / 2) ** 2 + cos_lat[i-1] * cos_lat[i] * sin((lon[i] - lon[i-1]) / 2) ** 2)))
+            for i in range(1, len(positions))]
+
+
+def running_ascent(altitudes, hysteresis=ASCENT_HYSTERESIS):
+    """ meters climbed up to every point, a climb counts once it is `hysteresis` above the lowest point since the last one """
+    ascent, total = [], 0.0
+    base = None
+    for a in altitudes:
+        if a is not None:
+            if base is None or a < base: base = a
+            elif a - base >= hysteresis:
+                total += a - base
+                base = a
+        ascent.append(total)
+    return ascent
+
+
+class TrackStats(object):
+    """ running distance, moving time, ascent and speed at every point of a track.Track, with the totals of them """
+    def __init__(self, track, stop_speed=STOP_SPEED, gap_sec=GAP_SEC):
+        t0 = track['time'][0]
+        altitudes = [None if a != a else a for a in track['alt']]
+        self.compute([(t - t0) / 1e9 for t in track['time']], track.positions(), altitudes, stop_speed, gap_sec)
+
+    def compute(self, seconds, positions, altitudes, stop_speed, gap_sec):
+        self.seconds = seconds
+
+        self.meters = [0.0]
+        for d in segment_meters(positions): self.meters.append(self.meters[-1] + d)
+
+        self.speeds = timeline.point_speeds(self.seconds, self.meters)
+
+        # the time of a segment counts as moving when it is not a gap and the rider is not stopped at either end
+        self.moving = [0.0]
+        for i in range(1, len(self.seconds)):
+            dt = self.seconds[i] - self.seconds[i-1]
+            is_moving = dt <= gap_sec and max(self.speeds[i-1], self.speeds[i]) >= stop_speed
+            self.moving.append(self.moving[-1] + (dt if is_moving else 0.0))
+
+        self.ascent = running_ascent(altitudes if altitudes else [None] * len(self.seconds))
+
+    @property
+    def total_distance(self):
+        return self.meters[-1]
+
+    @property
+    def total_moving_time(self):
+        return self.moving[-1]
+
+    @property
+    def total_elapsed_time(self):
+        return self.seconds[-1]
+
+    @property
+    def total_ascent(self):
+        return self.ascent[-1]
+
+    @property
+    def max_speed(self):
+        return max(self.speeds)
+
+    @property
+    def avg_speed(self):
+        return self.total_distance / self.total_moving_time if self.total_moving_time else 0.0
+
+    def session(self, start_dt, end_dt):
+        from loading import Session
+
+        return Session(end_dt, start_dt, self.total_elapsed_time, self.total_moving_time,
+                       self.total_distance, self.total_ascent, self.max_speed, self.avg_speed)
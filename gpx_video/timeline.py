@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## which gps points become frames: one frame per `points_per_frame` points while riding,
+## stops(and optionally straight, monotonous stretches) are sped up by giving their
+## points a smaller weight.
+
+import sys
+import os
+
+import math
+import bisect
+
+
+EARTH_R = 6371008.8
+
+
+def haversine(p1, p2):
+    """ meters between two (lon, lat) """
+    lon1, lat1, lon2, lat2 = map(math.radians, (p1[0], p1[1], p2[0], p2[1]))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_R * math.asin(math.sqrt(min(1.0, a)))
+
+
+def cumulative(seconds, positions):
+    """ seconds and meters from the first point, of the epoch seconds of the points """
+    t0 = seconds[0]
+    seconds = [t - t0 for t in seconds]
+
+    meters = [0.0]
+    for i in range(1, len(positions)):
+        meters.append(meters[-1] + haversine(positions[i-1], positions[i]))
+
+    return seconds, meters
+
+
+def point_speeds(seconds, meters, window=5):
+    """ m/s of every point, averaged over `window` points on both sides """
+    n = len(seconds)
+    speeds = []
+    for i in range(n):
+        a, b = max(0, i - window), min(n - 1, i + window)
+        dt = seconds[b] - seconds[a]
+        speeds.append((meters[b] - meters[a]) / dt if dt > 0 else 0.0)
+    return speeds
+
+
+def detect_stops(seconds, speeds, stop_speed=1.0, min_stop_sec=60):
+    """ [start, end) index ranges slower than stop_speed for at least min_stop_sec """
+    stops, start = [], None
+    for i, v in enumerate(speeds + [stop_speed]):
+        if v < stop_speed:
+            if start is None: start = i
+        elif start is not None:
+            if seconds[i-1] - seconds[start] >= min_stop_sec: stops.append((start, i))
+            start = None
+    return stops
+
+
+def straight_mask(seconds, meters, positions, window_sec=120, straightness=0.98):
+    """ True for the points in the middle of a window whose chord is almost the path length """
+    n = len(seconds)
+    cover = [0] * (n + 1)
+
+    j = 0
+    for i in range(n):
+        while j < n - 1 and seconds[j] - seconds[i] < window_sec: j += 1
+        if seconds[j] - seconds[i] < window_sec: break
+
+        path = meters[j] - meters[i]
+        if path > 100 and haversine(positions[i], positions[j]) >= path * straightness:
+            cover[i] += 1
+            cover[j + 1] -= 1
+
+    mask, c = [], 0
+    for i in range(n):
+        c += cover[i]
+        mask.append(c > 0)
+
+    return mask
+
+
+def point_weights(seconds, positions, stop_compress=0, straight_speedup=0, speeds=None, stop_speed=1.0, min_stop_sec=60):
+    """
+    frame cost of every point(by epoch second), 1 while riding, 1/stop_compress during a stop, 1/straight_speedup on a straight stretch.
+    speeds(m/s, eg. the speed column of a fit file) are taken where not nan, the ones from the points elsewhere.
+    """
+    seconds, meters = cumulative(seconds, positions)
+    if speeds is None:
+        speeds = point_speeds(seconds, meters)
+    else:
+        speeds = list(speeds)   # eg. a track column(memoryview)
+        if any(v != v for v in speeds):
+            speeds = [d if v != v else v for v, d in zip(speeds, point_speeds(seconds, meters))]
+
+    weights = [1.0] * len(seconds)
+
+    if straight_speedup > 1:
+        for i, is_straight in enumerate(straight_mask(seconds, meters, positions)):
+            if is_straight: weights[i] = 1.0 / straight_speedup
+
+    stops = detect_stops(seconds, speeds, stop_speed, min_stop_sec) if stop_compress > 1 else []
+    for start, end in stops:
+        for i in range(start, end): weights[i] = 1.0 / stop_compress
+
+    if stops:
+        print('stops: %d, %.1f min compressed %dx' % (len(stops), sum(seconds[e-1] - seconds[s] for s, e in stops) / 60, stop_compress))
+
+    return weights
+
+
+def select_frames(weights, points_per_frame, keep_index=()):
+    """ index of the points shown as frames: every `points_per_frame` of the weight, the first, the last and keep_index """
+    keep = set(keep_index)
+
+    index, threshold, cost = [], 0.0, 0.0
+    for i, w in enumerate(weights):
+        if cost >= threshold or i in keep:
+            index.append(i)
+            while threshold <= cost: threshold += points_per_frame
+        cost += w
+
+    if index[-1] != len(weights) - 1: index.append(len(weights) - 1)
+
+    return index
+
+
+def keep_index_of(timestamps, keep_times):
+    """ index of the first point at or after every time, the one a photo is shown on """
+    index = []
+    for dt in keep_times:
+        i = bisect.bisect_left(timestamps, dt)
+        if i < len(timestamps): index.append(i)
+    return index
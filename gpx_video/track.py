@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## a track as typed columns in one buffer(52 bytes a point, not a datetime and a tuple of
+## floats a point): the buffer is a bytearray or a mmap of a track file, so a saved track opens
+## without parsing and the processes opening it share its pages. a slice of a track is a view
+## of the same buffer.
+
+import sys
+import os
+
+import mmap
+import struct
+
+from array import array
+
+from datetime import datetime, timezone
+
+
+# name, array typecode; the 8 byte columns first, so every column is aligned
+FIELDS = (('time', 'q'), ('lon', 'd'), ('lat', 'd'), ('odo', 'd'),
+          ('alt', 'f'), ('speed', 'f'), ('cadence', 'f'), ('hr', 'f'), ('temp', 'f'))
+ITEM_SIZE = {'q': 8, 'd': 8, 'f': 4}
+POINT_SIZE = sum(ITEM_SIZE[code] for _, code in FIELDS)
+
+MAGIC = b'GPXTRK01'
+HEADER = struct.Struct('<8sq')
+
+
+def column_views(buf, n, offset=0):
+    """ {name: memoryview} of the columns of n points laid out in buf from offset """
+    view, columns = memoryview(buf), {}
+    for name, code in FIELDS:
+        size = ITEM_SIZE[code] * n
+        columns[name] = view[offset:offset + size].cast(code)
+        offset += size
+    return columns
+
+
+class Track(object):
+    """ time(epoch ns), lon/lat(degree), odo(m) as 64 bit, alt(m), speed(m/s), cadence, hr, temp as 32 bit, nan where unknown """
+    __slots__ = ('columns', 'owner')
+
+    def __init__(self, columns, owner=None):
+        self.columns = columns
+        self.owner = owner   # the mmap the views are of, kept alive with them
+
+    @classmethod
+    def allocate(cls, n):
+        columns = column_views(bytearray(POINT_SIZE * n), n)
+        for name, code in FIELDS[1:]: columns[name][:] = array(code, [float('nan')]) * n
+        return cls(columns)
+
+    @classmethod
+    def from_rows(cls, rows, names=('time', 'lon', 'lat', 'alt', 'speed', 'odo', 'cadence', 'hr', 'temp')):
+        """ the track of the rows(tuples of the names, time in epoch second, None where unknown) sorted by time """
+        rows = sorted(rows, key=lambda r: r[0])
+        track = cls.allocate(len(rows))
+
+        for k, name in enumerate(names):
+            column = track.columns[name]
+            if name == 'time':
+                for i, r in enumerate(rows): column[i] = int(round(r[k] * 1e9))
+            else:
+                for i, r in enumerate(rows):
+                    if r[k] is not None: column[i] = r[k]
+        return track
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def __getitem__(self, key):
+        """ the column of a name, or a view of the points of a slice """
+        if isinstance(key, str): return self.columns[key]
+        if not isinstance(key, slice) or key.step not in (None, 1): raise TypeError('a column name or a slice: %r' % (key, ))
+        return Track({name: column[key] for name, column in self.columns.items()}, self.owner)
+
+    @property
+    def nbytes(self):
+        return POINT_SIZE * len(self)
+
+    def take(self, index):
+        """ a new track of the points at the index, eg. the resampled ones """
+        track = Track.allocate(len(index))
+        for name, column in self.columns.items():
+            out = track.columns[name]
+            for j, i in enumerate(index): out[j] = column[i]
+        return track
+
+    def seconds(self):
+        """ epoch second of every point """
+        return [t / 1e9 for t in self.columns['time']]
+
+    def timestamps(self, tz=timezone.utc):
+        return [datetime.fromtimestamp(t / 1e9, tz) for t in self.columns['time']]
+
+    def positions(self):
+        return list(zip(self.columns['lon'], self.columns['lat']))
+
+    def tobytes(self):
+        return b''.join(self.columns[name].tobytes() for name, _ in FIELDS)
+
+    def save(self, filename):
+        """ write the track file opened by open(), through a temporary file """
+        tmp = str(filename) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(self)))
+            f.write(self.tobytes())
+        os.replace(tmp, filename)
+
+    @classmethod
+    def open(cls, filename):
+        """ the track of the file mapped read only, the pages are read as the columns are """
+        with open(filename, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, n = HEADER.unpack_from(m)
+        if magic != MAGIC or len(m) != HEADER.size + POINT_SIZE * n: raise ValueError('not a track file: %s' % filename)
+
+        return cls(column_views(m, n, HEADER.size), m)
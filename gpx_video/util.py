@@ -4,20 +4,20 @@
 import sys
 import os
 
+import bisect
+
 from pathlib import Path
-from collections import defaultdict, namedtuple
+from collections import defaultdict, namedtuple, deque
 
 from datetime import datetime, timedelta
-import pytz
-
-import requests
 
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
-from geopy.distance import geodesic
-
-import exif
-from PIL import Image, ImageOps
+import perf
+import probe
+import encoder
+import exifscan
+import markers
 
 
 def get_tz(lon, lat, username='yang'):
@@ -25,6 +25,9 @@ def get_tz(lon, lat, username='yang'):
     ## https://www.geonames.org/export/web-services.html#timezone
     # http://api.geonames.org/timezoneJSON?lat=47.01&lng=10.2&username=yang
 
+    import pytz
+    import requests
+
     print('get timezone online...')
 
     r = requests.get(f'http://api.geonames.org/timezoneJSON?lat={lat}&lng={lon}&username={username}')
@@ -62,21 +65,44 @@ def check_file_type(filepath):
             return None
 
 
-def splice_main_cmd_string(outfile, window_size, fps, is_release):
+def crop_to_aspect(window_size, out_size):
+    """ the middle part of the window with the aspect of out_size, in even pixels """
+    width, height = window_size
+    if out_size[0] * height > width * out_size[1]:
+        height = width * out_size[1] // out_size[0]
+    else:
+        width = height * out_size[0] // out_size[1]
+    return width // 2 * 2, height // 2 * 2
+
+
+def splice_main_cmd_string(outfile, window_size, fps, is_release, profile=None, outputs=()):
+    """ outputs: more (outfile, size) encoded from the same frames, cropped to their aspect and scaled by a split graph """
     width, height = window_size
     cmd_string = [
         'ffmpeg',
         '-y', '-hide_banner', '-loglevel', 'info',
         '-f', 'rawvideo', '-framerate', str(fps), '-s', f'{width}x{height}', '-pix_fmt', 'rgba',
         '-i', '-',
-        '-r', str(fps),
-        '-vcodec', 'libx264'
     ]
 
-    if is_release: cmd_string.extend(['-preset', 'fast'])
-    else: cmd_string.extend(['-preset', 'superfast'])
+    video_args = encoder.video_args(encoder.get_profile(profile, is_release))
+
+    if not outputs:
+        cmd_string.extend(['-r', str(fps)])
+        cmd_string.extend(video_args)
+        cmd_string.append(outfile)
+    else:
+        graph = ['[0:v]split=%d[v0]%s' % (len(outputs) + 1, ''.join('[s%d]' % (i + 1) for i in range(len(outputs))))]
+        for i, (_, out_size) in enumerate(outputs, 1):
+            crop_w, crop_h = crop_to_aspect(window_size, out_size)
+            graph.append('[s%d]crop=%d:%d,scale=%d:%d[v%d]' % (i, crop_w, crop_h, out_size[0], out_size[1], i))
+        cmd_string.extend(['-filter_complex', ';'.join(graph)])
+
+        for i, name in enumerate([outfile] + [x for x, _ in outputs]):
+            cmd_string.extend(['-map', '[v%d]' % i, '-r', str(fps)])
+            cmd_string.extend(video_args)
+            cmd_string.append(name)
 
-    cmd_string.append(outfile)
     print(cmd_string)
 
     return cmd_string
@@ -89,50 +115,45 @@ def splice_clip_cmd_string(infile, window_size, fps, is_release):
         '-y', '-hide_banner', '-loglevel', 'error',
         '-i', infile,
         '-vf', f'scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:-1:-1:color=black',
-        '-f', 'rawvideo', '-r', str(fps), '-s', f'{width}x{height}', '-pix_fmt', 'rgba'
+        '-f', 'rawvideo', '-r', str(fps), '-s', f'{width}x{height}', '-pix_fmt', 'rgba',
+        '-'
     ]
 
-    if is_release: cmd_string.extend(['-preset', 'fast'])
-    else: cmd_string.extend(['-preset', 'ultrafast'])
-
-    cmd_string.append('-')
     print(cmd_string)
 
     return cmd_string
 
 
-def splice_scale_cmd_string(infile, outfile, window_size, fps):
+def splice_scale_cmd_string(infile, outfile, window_size, fps, profile='clip'):
     width, height = window_size
     cmd_string = [
         'ffmpeg',
         '-y', '-hide_banner', '-loglevel', 'error',
         '-i', infile,
         '-vf', f'scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:-1:-1:color=black',
-        '-r', str(fps),
-        '-c:v', 'libx264',
-        '-c:a', 'aac',
-        '-preset', 'fast',
-        outfile
+        '-r', str(fps)
     ]
 
+    cmd_string.extend(encoder.video_args(encoder.get_profile(profile)))
+    cmd_string.extend(['-c:a', 'aac', outfile])
+
     print(cmd_string)
 
     return cmd_string
 
 
-def splice_concat_cmd_string(concat_file, outfile, is_release):
+def splice_concat_cmd_string(concat_file, outfile, is_release, profile=None):
     cmd_string = [
         'ffmpeg',
         '-y', '-hide_banner', '-loglevel', 'info',
         '-f', 'concat',
         '-safe', '0',
         '-i', concat_file,
-        '-c:v', 'libx264', '-c:a', 'aac'
+        '-c:a', 'aac'
         # '-c', 'copy'
     ]
 
-    if is_release: cmd_string.extend(['-preset', 'fast'])
-    else: cmd_string.extend(['-preset', 'superfast'])
+    cmd_string.extend(encoder.video_args(encoder.get_profile(profile, is_release)))
 
     cmd_string.append(outfile)
     print(cmd_string)
@@ -140,7 +161,7 @@ def splice_concat_cmd_string(concat_file, outfile, is_release):
     return cmd_string
 
 
-def splice_concat_cmd_string2(concat_file_list, outfile, filter_complex, video_map, audio_map, is_release):
+def splice_concat_cmd_string2(concat_file_list, outfile, filter_complex, video_map, audio_map, is_release, profile=None):
     cmd_string = [
         'ffmpeg',
         '-y', '-hide_banner', '-loglevel', 'info'
@@ -156,8 +177,7 @@ def splice_concat_cmd_string2(concat_file_list, outfile, filter_complex, video_m
     if audio_map is not None:
         cmd_string.extend(['-map', audio_map])
 
-    if is_release: cmd_string.extend(['-preset', 'fast'])
-    else: cmd_string.extend(['-preset', 'superfast'])
+    cmd_string.extend(encoder.video_args(encoder.get_profile(profile, is_release)))
 
     cmd_string.append(outfile)
     print(cmd_string)
@@ -190,14 +210,61 @@ def splice_audio_cmd_string(outfile, video_file, audio_file=None):
 
 
 def exists_audio(video_file):
-    r = subprocess.run(['ffprobe', '-hide_banner', '-loglevel', 'error', '-select_streams', 'a', '-show_entries', 'stream=codec_type', '-of', 'csv=p=0', video_file], capture_output=True)
-    return r.stdout.strip() == b'audio'
+    return probe.has_audio(probe.probe(video_file))
+
+
+def probe_video(video_file):
+    """ width, height, fps(as the 'num/den' string ffmpeg takes) and duration in second of the first video stream """
+    info = probe.probe(video_file)
+    stream = probe.video_stream(info)
+
+    return stream['width'], stream['height'], stream['r_frame_rate'], float(info['format']['duration'])
+
+
+def splice_overlay_cmd_string(infile, outfile, start, end, overlay_size, fps, position, is_release, profile=None):
+    """ decode the clip(from start to end second), put the rgba frames of stdin on it at position and encode, in one pass """
+    width, height = overlay_size
+    cmd_string = [
+        'ffmpeg',
+        '-y', '-hide_banner', '-loglevel', 'info'
+    ]
+
+    if start: cmd_string.extend(['-ss', '%.3f' % start])
+    if end: cmd_string.extend(['-to', '%.3f' % end])
+
+    cmd_string.extend([
+        '-i', infile,
+        '-f', 'rawvideo', '-framerate', str(fps), '-s', f'{width}x{height}', '-pix_fmt', 'rgba',
+        '-i', '-',
+        '-filter_complex', '[0:v][1:v]overlay=%s:%s:eof_action=pass[outv]' % position,
+        '-map', '[outv]', '-map', '0:a?'
+    ])
+
+    cmd_string.extend(encoder.video_args(encoder.get_profile(profile, is_release)))
+    cmd_string.extend(['-c:a', 'copy', outfile])
+
+    print(cmd_string)
+
+    return cmd_string
+
+
+def load_photo_frame(filename, window_size):
+    """ rgba bytes of the photo padded to the window, the jpeg is decoded at the smallest scale still covering it """
+    from PIL import Image, ImageOps
+
+    im = Image.open(filename)
+    side = max(window_size)
+    im.draft('RGB', (side, side))
+
+    im = ImageOps.exif_transpose(im).convert('RGBA')
+
+    return ImageOps.pad(im, window_size).tobytes()
 
 
 PhotoInfo = namedtuple('PhotoInfo', ['photo_name', 'is_video', 'dt', 'lon', 'lat'], defaults=(None, False, None, None, None))
 
 class PhotoRender(object):
-    def __init__(self, filename, timestamp_list, location_list, is_mars_in_china=False, is_release=False):
+    def __init__(self, filename, timestamp_list, location_list, is_mars_in_china=False, is_release=False, cache_file=None):
         self.is_mars_in_china = is_mars_in_china
         self.is_release = is_release
 
@@ -207,36 +274,68 @@ class PhotoRender(object):
         self.is_init = filename is not None
         if not self.is_init or not os.path.exists(filename): return
 
-        self._read_photo_file(filename, is_mars_in_china)
-        self._find_photo_location(timestamp_list, location_list)
+        self._read_photo_file(filename, is_mars_in_china, cache_file)
+        if timestamp_list is not None: self._find_photo_location(timestamp_list, location_list)
 
-    def render_photo_if_need(self, pipe_out, writer, window_size, dt, fps, time_in_sec=1.5):
-        if dt not in self.photo_location_dict: return []
+    def locate(self, timestamp_list, location_list):
+        """ when created without the track: find the point of every photo once the track is resampled """
+        self.photo_location_dict.clear()
+        if self.photo_info_list: self._find_photo_location(timestamp_list, location_list)
 
-        num_frame = int(fps * time_in_sec)
+    def times(self):
+        return [pi.dt for pi in self.photo_info_list]
 
-        for photo_info in self.photo_location_dict[dt]:
-            if photo_info.is_video:
-                continue
+    def start(self, timestamp_list, window_size, ahead=4, workers=2):
+        """
+        plan the photos before the frame loop: the sorted point index every photo list is shown at,
+        and decode the first `ahead` photos in the background.
+        """
+        index_of = {t: i for i, t in enumerate(timestamp_list)}
+        self.plan = sorted((index_of[dt], pi_list) for dt, pi_list in self.photo_location_dict.items() if dt in index_of)
+        self.plan_pos = 0
 
-                print('render video:', photo_info.photo_name)
+        self.window_size = tuple(window_size)
+        self.pending = [pi.photo_name for _, pi_list in self.plan for pi in pi_list if not pi.is_video]
+        self.pending.reverse()
+        self.frame_futures = deque()
 
-                cmd_string = splice_clip_cmd_string(photo_info.photo_name, window_size, fps, self.is_release)
+        self.ahead = ahead
+        self.executor = ThreadPoolExecutor(max_workers=workers) if self.pending else None
+        self._prefetch()
 
-                p2 = subprocess.Popen(cmd_string, stdout=pipe_out)
-                p2.wait()
+    def insert_at(self, writer, i, fps, time_in_sec=1.5):
+        """ write the frames of the photos planned at point i, return their PhotoInfo """
+        if self.plan_pos >= len(self.plan) or self.plan[self.plan_pos][0] != i: return []
 
-            else:
-                print('render photo:', photo_info.photo_name)
+        _, pi_list = self.plan[self.plan_pos]
+        self.plan_pos += 1
+
+        num_frame = int(fps * time_in_sec)
+        for photo_info in pi_list:
+            if photo_info.is_video: continue
+
+            print('render photo:', photo_info.photo_name)
+
+            with perf.span('photo_frames'):
+                with perf.span('photo_wait'):
+                    frame = self.frame_futures.popleft().result()
+                self._prefetch()
+
+                for _ in range(num_frame): writer.write(frame)
+            perf.count('frames.photo', num_frame)
 
-                im = Image.open(photo_info.photo_name).convert('RGBA')
-                ImageOps.exif_transpose(im, in_place=True)
+        return pi_list
 
-                bg = ImageOps.pad(im, window_size)
+    def close(self):
+        if getattr(self, 'executor', None): self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
 
-                for i in range(num_frame): writer.write(bg.tobytes())
+    def _prefetch(self):
+        while self.pending and len(self.frame_futures) < self.ahead:
+            self.frame_futures.append(self.executor.submit(load_photo_frame, self.pending.pop(), self.window_size))
 
-        return self.photo_location_dict[dt]
+    def frame_num(self, fps, time_in_sec=1.5):
+        return sum(int(fps * time_in_sec) for pi_list in self.photo_location_dict.values() for pi in pi_list if not pi.is_video)
 
     def videos(self):
         for pi_list in self.photo_location_dict.values():
@@ -244,46 +343,49 @@ class PhotoRender(object):
                 if pi.is_video:
                     yield pi.photo_name
 
-    def draw_camera_icon(self, mm, map_image, icon_photo='./icon/c3.png', icon_video='./icon/c1.png', icon_size=(60, 60)):
-        im_photo = ImageOps.contain(Image.open(icon_photo), icon_size)
-        im_video = ImageOps.contain(Image.open(icon_video), icon_size)
+    def draw_camera_icon(self, mm, map_image, icon_photo='./icon/c3.png', icon_video='./icon/c1.png', icon_size=(60, 60), cluster_radius=0):
+        layer = markers.MarkerLayer(icon_size)
 
         for photo_info in sorted([x for xx in self.photo_location_dict.values() for x in xx], key=lambda a: a.dt):
-            bg = Image.new('RGBA', map_image.size)
-
-            im = im_video if photo_info.is_video else im_photo
             x, y = mm.rev_geocode((photo_info.lon, photo_info.lat))
-            bg.paste(im, (int(x-im.width//2), int(y-im.height//2)))
+            layer.add(x, y, icon_video if photo_info.is_video else icon_photo)
 
-            map_image.alpha_composite(bg)
+        layer.draw(map_image, cluster_radius)
 
     def debug(self):
         for x in self.photo_info_list: print(x)
         for x in self.photo_location_dict.items(): print(x)
 
-    def _read_photo_file(self, filename, is_mars_in_china):
-        for line in open(filename):
-            if line.startswith('#') or line.startswith('\n'): continue
+    def _read_photo_file(self, filename, is_mars_in_china, cache_file=None):
+        """ the photo file lists a photo name and [or] datetime per line, or it is a dir of them """
+        if os.path.isdir(filename):
+            entries = [(x, None) for x in exifscan.list_media(filename)]
+        else:
+            entries = []
+            for line in open(filename):
+                if line.startswith('#') or line.startswith('\n'): continue
+
+                xxxx = line.strip().split(' ')
+
+                photo_name = xxxx[0]
+                if not os.path.exists(photo_name): continue
 
-            xxxx = line.strip().split(' ')
+                dt = datetime.strptime(xxxx[1], '%Y-%m-%dT%H:%M:%S%z') if len(xxxx) > 1 else None
+                entries.append((photo_name, dt))
 
-            photo_name = xxxx[0]
-            if not os.path.exists(photo_name): continue
+        found = exifscan.scan([x for x, dt in entries if dt is None and check_file_type(x)], cache_file)
 
+        for photo_name, dt in entries:
             file_type = check_file_type(photo_name)
             if file_type is None: continue
 
             is_video = (file_type == 'video')
 
-            if len(xxxx) > 1:
-                dt = datetime.strptime(xxxx[1], '%Y-%m-%dT%H:%M:%S%z')
+            if dt is not None:
                 self.photo_info_list.append(PhotoInfo(photo_name, is_video, dt))
-            elif len(xxxx) == 1 and not is_video:
-                aaa = self._read_photo_location_from_file(photo_name)
-                if aaa is None : continue
-
-                dt, lon, lat = aaa
-                if is_mars_in_china:
+            elif found.get(photo_name) is not None:
+                dt, lon, lat = found[photo_name]
+                if is_mars_in_china and lon is not None:
                     lon, lat = fix_mars_in_china((lon, lat))
 
                 self.photo_info_list.append(PhotoInfo(photo_name, is_video, dt, lon, lat))
@@ -291,11 +393,13 @@ class PhotoRender(object):
                 print(photo_name + ' has no timestamp, skip')
 
     def _find_photo_location(self, timestamp_list, location_list):
+        from geopy.distance import geodesic
+
         for photo_name, is_video, dt, lon, lat in self.photo_info_list:
             if dt+timedelta(hours=1) < timestamp_list[0] or dt-timedelta(hours=1) > timestamp_list[-1]: continue
 
-            for i, t in enumerate(timestamp_list):
-                if t >= dt: break
+            # the first point at or after the photo, the last one when all are before it
+            i = min(bisect.bisect_left(timestamp_list, dt), len(timestamp_list) - 1)
 
             if lon is not None and geodesic((lat, lon), reversed(location_list[i])).km > 1.0: continue
 
@@ -305,33 +409,10 @@ class PhotoRender(object):
         for v in self.photo_location_dict.values():
             v.sort(key=lambda a: (a.is_video, a.dt))
 
-    def _read_photo_location_from_file(self, photo):
-        with open(photo, 'rb') as image_file:
-            my_image = exif.Image(image_file)
-
-        if not my_image.has_exif: return None
-
-        if my_image.get('datetime') is not None and my_image.get('offset_time') is not None:
-            dt_string = my_image.datetime + my_image.offset_time.replace(':', '')
-        elif my_image.get('gps_datestamp') is not None and my_image.get('gps_timestamp') is not None:
-            dt_string = my_image.gps_datestamp + ' ' + '%02d:%02d:%02d' % my_image.gps_timestamp + 'Z'
-        else:
-            return None
-
-        dt = datetime.strptime(dt_string, '%Y:%m:%d %H:%M:%S%z')
-
-        if my_image.get('gps_longitude') is None or my_image.get('gps_latitude') is None:
-            lon, lat = None, None
-        else:
-            lon = float(sum([x / (60 ** i) for i, x in enumerate(my_image.gps_longitude)]))
-            lat = float(sum([x / (60 ** i) for i, x in enumerate(my_image.gps_latitude)]))
-
-        return dt, lon, lat
-
-
 if __name__ == '__main__':
     import loading
-    timestamp_list, location_list = loading.load_gps_data(['./tuanpohu.gpx'])
+    points, _, tz = loading.load_gps_data(['./tuanpohu.gpx'])
+    timestamp_list, location_list = points.timestamps(tz), points.positions()
 
     photo_render = PhotoRender('p.txt', timestamp_list, location_list)
     photo_render.debug()
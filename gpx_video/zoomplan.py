@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## the zoom of the map picked by what it costs: for every candidate zoom the map image size,
+## its tiles, the peak memory while rendering it and the pan speed/cost of a frame are estimated
+## from the route, the most detailed zoom within the limits is used.
+
+import sys
+import os
+
+import math
+import pathlib
+import importlib.util
+
+from collections import namedtuple
+
+
+ZOOMS = range(17, 9, -1)
+TILE_SIZE = 256
+
+# the rgba map, the rgb tiles composed into it and the zoomed out pyramid(1/3) are alive at once
+MEM_FACTOR = 2.5
+# bytes a frame crop/scale + tobytes copies per ms
+COPY_BYTES_PER_MS = 2e6
+# the viewport pans at most this many windows a second
+MAX_WINDOWS_PER_SEC = 1.0
+
+Limits = namedtuple('Limits', ['max_mem', 'max_tiles', 'fps', 'max_zoom_out', 'heading_up'], defaults=(None, 4000, 30, 1.0, False))
+ZoomPlan = namedtuple('ZoomPlan', ['zoom', 'map_size', 'tiles', 'peak_bytes', 'pan_px', 'frame_ms', 'over'])
+
+
+def load_tile_planner():
+    """ source/geo_to_tile_num.py, it is a script dir and no package """
+    spec = importlib.util.spec_from_file_location('geo_to_tile_num', pathlib.Path(__file__).resolve().parent / 'source/geo_to_tile_num.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def total_memory():
+    """ bytes of the physical memory, None when unknown """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def plan_zooms(positions, video_size, limits=Limits(), zooms=ZOOMS):
+    """ the estimate of every zoom, most detailed first; over lists the limits it breaks """
+    pixels = load_tile_planner().deg2pixel(positions, 0)
+    x, y = zip(*pixels)
+    width, height = max(x) - min(x), max(y) - min(y)
+    length = sum(math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(pixels, pixels[1:]))
+
+    max_mem = limits.max_mem if limits.max_mem else (total_memory() or 0) / 2
+    window = video_size[0] * video_size[1] * 4 * limits.max_zoom_out ** 2
+
+    plans = []
+    for zoom in zooms:
+        s = 2 ** zoom
+
+        # as init_map_object sizes it: the route and half a window around, or the turned window around it heading up
+        if limits.heading_up:
+            pad = 2 * (int(math.ceil(math.hypot(*video_size) / 2 * limits.max_zoom_out)) + 2)
+            map_size = (int(width * s) + pad, int(height * s) + pad)
+        else:
+            map_size = (max(video_size[0], int(width * s) + video_size[0] // 2), max(video_size[1], int(height * s) + video_size[1] // 2))
+        tiles = (math.ceil(map_size[0] / TILE_SIZE) + 1) * (math.ceil(map_size[1] / TILE_SIZE) + 1)
+        peak = map_size[0] * map_size[1] * 4 * MEM_FACTOR
+
+        pan = length * s / max(1, len(positions))
+        frame_ms = 2 * window / COPY_BYTES_PER_MS
+
+        over = []
+        if max_mem and peak > max_mem: over.append('memory')
+        if limits.max_tiles and tiles > limits.max_tiles: over.append('tiles')
+        if pan * limits.fps > min(video_size) * MAX_WINDOWS_PER_SEC: over.append('pan')
+
+        plans.append(ZoomPlan(zoom, map_size, tiles, peak, pan, frame_ms, tuple(over)))
+
+    return plans
+
+
+def print_plans(plans, chosen):
+    for p in plans:
+        print('zoom %2d: map %6d x %-6d %6d tiles, peak %7.1f MB, pan %5.1f px/frame, frame %4.1f ms %s%s'
+              % (p.zoom, p.map_size[0], p.map_size[1], p.tiles, p.peak_bytes / 1e6, p.pan_px, p.frame_ms,
+                 '<-' if p.zoom == chosen else '  ', ' over: ' + ', '.join(p.over) if p.over else ''))
+
+
+def choose_zoom(positions, video_size, limits=Limits(), zooms=ZOOMS):
+    """ the most detailed zoom within the limits, the least detailed one when none is """
+    plans = plan_zooms(positions, video_size, limits, zooms)
+
+    fit = [p for p in plans if not p.over]
+    chosen = fit[0] if fit else plans[-1]
+    if not fit: print('no zoom within the limits, use the smallest map', file=sys.stderr)
+
+    print_plans(plans, chosen.zoom)
+    return chosen.zoom
+
+
+def check_zoom(positions, video_size, zoom, limits=Limits()):
+    """ warn when the zoom given breaks the limits """
+    plan = plan_zooms(positions, video_size, limits, [zoom])[0]
+    if 'memory' in plan.over or 'tiles' in plan.over:
+        print('zoom %d is over the limits(%s): map %d x %d, %d tiles, peak %.1f MB'
+              % (zoom, ', '.join(plan.over), plan.map_size[0], plan.map_size[1], plan.tiles, plan.peak_bytes / 1e6), file=sys.stderr)
+    return plan